@@ -0,0 +1,253 @@
+import hashlib
+import os
+import pandas as pd
+from comment_lineage import merge_lineages
+from comment_output import load_comments
+
+# Labelled SATD comments and the columns the analysis uses
+SOURCE = "ssw_satd.csv"
+COLUMNS_TO_KEEP = [
+    "file_name",
+    "comment",
+    "project",
+    "category",
+    "scientific_category",
+    "introduced",
+    "removed",
+]
+
+# Projects of the introduction and removal trends; other projects count as CESM
+PROJECTS = [
+    "Astropy",
+    "Athena",
+    "Biopython",
+    "Elmer",
+    "Firedrake",
+    "GROMACS",
+    "Root",
+    "MOOSE",
+    "CESM",
+]
+
+# Columns of the labelled comments under the names of the mined ones
+MINED_COLUMNS = {
+    "file_name": "File Path",
+    "comment": "Comment",
+    "introduced": "Introduced",
+    "removed": "Removed",
+}
+
+# Bump when the preparation changes, so that cached frames are rebuilt
+PREPARATION_VERSION = 1
+
+
+def prepare_comments(df):
+    """
+    Return the analysis columns of the labelled comments, cleaned once. Debt
+    categories are lower case and comma separated without spaces around the
+    commas, scientific categories lose their quotes, and project and categories
+    are categorical columns.
+    """
+    df = df[COLUMNS_TO_KEEP].copy()
+    scientific_category = df["scientific_category"].str.replace('"', "")
+    df["scientific_category"] = scientific_category.replace(
+        "scientific findings", "new scientific findings"
+    )
+    # "code debt, on hold debt" and "codedebt,onholddebt" are the same categories
+    category = df["category"].str.lower().str.replace(r"\s+", "", regex=True)
+    category = category.str.replace("debt", " debt").str.replace("hold", " hold")
+    df["category"] = category.str.replace(",", ", ").str.strip()
+    for column in ("project", "category", "scientific_category"):
+        df[column] = df[column].astype("category")
+    return df
+
+
+def explode_categories(comments):
+    """
+    Return one row per comment and debt category, without uncategorised
+    comments, with a categorical category column.
+    """
+    exploded = comments.dropna(subset=["category"])
+    exploded = exploded.assign(
+        category=exploded["category"].astype(str).str.split(", ")
+    ).explode("category")
+    exploded["category"] = exploded["category"].astype("category")
+    return exploded
+
+
+# Function to turn a categorical index into one of the plain category labels
+def plain_labels(index):
+    if isinstance(index, pd.CategoricalIndex):
+        return index.astype(index.categories.dtype)
+    return index
+
+
+# Function to count rows by some columns into a frame with the last one as columns
+def count_table(df, columns):
+    counts = df.groupby(columns, observed=True).size().unstack(fill_value=0)
+    # Plain labels, so that the tables index like the notebook's original ones
+    counts.columns = plain_labels(counts.columns)
+    if isinstance(counts.index, pd.MultiIndex):
+        counts.index = counts.index.set_levels(
+            [plain_labels(level) for level in counts.index.levels]
+        )
+    else:
+        counts.index = plain_labels(counts.index)
+    return counts
+
+
+def build_comments(data):
+    comments = load_comments(data.source)
+    if data.lineage:
+        comments = merge_lineages(
+            comments.rename(columns=MINED_COLUMNS), pd.read_csv(data.lineage)
+        )
+        comments = comments.rename(columns={v: k for k, v in MINED_COLUMNS.items()})
+    return prepare_comments(comments)
+
+
+def build_exploded(data):
+    return explode_categories(data.comments)
+
+
+def build_category_counts(data):
+    return count_table(data.exploded, ["project", "category"])
+
+
+def build_category_percentages(data):
+    counts = data.category_counts
+    return counts.div(counts.sum(axis=1), axis=0) * 100
+
+
+def build_scientific_category_counts(data):
+    return count_table(data.comments, ["project", "scientific_category"])
+
+
+def build_timeline(data):
+    """
+    Return the yearly introductions and removals per project and debt category,
+    each normalised by the project's total of the category, stacked with a
+    leading "event" level.
+    """
+    exploded = data.exploded.copy()
+    exploded["project"] = exploded["project"].astype(str)
+    exploded.loc[~exploded["project"].isin(PROJECTS), "project"] = "CESM"
+    exploded["Introduced_Year"] = exploded["introduced"].dt.year
+    exploded["Removed_Year"] = exploded["removed"].dt.year
+    exploded = exploded.dropna(subset=["Introduced_Year"])
+    exploded["Introduced_Year"] = exploded["Introduced_Year"].astype(int)
+
+    totals = count_table(exploded, ["project", "category"])
+    introduced = count_table(exploded, ["Introduced_Year", "project", "category"])
+    introduced = introduced.reindex(columns=totals.columns, fill_value=0)
+
+    removed = exploded.dropna(subset=["Removed_Year"])
+    removed = removed.assign(Removed_Year=removed["Removed_Year"].astype(int))
+    removed = count_table(removed, ["Removed_Year", "project", "category"])
+    removed = removed.reindex(columns=totals.columns, fill_value=0)
+
+    return pd.concat(
+        {
+            "introduced": introduced.div(totals, axis=1, level=1),
+            "removed": removed.div(totals, axis=1, level=1),
+        },
+        names=["event"],
+    )
+
+
+def build_addressed_percentages(data):
+    """
+    Return the percentages of each scientific category that were removed
+    (addressed) and that are still present (unaddressed).
+    """
+    comments = data.comments.dropna(subset=["category"])
+    scientific_category = comments["scientific_category"]
+    scientific_category = scientific_category.astype(
+        scientific_category.cat.categories.dtype
+    )
+    total_counts = scientific_category.value_counts()
+    removed = comments["removed"].notna()
+    return pd.DataFrame(
+        {
+            "addressed": scientific_category[removed].value_counts()
+            / total_counts
+            * 100,
+            "unaddressed": scientific_category[~removed].value_counts()
+            / total_counts
+            * 100,
+        }
+    )
+
+
+# Frames the data layer prepares, with the function that builds each of them
+BUILDERS = {
+    "comments": build_comments,
+    "exploded": build_exploded,
+    "category_counts": build_category_counts,
+    "category_percentages": build_category_percentages,
+    "scientific_category_counts": build_scientific_category_counts,
+    "timeline": build_timeline,
+    "addressed_percentages": build_addressed_percentages,
+}
+
+
+class AnalysisData:
+    """
+    Prepared frames of the labelled SATD comments for analysis.ipynb.
+
+    Each frame is built on first use and pickled to `cache_dir` under the content
+    hash of the source file, so later sessions load it instead of re-reading and
+    re-cleaning the CSV. When the source changes, its hash changes and the
+    frames are rebuilt, replacing the stale cache files.
+
+    With `lineage`, the lineage edges written by `extract_git_log.py --lineage`,
+    each lineage of edited or moved comments is counted as one comment, see
+    `comment_lineage.merge_lineages`.
+    """
+
+    def __init__(self, source=SOURCE, cache_dir=".analysis_cache", lineage=None):
+        self.source = source
+        self.cache_dir = cache_dir
+        self.lineage = lineage
+        self.frames = {}
+        self._fingerprint = None
+
+    def fingerprint(self):
+        """
+        Return the hash of the source and lineage files and the preparation
+        version.
+        """
+        if self._fingerprint is None:
+            digest = hashlib.sha256(str(PREPARATION_VERSION).encode())
+            for file_name in filter(None, (self.source, self.lineage)):
+                with open(file_name, "rb") as file:
+                    for chunk in iter(lambda: file.read(1024**2), b""):
+                        digest.update(chunk)
+            self._fingerprint = digest.hexdigest()[:16]
+        return self._fingerprint
+
+    def frame(self, name):
+        """
+        Return a prepared frame, from memory, from the cache or built anew.
+        """
+        if name in self.frames:
+            return self.frames[name]
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        stem = f"{os.path.splitext(os.path.basename(self.source))[0]}-{name}-"
+        path = os.path.join(self.cache_dir, f"{stem}{self.fingerprint()}.pkl")
+        if os.path.exists(path):
+            frame = pd.read_pickle(path)
+        else:
+            frame = BUILDERS[name](self)
+            frame.to_pickle(path)
+            for file_name in os.listdir(self.cache_dir):
+                if file_name.startswith(stem) and file_name != os.path.basename(path):
+                    os.remove(os.path.join(self.cache_dir, file_name))
+        self.frames[name] = frame
+        return frame
+
+    def __getattr__(self, name):
+        if name in BUILDERS:
+            return self.frame(name)
+        raise AttributeError(name)
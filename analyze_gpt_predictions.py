@@ -1,8 +1,11 @@
 import os
 import json
+import argparse
+import openai
 import pandas as pd
 from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score
 from openai import OpenAI
+from response_cache import ResponseCache
 
 
 def initialize_openai_client():
@@ -14,27 +17,60 @@ def initialize_openai_client():
         raise ValueError("Please set the OPENAI_API_KEY environment variable")
 
 
-def retrieve_gpt_responses(response_id):
+# Columns of the table of failed responses
+ERROR_COLUMNS = ["Payload_Hash", "Error"]
+
+
+def retrieve_gpt_responses(
+    response_id, output_file="requests_output.jsonl", chunk_size=1024**2
+):
     """
-    Retrieve the GPT responses from the batch output file.
+    Stream the output file of a batch to disk in chunks, followed by its error
+    file if some requests failed.
     """
     client = OpenAI(organization="org-t0BfEZys25Afw0bMxsVMwPDD")
-    output_file_id = client.batches.retrieve(response_id).output_file_id
-    content = client.files.content(output_file_id)
+    batch = client.batches.retrieve(response_id)
 
-    with open("requests_output.jsonl", "wb") as file:
-        file.write(content.content)
+    with open(output_file, "wb") as file:
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id is None:
+                continue
+            with client.files.with_streaming_response.content(file_id) as content:
+                for chunk in content.iter_bytes(chunk_size):
+                    file.write(chunk)
 
 
-def load_jsonl_data(jsonl_file):
+def iter_batch_results(jsonl_file):
     """
-    Load data from a JSONL file.
+    Lazily parse a batch output file into (custom ID, content, error) triples,
+    where either the content or the error is None.
     """
-    data = []
-    with open(jsonl_file, "r") as file:
-        for line in file:
-            data.append(json.loads(line))
-    return data
+    with open(jsonl_file, "rb") as file:
+        for line_number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+                custom_id = item.get("custom_id")
+                error = item.get("error")
+                response = item.get("response") or {}
+            except (json.JSONDecodeError, AttributeError):
+                yield None, None, f"malformed output line {line_number}"
+                continue
+            if error:
+                message = error.get("message") if isinstance(error, dict) else error
+                yield custom_id, None, f"request failed: {message}"
+            elif response.get("status_code", 200) != 200:
+                yield custom_id, None, f"status code {response['status_code']}"
+            else:
+                try:
+                    content = response["body"]["choices"][0]["message"]["content"]
+                except (KeyError, IndexError, TypeError):
+                    content = None
+                if isinstance(content, str):
+                    yield custom_id, content, None
+                else:
+                    yield custom_id, None, "response without content"
 
 
 def parse_content(content):
@@ -48,36 +84,118 @@ def parse_content(content):
         return {}
 
 
-def update_dataframe_with_predictions(data, df):
+def cache_gpt_responses(jsonl_file, cache):
+    """
+    Stream the successful responses of a batch output file into the response
+    cache, keyed by payload hash, and return a table of the failed ones. Failed
+    requests are not cached, so they are submitted again.
+    """
+    errors = []
+
+    def responses():
+        for custom_id, content, error in iter_batch_results(jsonl_file):
+            if error is None:
+                yield custom_id, content
+            else:
+                errors.append((custom_id, error))
+
+    cache.save(responses())
+    return pd.DataFrame(errors, columns=ERROR_COLUMNS)
+
+
+def parse_predictions(contents):
     """
-    Update the DataFrame with GPT predictions.
+    Parse response contents, a Series indexed by payload hash, into a Series of
+    "yes"/"no" predictions and a table of the contents that hold none.
     """
-    for item in data:
-        custom_id = item["custom_id"]
-        content = parse_content(
-            item["response"]["body"]["choices"][0]["message"]["content"]
+    # Responses repeat a handful of contents, so each one is parsed once
+    prediction_of = {}
+    for content in contents.unique():
+        parsed = parse_content(content)
+        prediction_of[content] = (
+            parsed.get("impacts_science") if isinstance(parsed, dict) else None
         )
-        if custom_id in df["Custom_ID"].values:
-            df.loc[df["Custom_ID"] == custom_id, "gpt_prediction"] = (
-                json.dumps(content["impacts_science"]) if content else None
-            )
-        else:
-            print("Custom_ID not found in DataFrame.")
+    values = contents.map(prediction_of).astype(object)
+    valid = values.isin(["yes", "no"])
+    invalid = values[~valid]
+    errors = pd.DataFrame(
+        {
+            "Payload_Hash": invalid.index,
+            "Error": [
+                (
+                    "no prediction in content"
+                    if value is None
+                    else f"unexpected value {value!r}"
+                )
+                for value in invalid
+            ],
+        },
+        columns=ERROR_COLUMNS,
+    )
+    return values[valid].astype(str), errors
 
-    df["gpt_prediction"] = df["gpt_prediction"].str.replace('"', "")
-    df.to_csv("ctsm_issues_labelled.csv", index=False)
 
+def update_dataframe_with_predictions(
+    contents, df, output_file="ctsm_issues_labelled.csv"
+):
+    """
+    Join the GPT predictions of the cached response contents to the issues by
+    payload hash and save them to the output file. Return the labelled DataFrame
+    and a table of the payloads whose response is missing or holds no prediction.
+    """
+    contents = pd.Series(contents, dtype=object)
+    predictions, errors = parse_predictions(contents)
+    df = df.drop(columns="gpt_prediction", errors="ignore").merge(
+        predictions.rename("gpt_prediction"),
+        left_on="Payload_Hash",
+        right_index=True,
+        how="left",
+        validate="many_to_one",
+    )
+    hashes = df["Payload_Hash"].dropna()
+    missing = hashes[~hashes.isin(contents.index)].unique()
+    errors = pd.concat(
+        [errors, pd.DataFrame({"Payload_Hash": missing, "Error": "no response"})],
+        ignore_index=True,
+    )
+
+    df.to_csv(output_file, index=False)
+    return df, errors
 
-def calculate_metrics(df):
+
+def join_manifest(df, manifest):
     """
-    Calculate and print accuracy, precision, recall, and F1 score.
+    Add the payload hash each issue was requested with, and its pre-screen label
+    if any, from the manifest written by send_gpt_request.py, joined on the
+    issue number. The hashes are not recomputed, as compaction depends on the
+    token budget and tokenizer of the environment the requests were built in.
+    Raises ValueError if none of the issues is in the manifest.
     """
-    accuracy = accuracy_score(df["impacts_science"], df["gpt_prediction"])
-    precision = precision_score(
-        df["impacts_science"], df["gpt_prediction"], pos_label="yes"
+    columns = ["Payload_Hash", "prescreen_label"]
+    columns = ["number"] + [column for column in columns if column in manifest]
+    df = df.drop(columns=columns[1:], errors="ignore").merge(
+        manifest[columns].drop_duplicates("number"),
+        on="number",
+        how="left",
+        validate="many_to_one",
     )
-    recall = recall_score(df["impacts_science"], df["gpt_prediction"], pos_label="yes")
-    f1 = f1_score(df["impacts_science"], df["gpt_prediction"], pos_label="yes")
+    unknown = df["Payload_Hash"].isna()
+    if unknown.all():
+        raise ValueError("None of the issues is in the requests manifest")
+    if unknown.any():
+        print(f"{unknown.sum()} issues are not in the requests manifest")
+    return df
+
+
+def calculate_metrics(df, prediction_column="gpt_prediction"):
+    """
+    Calculate and print accuracy, precision, recall, and F1 score.
+    """
+    predictions = df[prediction_column]
+    accuracy = accuracy_score(df["impacts_science"], predictions)
+    precision = precision_score(df["impacts_science"], predictions, pos_label="yes")
+    recall = recall_score(df["impacts_science"], predictions, pos_label="yes")
+    f1 = f1_score(df["impacts_science"], predictions, pos_label="yes")
 
     print(f"Accuracy: {accuracy:.2f}")
     print(f"Precision: {precision:.2f}")
@@ -86,18 +204,66 @@ def calculate_metrics(df):
 
 
 def main():
-    initialize_openai_client()
+    parser = argparse.ArgumentParser(description="Collect and check GPT labels")
+    parser.add_argument(
+        "--issues",
+        default="filtered_df.csv",
+        help="issues with manual impacts_science labels",
+    )
+    parser.add_argument(
+        "--batch-ids",
+        default="batch_ids.txt",
+        help="IDs of the batches submitted by send_gpt_request.py",
+    )
+    parser.add_argument(
+        "--results",
+        nargs="+",
+        help="batch output files to ingest instead of retrieving the batches",
+    )
+    parser.add_argument(
+        "--manifest",
+        default="requests_manifest.csv",
+        help="issues with the payload hashes send_gpt_request.py requested",
+    )
+    parser.add_argument("--cache", default="gpt_responses.sqlite")
+    parser.add_argument("--output", default="ctsm_issues_labelled.csv")
+    parser.add_argument("--errors", default="gpt_errors.csv")
+    args = parser.parse_args()
+
+    cache = ResponseCache(args.cache)
+    errors = []
+    if args.results is not None:
+        for jsonl_file in args.results:
+            errors.append(cache_gpt_responses(jsonl_file, cache))
+    else:
+        initialize_openai_client()
+        with open(args.batch_ids) as file:
+            response_ids = file.read().split()
+        for response_id in response_ids:
+            retrieve_gpt_responses(response_id)
+            errors.append(cache_gpt_responses("requests_output.jsonl", cache))
 
-    response_id = "get_response_id"  # replace with your actual response ID
-    retrieve_gpt_responses(response_id)
+    # Issues with identical payloads share the response to one request
+    df = join_manifest(pd.read_csv(args.issues), pd.read_csv(args.manifest))
 
-    data = load_jsonl_data("requests_output.jsonl")
+    df, label_errors = update_dataframe_with_predictions(
+        cache.contents(df["Payload_Hash"].dropna()), df, args.output
+    )
+    cache.close()
 
-    # Assuming 'filtered_df' is available. Load it if necessary.
-    df = pd.read_csv("filtered_df.csv")
+    # Failures that a later response fixed are not errors
+    errors = pd.concat(errors + [label_errors], ignore_index=True)
+    labelled = df.loc[df["gpt_prediction"].notna(), "Payload_Hash"]
+    errors = errors[~errors["Payload_Hash"].isin(labelled)]
+    errors.to_csv(args.errors, index=False)
+    print(f"{len(errors)} failed or missing responses saved to {args.errors}")
 
-    update_dataframe_with_predictions(data, df)
-    calculate_metrics(df)
+    calculate_metrics(df.dropna(subset=["gpt_prediction"]))
+    if "prescreen_label" in df:
+        # Issues labelled by the pre-screen were not sent to the LLM
+        df["prediction"] = df["prescreen_label"].fillna(df["gpt_prediction"])
+        print("Combined with the pre-screen:")
+        calculate_metrics(df.dropna(subset=["prediction"]), "prediction")
 
 
 if __name__ == "__main__":
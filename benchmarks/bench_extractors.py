@@ -0,0 +1,89 @@
+"""
+Throughput of the lexer-based comment extractors against the original
+line-based ones, per language.
+
+Usage: python benchmarks/bench_extractors.py <file or directory> [...] [--repeat N]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import extract_comments
+import legacy_extract_comments
+from extract_git_log import FILE_TYPES
+
+
+# Function to collect the contents of the source files under the given paths, per language
+def collect_sources(paths):
+    sources = {"python": [], "cpp": [], "fortran": []}
+    for path in paths:
+        if os.path.isfile(path):
+            file_paths = [path]
+        else:
+            file_paths = [
+                os.path.join(root, name)
+                for root, _, names in os.walk(path)
+                for name in names
+            ]
+        for file_path in file_paths:
+            files_type = FILE_TYPES.get(os.path.splitext(file_path)[1])
+            if files_type:
+                with open(file_path, "rb") as f:
+                    sources[files_type].append((file_path, f.read()))
+    return sources
+
+
+# Function to time one extractor over all sources, returning the best of `repeat` runs
+def time_extractor(extract, sources, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        # The extractors print decoding errors, keep them out of the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            for file_path, content in sources:
+                extract(file_path, content)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+# Function to count the files whose comments differ between the two extractors
+def count_differences(legacy_extract, extract, sources):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return sum(
+            Counter(legacy_extract(file_path, content))
+            != Counter(extract(file_path, content))
+            for file_path, content in sources
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    for files_type, sources in collect_sources(args.paths).items():
+        if not sources:
+            continue
+        name = f"extract_{files_type}_comments"
+        legacy_extract = getattr(legacy_extract_comments, name)
+        extract = getattr(extract_comments, name)
+        megabytes = sum(len(content) for _, content in sources) / 1e6
+
+        legacy_time = time_extractor(legacy_extract, sources, args.repeat)
+        lexer_time = time_extractor(extract, sources, args.repeat)
+        differences = count_differences(legacy_extract, extract, sources)
+        print(
+            f"{files_type}: {len(sources)} files, {megabytes:.1f} MB | "
+            f"legacy {megabytes / legacy_time:.1f} MB/s | "
+            f"lexer {megabytes / lexer_time:.1f} MB/s | "
+            f"speedup {legacy_time / lexer_time:.2f}x | "
+            f"{differences} files with different comments"
+        )
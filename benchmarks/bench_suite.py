@@ -0,0 +1,270 @@
+"""
+Benchmark suite of the mining and filtering steps on a synthetic repository:
+file versions per second of each history mining mode, MB/s of each comment
+extractor, comments per second of SATD filtering, and the peak memory of each.
+
+Results are written as JSON and can be compared against a saved baseline.
+
+Usage: python benchmarks/bench_suite.py [--output results.json] [--baseline baseline.json]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+import pandas as pd
+import extract_comments
+import extract_git_log
+from comment_store import CommentStore
+from extract_git_log import FILE_TYPES
+from synthetic_repo import generate_repo
+
+
+class RowCollector:
+    """
+    Comment writer that keeps the mined rows in memory.
+    """
+
+    def __init__(self):
+        self.rows = []
+
+    def writerows(self, rows):
+        self.rows.extend(rows)
+
+
+# Function to count the versions of source files in the history of a repository
+def count_file_versions(repo_dir):
+    changed_paths = subprocess.run(
+        ["git", "log", "--format=", "--name-only", "HEAD"],
+        cwd=repo_dir,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split()
+    return sum(os.path.splitext(path)[1] in FILE_TYPES for path in changed_paths)
+
+
+# Function to mine a repository in one of the miner's modes and return its rows
+def mine(repo_dir, mode):
+    # The miner keeps its state in module globals, start each run afresh
+    extract_git_log.comment_store = CommentStore()
+    extract_git_log.error_details.clear()
+    extract_git_log.dirty_files.clear()
+    collector = RowCollector()
+    # Keep the progress bars out of the report
+    with contextlib.redirect_stderr(io.StringIO()):
+        if mode == "single_pass":
+            extract_git_log.analyze_git_history(repo_dir)
+            extract_git_log.comment_store.finish_all(collector)
+        else:
+            extract_git_log.analyze_git_directory(
+                repo_dir, None, collector, incremental=mode == "incremental"
+            )
+    return collector.rows
+
+
+def measure(run, repeat):
+    """
+    Return the best time of `repeat` runs of a function, and its peak memory in
+    MB from one more run under tracemalloc, which slows it down too much to be
+    timed at the same time. Memory allocated by subprocesses is not included.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak / 1e6
+
+
+def run_benchmarks(repo_dir, contents, repeat=3, filter_comments=200_000):
+    """
+    Run all benchmarks on a generated repository and return their results by
+    name, each with its throughput, unit, best time and peak memory.
+    """
+    results = {}
+
+    def record(name, amount, unit, run):
+        seconds, peak_memory = measure(run, repeat)
+        results[name] = {
+            "value": amount / seconds,
+            "unit": unit,
+            "seconds": seconds,
+            "peak_memory_mb": peak_memory,
+        }
+        print(f"{name}: {amount / seconds:,.1f} {unit} ({peak_memory:.1f} MB peak)")
+
+    file_versions = count_file_versions(repo_dir)
+    for mode in ("per_file", "incremental", "single_pass"):
+        record(
+            f"mine_{mode}",
+            file_versions,
+            "file-versions/s",
+            lambda: mine(repo_dir, mode),
+        )
+
+    for files_type in ("python", "cpp", "fortran"):
+        sources = [
+            (os.path.join(repo_dir, path), content)
+            for path, content in contents.items()
+            if FILE_TYPES.get(os.path.splitext(path)[1]) == files_type
+        ]
+        if not sources:
+            continue
+        extract = getattr(extract_comments, f"extract_{files_type}_comments")
+
+        def run_extractor():
+            # The extractors print decoding errors, keep them out of the report
+            with contextlib.redirect_stdout(io.StringIO()):
+                for file_path, content in sources:
+                    extract(file_path, content)
+
+        megabytes = sum(len(content) for _, content in sources) / 1e6
+        record(f"extract_{files_type}", megabytes, "MB/s", run_extractor)
+
+    # identify_satd reads its keyword list relative to the working directory
+    working_directory = os.getcwd()
+    os.chdir(PACKAGE_DIR)
+    try:
+        import identify_satd
+    finally:
+        os.chdir(working_directory)
+    rows = mine(repo_dir, "per_file")
+    comments = pd.DataFrame(
+        rows, columns=["File Path", "Comment", "Introduced", "Removed"]
+    )
+    # Repeat the mined comments up to the requested number
+    copies = -(-filter_comments // max(len(comments), 1))
+    comments = pd.concat([comments] * copies, ignore_index=True).head(filter_comments)
+    record(
+        "filter_satd",
+        len(comments),
+        "comments/s",
+        lambda: identify_satd.filter_chunk(comments),
+    )
+    return results
+
+
+# Function to describe the machine and code a benchmark ran on
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=PACKAGE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare_results(results, baseline, threshold=0.1):
+    """
+    Print each benchmark's change against a baseline and return the names of
+    those that regressed by more than `threshold`: throughput lower, or peak
+    memory higher, by that fraction. Memory growth under 1 MB is ignored, as
+    small peaks vary a lot between runs.
+    """
+    regressions = []
+    print(f"{'benchmark':<22}{'baseline':>14}{'current':>14}{'change':>9}{'memory':>9}")
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name:<22}{'-':>14}{result['value']:>14,.1f}")
+            continue
+        before = baseline[name]
+        change = result["value"] / before["value"] - 1
+        memory_change = (
+            result["peak_memory_mb"] / max(before["peak_memory_mb"], 1e-9) - 1
+        )
+        memory_growth = result["peak_memory_mb"] - before["peak_memory_mb"]
+        regressed = change < -threshold or (
+            memory_change > threshold and memory_growth > 1
+        )
+        if regressed:
+            regressions.append(name)
+        print(
+            f"{name:<22}{before['value']:>14,.1f}{result['value']:>14,.1f}"
+            f"{change:>+9.1%}{memory_change:>+9.1%}{'  REGRESSION' if regressed else ''}"
+        )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative slowdown or memory growth reported as a regression",
+    )
+    parser.add_argument("--commits", type=int, default=200)
+    parser.add_argument("--files", type=int, default=60)
+    parser.add_argument("--comment-density", type=float, default=0.25)
+    parser.add_argument("--files-per-commit", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--filter-comments", type=int, default=200_000)
+    args = parser.parse_args()
+
+    repo_parameters = {
+        "commits": args.commits,
+        "files": args.files,
+        "comment_density": args.comment_density,
+        "files_per_commit": args.files_per_commit,
+        "seed": args.seed,
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        repo_dir = os.path.join(directory, "repo")
+        contents = generate_repo(repo_dir, **repo_parameters)
+        results = run_benchmarks(repo_dir, contents, args.repeat, args.filter_comments)
+
+    report = {
+        "environment": environment(),
+        "parameters": {
+            **repo_parameters,
+            "repeat": args.repeat,
+            "filter_comments": args.filter_comments,
+        },
+        "results": results,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Results saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline["parameters"] != report["parameters"]:
+            print("Warning: the baseline was run with other parameters")
+        regressions = compare_results(results, baseline["results"], args.threshold)
+        if regressions:
+            sys.exit(1)
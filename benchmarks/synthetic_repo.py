@@ -0,0 +1,278 @@
+"""
+Generator of synthetic git repositories that look like scientific codes: MOOSE
+style C++ kernels, Elmer style Fortran 90 solvers and Python utilities, with
+scientific and self-admitted technical debt comments.
+
+The same parameters and seed always give the same repository, down to the
+commit hashes, so benchmark results of different runs are comparable.
+
+Usage: python benchmarks/synthetic_repo.py <directory> [--commits N] [--files N]
+"""
+
+import argparse
+import os
+import random
+import subprocess
+
+# Prose of ordinary comments, and debt phrases that the SATD keywords match
+SCIENCE_PHRASES = [
+    "Compute the residual contribution of the diffusion term at the quadrature point",
+    "Assemble the local stiffness matrix using the shape function gradients",
+    "Apply the Dirichlet boundary condition on the outer boundary",
+    "Update the temperature field with an implicit Euler step",
+    "Integrate the heat flux over the element face",
+    "Evaluate the Jacobian of the nonlinear residual",
+    "Conserve mass across the interface between the two subdomains",
+    "Interpolate the material properties to the integration points",
+    "Scale the time step by the CFL condition",
+    "Use the Gauss-Legendre rule of the element order",
+    "Convert from Kelvin to Celsius for the output",
+    "Normalise the eigenvectors before the orthogonalisation",
+    "Accumulate the contribution of the source term",
+    "Solve the linear system with the preconditioned Krylov solver",
+    "The viscosity follows an Arrhenius law in the temperature",
+]
+DEBT_PHRASES = [
+    "TODO: this is a hack until the mesh adaptivity supports it",
+    "FIXME: only works for linear elements",
+    "HACK: workaround for a PETSc bug in the block preconditioner",
+    "TODO remove once the old input syntax is deprecated",
+    "XXX: not very clear why this tolerance is needed",
+    "this is a temporary fix, the assumption of constant density is wrong",
+    "ugly, but the only solution without changing the interface",
+    "should we check the sign of the Jacobian here?",
+    "try to optimize this loop, it dominates the run time",
+    "kludge: the units are inconsistent with the rest of the module",
+]
+NAMES = [
+    "Diffusion",
+    "HeatConduction",
+    "Advection",
+    "NavierStokes",
+    "Elasticity",
+    "Porosity",
+    "Radiation",
+    "PhaseField",
+    "Darcy",
+    "Species",
+    "Coupled",
+    "Stabilized",
+]
+
+
+class SyntheticFile:
+    """
+    A source file as a list of units (functions or subroutines), each a list of
+    lines, so commits can edit units and comments in place.
+    """
+
+    def __init__(self, path, language, rng, comment_density, debt_share):
+        self.path = path
+        self.language = language
+        self.rng = rng
+        self.comment_density = comment_density
+        self.debt_share = debt_share
+        self.serial = 0
+        self.units = [self.unit() for _ in range(rng.randint(3, 12))]
+
+    def comment_text(self):
+        phrases = (
+            DEBT_PHRASES if self.rng.random() < self.debt_share else SCIENCE_PHRASES
+        )
+        return f"{self.rng.choice(phrases)} ({self.rng.randint(1, 999)})"
+
+    def comment(self, indent):
+        text = self.comment_text()
+        if self.language == "python":
+            return [f"{indent}# {text}"]
+        if self.language == "fortran":
+            return [f"{indent}! {text}"]
+        style = self.rng.random()
+        if style < 0.6:
+            return [f"{indent}// {text}"]
+        if style < 0.8:
+            return [f"{indent}/// {text}"]
+        return [f"{indent}/*", f"{indent} * {text}", f"{indent} */"]
+
+    def code_line(self, indent):
+        a, b = self.rng.sample("uvwxyzpqr", 2)
+        value = self.rng.randint(1, 99)
+        if self.language == "python":
+            return f"{indent}{a} = {b} * {value} + residual[{value % 7}]"
+        if self.language == "fortran":
+            return f"{indent}{a} = {b} * {value}.0_dp + Residual({value % 7 + 1})"
+        return f"{indent}{a} += _{b}[_qp] * {value}.0 * _grad_test[_i][_qp](0);"
+
+    def body(self, indent):
+        lines = []
+        for _ in range(self.rng.randint(4, 20)):
+            if self.rng.random() < self.comment_density:
+                lines.extend(self.comment(indent))
+            line = self.code_line(indent)
+            if self.rng.random() < self.comment_density / 4:
+                # Trailing comment on a line of code
+                marker = {"python": "#", "fortran": "!"}.get(self.language, "//")
+                line += f"  {marker} {self.comment_text()}"
+            lines.append(line)
+        return lines
+
+    def unit(self):
+        self.serial += 1
+        name = f"{self.rng.choice(NAMES)}{self.serial}"
+        if self.language == "python":
+            return (
+                [f"def compute_{name.lower()}(u, v, residual):"]
+                + self.body("    ")
+                + ["    return u", ""]
+            )
+        if self.language == "fortran":
+            return (
+                [f"SUBROUTINE {name}Solver( Model, Solver, dt, Transient )"]
+                + ["  USE DefUtils", "  IMPLICIT NONE"]
+                + self.body("  ")
+                + [f"END SUBROUTINE {name}Solver", ""]
+            )
+        return (
+            [f"Real {self.path_stem()}::compute{name}()", "{"]
+            + self.body("  ")
+            + ["  return 0.0;", "}", ""]
+        )
+
+    def path_stem(self):
+        return os.path.splitext(os.path.basename(self.path))[0]
+
+    def edit(self):
+        """
+        Apply a random edit: add a comment, rewrite a line, add a unit or remove
+        one.
+        """
+        choice = self.rng.random()
+        if choice < 0.15 or not self.units:
+            self.units.insert(self.rng.randint(0, len(self.units)), self.unit())
+        elif choice < 0.25 and len(self.units) > 1:
+            del self.units[self.rng.randrange(len(self.units))]
+        else:
+            unit = self.rng.choice(self.units)
+            index = self.rng.randrange(len(unit))
+            indent = unit[index][: len(unit[index]) - len(unit[index].lstrip())]
+            if choice < 0.6:
+                unit[index : index + 1] = self.comment(indent or "  ") + [unit[index]]
+            else:
+                unit[index] = self.code_line(indent or "  ")
+
+    def content(self):
+        lines = [line for unit in self.units for line in unit]
+        if self.language == "cpp" and self.path.endswith(".h"):
+            lines = ["#pragma once", ""] + lines
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+# Function to pick the path and language of the n-th file of the repository
+def file_path(index, rng):
+    kind = rng.random()
+    name = f"{rng.choice(NAMES)}{index}"
+    if kind < 0.45:
+        return f"framework/src/kernels/{name}.cpp", "cpp"
+    if kind < 0.55:
+        return f"framework/include/kernels/{name}.h", "cpp"
+    if kind < 0.85:
+        return f"fem/src/modules/{name}Solver.F90", "fortran"
+    return f"python/utils/{name.lower()}.py", "python"
+
+
+def generate_repo(
+    directory,
+    commits=200,
+    files=60,
+    comment_density=0.25,
+    debt_share=0.1,
+    files_per_commit=4,
+    new_file_rate=0.1,
+    seed=0,
+):
+    """
+    Create a git repository in `directory` with `commits` commits. The first
+    commit adds part of the `files` files, later ones edit `files_per_commit`
+    files each and add the remaining files one at a time. `comment_density` is
+    the chance of a comment before each line of code, and `debt_share` the
+    share of comments that admit debt. Returns the final content of every file.
+    """
+    rng = random.Random(seed)
+    sources = {}
+    initial_files = max(1, files - int(commits * new_file_rate))
+
+    def add_file():
+        path, language = file_path(len(sources), rng)
+        sources[path] = SyntheticFile(path, language, rng, comment_density, debt_share)
+        return path
+
+    chunks = []
+    timestamp = 1_420_070_400  # 2015-01-01
+    for number in range(commits):
+        if number == 0:
+            changed = {add_file() for _ in range(initial_files)}
+        else:
+            changed = set(
+                rng.sample(sorted(sources), min(files_per_commit, len(sources)))
+            )
+            # Edits share one random generator, so apply them in a fixed order
+            for path in sorted(changed):
+                sources[path].edit()
+            if len(sources) < files and rng.random() < new_file_rate:
+                changed.add(add_file())
+        timestamp += rng.randint(600, 3 * 86_400)
+        message = f"Commit {number}".encode()
+        chunks.append(
+            b"commit refs/heads/main\n"
+            + f"mark :{number + 1}\n".encode()
+            + f"author Bench <bench@example.com> {timestamp} +0000\n".encode()
+            + f"committer Bench <bench@example.com> {timestamp} +0000\n".encode()
+            + f"data {len(message)}\n".encode()
+            + message
+            + b"\n"
+            + (f"from :{number}\n".encode() if number else b"")
+        )
+        for path in sorted(changed):
+            content = sources[path].content()
+            chunks.append(
+                f"M 100644 inline {path}\ndata {len(content)}\n".encode()
+                + content
+                + b"\n"
+            )
+        chunks.append(b"\n")
+
+    os.makedirs(directory, exist_ok=True)
+    subprocess.run(["git", "init", "-q", directory], check=True)
+    subprocess.run(
+        ["git", "fast-import", "--quiet"],
+        cwd=directory,
+        input=b"".join(chunks),
+        check=True,
+    )
+    subprocess.run(
+        ["git", "symbolic-ref", "HEAD", "refs/heads/main"], cwd=directory, check=True
+    )
+    subprocess.run(["git", "reset", "-q", "--hard"], cwd=directory, check=True)
+    return {path: source.content() for path, source in sources.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("directory")
+    parser.add_argument("--commits", type=int, default=200)
+    parser.add_argument("--files", type=int, default=60)
+    parser.add_argument("--comment-density", type=float, default=0.25)
+    parser.add_argument("--files-per-commit", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    contents = generate_repo(
+        args.directory,
+        args.commits,
+        args.files,
+        args.comment_density,
+        files_per_commit=args.files_per_commit,
+        seed=args.seed,
+    )
+    megabytes = sum(len(content) for content in contents.values()) / 1e6
+    print(f"{len(contents)} files, {megabytes:.1f} MB at HEAD, {args.commits} commits")
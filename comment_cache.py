@@ -0,0 +1,216 @@
+import json
+import os
+import sqlite3
+import zlib
+
+
+class CommentCache:
+    """
+    Persistent, content-addressed cache of extracted comments.
+
+    Entries are keyed by (blob SHA, file type, extractor version), so identical blobs
+    seen through reverts, merges, vendored copies or other repositories are parsed
+    only once. The cache is capped at `max_bytes` of stored comment data and evicts
+    the least recently used entries when the cap is exceeded.
+
+    A `read_only` cache, as used by the workers of the parallel miner, never
+    writes to the database. It keeps the comments it extracts and the entries it
+    uses in memory until `drain` hands them over to a writable cache's `merge`,
+    so that a single process writes to the database.
+    """
+
+    def __init__(
+        self, db_path, extractor_version, max_bytes=2 * 1024**3, read_only=False
+    ):
+        self.db_path = db_path
+        self.extractor_version = extractor_version
+        self.max_bytes = max_bytes
+        self.read_only = read_only
+        self.hits = 0
+        self.misses = 0
+        self._pending_writes = 0
+        # Entries extracted and entries used by a read-only cache since its last drain
+        self.new_entries = {}
+        self.used_entries = []
+
+        if read_only:
+            self.connection = sqlite3.connect(
+                f"file:{db_path}?mode=ro", uri=True, timeout=60
+            )
+            self.total_size = self.clock = 0
+            return
+
+        self.connection = sqlite3.connect(db_path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS comments (
+                blob_sha TEXT NOT NULL,
+                files_type TEXT NOT NULL,
+                extractor_version INTEGER NOT NULL,
+                payload BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_used INTEGER NOT NULL,
+                PRIMARY KEY (blob_sha, files_type, extractor_version)
+            )
+            """)
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS comments_last_used ON comments (last_used)"
+        )
+        self.connection.commit()
+
+        total_size, clock = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0), COALESCE(MAX(last_used), 0) FROM comments"
+        ).fetchone()
+        self.total_size = total_size
+        self.clock = clock
+
+    def _tick(self):
+        self.clock += 1
+        return self.clock
+
+    def _maybe_commit(self):
+        self._pending_writes += 1
+        if self._pending_writes >= 1000:
+            self.connection.commit()
+            self._pending_writes = 0
+
+    def get(self, blob_sha, files_type):
+        """
+        Return the cached comments of a blob, or None if the blob has not been seen.
+        """
+        if self.read_only and (blob_sha, files_type) in self.new_entries:
+            self.hits += 1
+            return list(self.new_entries[blob_sha, files_type])
+        row = self.connection.execute(
+            "SELECT payload FROM comments "
+            "WHERE blob_sha = ? AND files_type = ? AND extractor_version = ?",
+            (blob_sha, files_type, self.extractor_version),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        if self.read_only:
+            self.used_entries.append((blob_sha, files_type))
+        else:
+            self.touch(blob_sha, files_type)
+        return json.loads(zlib.decompress(row[0]))
+
+    def touch(self, blob_sha, files_type):
+        """
+        Mark an entry as the most recently used one.
+        """
+        self.connection.execute(
+            "UPDATE comments SET last_used = ? "
+            "WHERE blob_sha = ? AND files_type = ? AND extractor_version = ?",
+            (self._tick(), blob_sha, files_type, self.extractor_version),
+        )
+        self._maybe_commit()
+
+    def put(self, blob_sha, files_type, comments):
+        """
+        Store the comments extracted from a blob, evicting old entries if needed.
+        """
+        if self.read_only:
+            self.new_entries[blob_sha, files_type] = list(comments)
+            return
+        payload = zlib.compress(json.dumps(list(dict.fromkeys(comments))).encode())
+        # A blob stored again replaces its entry, whose size no longer counts
+        replaced = self.connection.execute(
+            "SELECT size FROM comments "
+            "WHERE blob_sha = ? AND files_type = ? AND extractor_version = ?",
+            (blob_sha, files_type, self.extractor_version),
+        ).fetchone()
+        self.connection.execute(
+            "INSERT OR REPLACE INTO comments VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                blob_sha,
+                files_type,
+                self.extractor_version,
+                payload,
+                len(payload),
+                self._tick(),
+            ),
+        )
+        self.total_size += len(payload) - (replaced[0] if replaced else 0)
+        self._maybe_commit()
+
+        if self.total_size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """
+        Drop least recently used entries until the cache is below 90% of its cap.
+        """
+        self.connection.commit()
+        # Other processes may share the database, so start from the real size
+        self.total_size = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM comments"
+        ).fetchone()[0]
+        target = int(self.max_bytes * 0.9)
+        cursor = self.connection.execute(
+            "SELECT rowid, size FROM comments ORDER BY last_used"
+        )
+        evicted = []
+        for rowid, size in cursor:
+            if self.total_size <= target:
+                break
+            evicted.append((rowid,))
+            self.total_size -= size
+        self.connection.executemany("DELETE FROM comments WHERE rowid = ?", evicted)
+        self.connection.commit()
+
+    def drain(self):
+        """
+        Return the entries a read-only cache extracted and used since the last
+        call, and forget them.
+        """
+        entries = (self.new_entries, self.used_entries)
+        self.new_entries = {}
+        self.used_entries = []
+        return entries
+
+    def merge(self, entries):
+        """
+        Write the entries drained from a read-only cache. Writes are committed in
+        batches like those of `put` and `get`.
+        """
+        new_entries, used_entries = entries
+        for (blob_sha, files_type), comments in new_entries.items():
+            self.put(blob_sha, files_type, comments)
+        for blob_sha, files_type in used_entries:
+            self.touch(blob_sha, files_type)
+
+    def flush(self):
+        """
+        Commit pending writes so that other processes sharing the cache see them.
+        """
+        if self.read_only:
+            return
+        self.connection.commit()
+        self._pending_writes = 0
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def report(self):
+        """
+        Print the hit rate and size of the cache for the current run.
+        """
+        self.flush()
+        self.total_size = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM comments"
+        ).fetchone()[0]
+        print(
+            f"Comment cache {os.path.basename(self.db_path)}: "
+            f"{self.hits} hits, {self.misses} misses "
+            f"({self.hit_rate():.1%} hit rate), "
+            f"{self.total_size / 1024**2:.1f} MB stored"
+        )
+
+    def close(self):
+        self.flush()
+        self.connection.close()
@@ -0,0 +1,408 @@
+import re
+from collections import namedtuple
+
+# A comment as reported by the extractors, with the 1-based lines it spans
+CommentRecord = namedtuple("CommentRecord", ["text", "start_line", "end_line"])
+
+# A raw comment token: its kind ("line", "block" or "docstring"), its text without
+# delimiters, the lines it spans and whether only whitespace precedes it on its
+# first line. A "line" token is a run of line comments on consecutive lines, all
+# but the first of which are full-line comments; its text has one line per comment.
+# Spans that are not comments but cover several lines are reported as well, with
+# no text, so that the lines covered by a token are known: "string" for multi-line
+# string literals and "unterminated" for a docstring, block comment or C++ raw
+# string that runs to the end of the text. The grouping functions ignore them.
+Token = namedtuple("Token", ["kind", "text", "start_line", "end_line", "full_line"])
+
+# Tokens matched from their opening delimiter. A single-line string literal ends
+# at an unescaped quote or, if unterminated, at the end of its line. A run of line
+# comments goes on while the next line holds nothing but a comment. A lone
+# backslash at the very end lets a triple-quoted string reach `\Z` without
+# backtracking.
+STRING_LITERAL = {
+    '"': re.compile(r'"(?:[^"\\\n]+|\\.)*"?', re.DOTALL),
+    "'": re.compile(r"'(?:[^'\\\n]+|\\.)*'?", re.DOTALL),
+}
+FORTRAN_STRING_LITERAL = {
+    '"': re.compile(r'"(?:[^"\n]+|"")*"?'),
+    "'": re.compile(r"'(?:[^'\n]+|'')*'?"),
+}
+PYTHON_TRIPLE_QUOTED = {
+    '"': re.compile(r'"""(?:[^"\\]+|\\.?|"(?!""))*(?:(""")|\Z)', re.DOTALL),
+    "'": re.compile(r"'''(?:[^'\\]+|\\.?|'(?!''))*(?:(''')|\Z)", re.DOTALL),
+}
+CPP_RAW_STRING_OPENING = re.compile(r'"([^()\\\s"]{0,16})\(')
+CPP_RAW_STRING_PREFIXES = ("R", "u8R", "uR", "UR", "LR")
+PYTHON_LINE_COMMENTS = re.compile(r"#[^\n]*(?:\n[^\S\n]*#[^\n]*)*")
+CPP_LINE_COMMENTS = re.compile(r"//[^\n]*(?:\n[^\S\n]*//[^\n]*)*")
+FORTRAN_LINE_COMMENTS = re.compile(r"![^\n]*(?:\n[^\S\n]*![^\n]*)*")
+
+
+def clean_comment(comment):
+    return comment.replace("\n", " ").strip()
+
+
+class LineCounter:
+    """
+    Map increasing offsets of a text to line numbers without splitting it.
+    """
+
+    def __init__(self, text, first_line=1):
+        self.text = text
+        self.position = 0
+        self.line = first_line
+
+    def line_at(self, position):
+        self.line += self.text.count("\n", self.position, position)
+        self.position = position
+        return self.line
+
+    def is_line_start(self, position):
+        line_start = self.text.rfind("\n", 0, position) + 1
+        return not self.text[line_start:position].strip()
+
+
+# Function to build the token of a run of line comments starting at `start`
+def line_token(lines, run, start, delimiter_length):
+    start_line = lines.line_at(start)
+    full_line = lines.is_line_start(start)
+    if "\n" not in run:
+        return Token("line", run[delimiter_length:], start_line, start_line, full_line)
+    texts = [piece.lstrip()[delimiter_length:] for piece in run.split("\n")]
+    return Token(
+        "line", "\n".join(texts), start_line, start_line + len(texts) - 1, full_line
+    )
+
+
+# Function to build the token of a string literal spanning several lines
+def string_token(lines, start, end):
+    return Token("string", "", lines.line_at(start), lines.line_at(end), False)
+
+
+# Function to build the token of a construct running from `start` to the end of the text
+def unterminated_token(lines, start):
+    start_line = lines.line_at(start)
+    return Token("unterminated", "", start_line, lines.line_at(len(lines.text)), False)
+
+
+# Function to return the identifier characters directly before a position
+def preceding_word(text, position):
+    start = position
+    while start > 0 and (text[start - 1].isalnum() or text[start - 1] == "_"):
+        start -= 1
+    return text[start:position]
+
+
+# The lexers below are state machines over the source text. In code they jump to
+# the next character that can change the state, found with `str.find`; a string
+# literal or comment starting there is consumed in one step, so `#`, `//` or `!`
+# inside a literal are never taken for a comment. The position of the next
+# occurrence of each such character is kept until the lexer moves past it.
+
+
+def lex_python(text, first_line=1):
+    """
+    Yield the `#` comments and triple-quoted strings of Python source.
+    """
+    lines = LineCounter(text, first_line)
+    find, rfind, end_of_text = text.find, text.rfind, len(text)
+    next_hash = next_double = next_single = -1
+    next_triple_double = next_triple_single = next_continuation = next_token = -1
+    position = 0
+    while True:
+        if next_hash < position:
+            next_hash = find("#", position) % (end_of_text + 1)
+        if next_triple_double < position:
+            next_triple_double = find('"""', position) % (end_of_text + 1)
+        if next_triple_single < position:
+            next_triple_single = find("'''", position) % (end_of_text + 1)
+        if next_token < position:
+            next_token = min(next_hash, next_triple_double, next_triple_single)
+            token_line = rfind("\n", 0, next_token) + 1
+        if next_continuation < position:
+            next_continuation = find("\\\n", position) % (end_of_text + 1)
+        # Lines before the one of the next comment or triple-quoted string only
+        # hold code and single-line literals, which leave the lexer in code at the
+        # next line, so they are skipped unless a backslash continues a line
+        if position < token_line <= next_continuation:
+            position = token_line
+        if next_double < position:
+            next_double = find('"', position) % (end_of_text + 1)
+        if next_single < position:
+            next_single = find("'", position) % (end_of_text + 1)
+        position = min(next_hash, next_double, next_single)
+        if position == end_of_text:
+            return
+
+        character = text[position]
+        if character == "#":
+            run = PYTHON_LINE_COMMENTS.match(text, position).group()
+            yield line_token(lines, run, position, 1)
+            position += len(run)
+        elif text.startswith(character * 3, position):
+            match = PYTHON_TRIPLE_QUOTED[character].match(text, position)
+            if match.group(1) is None:
+                # An unterminated docstring is not reported as one
+                yield unterminated_token(lines, position)
+                return
+            end = match.start(1)
+            yield Token(
+                "docstring",
+                text[position + 3 : end],
+                lines.line_at(position),
+                lines.line_at(end),
+                lines.is_line_start(position),
+            )
+            position = match.end()
+        else:
+            end = STRING_LITERAL[character].match(text, position).end()
+            if find("\n", position, end) != -1:
+                yield string_token(lines, position, end)
+            position = end
+
+
+def lex_cpp(text, first_line=1):
+    """
+    Yield the `//` and `/* */` comments of C/C++ source, skipping string, raw
+    string and character literals as well as digit separators.
+    """
+    lines = LineCounter(text, first_line)
+    find, end_of_text = text.find, len(text)
+    next_slash = next_double = next_single = -1
+    position = 0
+    while True:
+        if next_slash < position:
+            next_slash = find("/", position) % (end_of_text + 1)
+        if next_double < position:
+            next_double = find('"', position) % (end_of_text + 1)
+        if next_single < position:
+            next_single = find("'", position) % (end_of_text + 1)
+        position = min(next_slash, next_double, next_single)
+        if position == end_of_text:
+            return
+
+        character = text[position]
+        if character == "/":
+            if text.startswith("/", position + 1):
+                run = CPP_LINE_COMMENTS.match(text, position).group()
+                yield line_token(lines, run, position, 2)
+                position += len(run)
+            elif text.startswith("*", position + 1):
+                end = find("*/", position + 2)
+                if end == -1:
+                    # An unterminated block comment is not reported as one
+                    yield unterminated_token(lines, position)
+                    return
+                yield Token(
+                    "block",
+                    text[position + 2 : end],
+                    lines.line_at(position),
+                    lines.line_at(end),
+                    lines.is_line_start(position),
+                )
+                position = end + 2
+            else:
+                position += 1
+        elif character == '"':
+            raw_string = None
+            if text.startswith("R", position - 1):
+                if preceding_word(text, position) in CPP_RAW_STRING_PREFIXES:
+                    raw_string = CPP_RAW_STRING_OPENING.match(text, position)
+            if raw_string:
+                closing = ")" + raw_string.group(1) + '"'
+                end = find(closing, raw_string.end())
+                if end == -1:
+                    # Like a block comment, an unterminated raw string runs to the
+                    # end of the text
+                    yield unterminated_token(lines, position)
+                    return
+                end += len(closing)
+            else:
+                end = STRING_LITERAL['"'].match(text, position).end()
+            if find("\n", position, end) != -1:
+                yield string_token(lines, position, end)
+            position = end
+        elif preceding_word(text, position)[:1].isdigit():
+            # Digit separator, e.g. 1'000'000
+            position += 1
+        else:
+            end = STRING_LITERAL["'"].match(text, position).end()
+            if find("\n", position, end) != -1:
+                yield string_token(lines, position, end)
+            position = end
+
+
+def lex_fortran(text, first_line=1):
+    """
+    Yield the `!` comments of free-form Fortran source, skipping string literals
+    (with doubled quotes as escapes). A literal ends at the end of its line.
+    """
+    lines = LineCounter(text, first_line)
+    find, end_of_text = text.find, len(text)
+    next_bang = next_double = next_single = -1
+    position = 0
+    while True:
+        if next_bang < position:
+            next_bang = find("!", position) % (end_of_text + 1)
+        if next_double < position:
+            next_double = find('"', position) % (end_of_text + 1)
+        if next_single < position:
+            next_single = find("'", position) % (end_of_text + 1)
+        position = min(next_bang, next_double, next_single)
+        if position == end_of_text:
+            return
+
+        character = text[position]
+        if character == "!":
+            run = FORTRAN_LINE_COMMENTS.match(text, position).group()
+            yield line_token(lines, run, position, 1)
+            position += len(run)
+        else:
+            position = FORTRAN_STRING_LITERAL[character].match(text, position).end()
+
+
+# The functions below group raw tokens into comments with the same rules as the
+# original line-based extractors: consecutive full-line comments form one comment,
+# and a code line with an inline comment does not end such a block.
+
+
+def group_python_tokens(tokens):
+    """
+    Yield the CommentRecords of a sequence of Python tokens.
+    """
+    block, block_start, block_end = [], 0, 0
+    for token in tokens:
+        if token.kind == "docstring":
+            docstring = " ".join(map(str.strip, token.text.split("\n")))
+            docstring = docstring.replace('"""', "").replace("'''", "").strip()
+            yield CommentRecord(docstring, token.start_line, token.end_line)
+            continue
+        if token.kind != "line":
+            continue
+
+        texts = token.text.split("\n")
+        line = token.start_line
+        if not token.full_line:
+            if block and line == block_end + 1:
+                block_end = line
+            yield CommentRecord(clean_comment(texts.pop(0).strip()), line, line)
+            line += 1
+        if texts:
+            if not block or line != block_end + 1:
+                if block:
+                    yield CommentRecord(
+                        clean_comment("\n".join(block)), block_start, block_end
+                    )
+                block, block_start = [], line
+            block.extend(piece.strip() for piece in texts)
+            block_end = token.end_line
+    if block:
+        yield CommentRecord(clean_comment("\n".join(block)), block_start, block_end)
+
+
+def group_cpp_tokens(tokens):
+    """
+    Yield the CommentRecords of a sequence of C/C++ tokens. As in the original
+    extractor, block comments that follow code on their first line are skipped.
+    """
+    block, block_start, block_end = [], 0, 0
+    for token in tokens:
+        if token.kind == "block":
+            if not token.full_line:
+                continue
+            if token.start_line == token.end_line:
+                comment = token.text.strip()
+            else:
+                comment = " ".join(map(str.strip, token.text.split("\n")))
+            yield CommentRecord(comment, token.start_line, token.end_line)
+            continue
+        if token.kind != "line":
+            continue
+
+        texts = token.text.split("\n")
+        line = token.start_line
+        if not token.full_line:
+            if block and line == block_end + 1:
+                block_end = line
+            yield CommentRecord(texts.pop(0).strip(), line, line)
+            line += 1
+        if texts:
+            if not block or line != block_end + 1:
+                if block:
+                    yield CommentRecord(" ".join(block), block_start, block_end)
+                block, block_start = [], line
+            block.extend(piece.strip() for piece in texts)
+            block_end = token.end_line
+    if block:
+        yield CommentRecord(" ".join(block), block_start, block_end)
+
+
+def group_fortran_tokens(tokens):
+    """
+    Yield the CommentRecords of a sequence of Fortran tokens. As in the original
+    extractor, a block of full-line comments directly followed by a line with an
+    inline comment keeps its line breaks.
+    """
+    block, block_start, block_end = [], 0, 0
+    for token in tokens:
+        texts = token.text.split("\n")
+        line = token.start_line
+        if block:
+            comment = "\n".join(block)
+            if not token.full_line and line == block_end + 1:
+                yield CommentRecord(comment, block_start, block_end)
+            else:
+                yield CommentRecord(clean_comment(comment), block_start, block_end)
+            block = []
+        if not token.full_line:
+            yield CommentRecord(clean_comment(texts.pop(0).strip()), line, line)
+            line += 1
+        if texts:
+            block, block_start = [piece.strip() for piece in texts], line
+            block_end = token.end_line
+    if block:
+        yield CommentRecord(clean_comment("\n".join(block)), block_start, block_end)
+
+
+def iter_python_comments(text):
+    """
+    Yield the comments of Python source as CommentRecords.
+    """
+    return group_python_tokens(lex_python(text))
+
+
+def iter_cpp_comments(text):
+    """
+    Yield the comments of C/C++ source as CommentRecords.
+    """
+    return group_cpp_tokens(lex_cpp(text))
+
+
+def iter_fortran_comments(text):
+    """
+    Yield the comments of Fortran source as CommentRecords.
+    """
+    return group_fortran_tokens(lex_fortran(text))
+
+
+# Map each file type to its lexer and to the grouping of its tokens into records
+LEXERS = {"python": lex_python, "cpp": lex_cpp, "fortran": lex_fortran}
+TOKEN_GROUPERS = {
+    "python": group_python_tokens,
+    "cpp": group_cpp_tokens,
+    "fortran": group_fortran_tokens,
+}
+
+# Map each file type to the generator of its comment records
+COMMENT_ITERATORS = {
+    "python": iter_python_comments,
+    "cpp": iter_cpp_comments,
+    "fortran": iter_fortran_comments,
+}
+
+
+def iter_comments(text, files_type):
+    """
+    Yield the CommentRecords of a source text of the given file type.
+    """
+    return COMMENT_ITERATORS[files_type](text)
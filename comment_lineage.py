@@ -0,0 +1,263 @@
+import csv
+from collections import deque
+import numpy as np
+import pandas as pd
+
+# Columns of the lineage edges output
+LINEAGE_CSV_HEADER = [
+    "Lineage",
+    "Parent File Path",
+    "Parent Comment",
+    "Child File Path",
+    "Child Comment",
+    "Similarity",
+    "Commit Hash",
+    "Date",
+]
+
+# Comments are compared as sets of byte 4-grams of their case- and
+# whitespace-normalised text, so re-wrapping a comment does not change it
+SHINGLE_SIZE = 4
+SHINGLE_WEIGHTS = np.array([1 << 24, 1 << 16, 1 << 8, 1], dtype=np.uint32)
+
+
+def shingles(comment):
+    """
+    Return the distinct byte 4-grams of a comment as a sorted uint32 array.
+    """
+    data = " ".join(comment.lower().split()).encode("utf-8").ljust(SHINGLE_SIZE)
+    windows = np.lib.stride_tricks.sliding_window_view(
+        np.frombuffer(data, dtype=np.uint8), SHINGLE_SIZE
+    )
+    return np.unique(windows.astype(np.uint32) @ SHINGLE_WEIGHTS)
+
+
+# Function to compute the exact Jaccard similarity of two shingle sets
+def jaccard(shingles_a, shingles_b):
+    common = np.intersect1d(shingles_a, shingles_b, assume_unique=True).size
+    return common / (shingles_a.size + shingles_b.size - common)
+
+
+class MinHasher:
+    """
+    MinHash signatures of shingle sets, using `num_perm` multiply-shift hash
+    functions of the 32-bit shingles.
+    """
+
+    def __init__(self, num_perm=64, seed=1):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 2**63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self.b = rng.integers(0, 2**63, size=num_perm, dtype=np.uint64)
+
+    def signature(self, shingle_set):
+        hashes = np.outer(self.a, shingle_set.astype(np.uint64)) + self.b[:, None]
+        return (hashes >> np.uint64(32)).min(axis=1).astype(np.uint32)
+
+
+class LineageIndex:
+    """
+    Locality-sensitive hashing index of MinHash signatures. Signatures are cut
+    into `bands` bands and two items are candidates when any band is identical,
+    so a lookup only touches the items sharing a bucket with the query.
+    """
+
+    def __init__(self, num_perm=64, bands=16):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.buckets = [{} for _ in range(bands)]
+        self.entries = {}
+        self.next_id = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _keys(self, signature):
+        rows = self.rows
+        return [
+            signature[band * rows : (band + 1) * rows].tobytes()
+            for band in range(self.bands)
+        ]
+
+    def add(self, item, shingle_set, signature):
+        """
+        Add an item with its shingles and signature and return its entry ID.
+        """
+        entry_id = self.next_id
+        self.next_id += 1
+        keys = self._keys(signature)
+        for buckets, key in zip(self.buckets, keys):
+            buckets.setdefault(key, []).append(entry_id)
+        self.entries[entry_id] = (item, shingle_set, keys)
+        return entry_id
+
+    def pop(self, entry_id):
+        """
+        Remove an entry and return its (item, shingles), or None if it is gone.
+        """
+        entry = self.entries.pop(entry_id, None)
+        if entry is None:
+            return None
+        item, shingle_set, keys = entry
+        for buckets, key in zip(self.buckets, keys):
+            bucket = buckets[key]
+            bucket.remove(entry_id)
+            if not bucket:
+                del buckets[key]
+        return item, shingle_set
+
+    def candidates(self, signature):
+        """
+        Return the IDs of the entries sharing at least one band with a signature.
+        """
+        found = set()
+        for buckets, key in zip(self.buckets, self._keys(signature)):
+            found.update(buckets.get(key, ()))
+        return found
+
+
+class CommentLineage:
+    """
+    Link removed comments to the near-identical comments that replace them, so an
+    edited or moved comment is one lineage instead of a removal plus an unrelated
+    introduction.
+
+    Feed it the comments each file version introduced and removed with `record`,
+    then close every commit with `end_commit`. Removed comments stay in an LSH
+    index for `window` commits. Each introduced comment is linked to its most
+    similar indexed comment, in any file, whose shingle Jaccard similarity reaches
+    `threshold`, and that comment leaves the index. Each link is written as an
+    edge with its similarity and the ID of the lineage it extends.
+    """
+
+    def __init__(self, file_name, threshold=0.6, window=100, num_perm=64, bands=16):
+        self.file = open(file_name, "w", newline="", encoding="utf-8")
+        self.csv_writer = csv.writer(self.file)
+        self.csv_writer.writerow(LINEAGE_CSV_HEADER)
+        self.threshold = threshold
+        self.window = window
+        self.hasher = MinHasher(num_perm)
+        self.index = LineageIndex(num_perm, bands)
+        self.expiry = deque()
+        self.commits = 0
+        self.introduced = []
+        self.removed = []
+        # Lineage ID of every comment that is part of a lineage
+        self.lineages = {}
+        self.next_lineage = 0
+        self.edges = 0
+
+    def record(self, file_path, introduced_comments, removed_comments):
+        # Sorted, so that matching does not depend on set iteration order
+        self.introduced.extend((file_path, c) for c in sorted(introduced_comments))
+        self.removed.extend((file_path, c) for c in sorted(removed_comments))
+
+    def end_commit(self, hexsha, committed_datetime):
+        """
+        Link the comments introduced by a commit and write the new edges.
+        """
+        self.commits += 1
+        index = self.index
+        for node in self.removed:
+            shingle_set = shingles(node[1])
+            entry_id = index.add(node, shingle_set, self.hasher.signature(shingle_set))
+            self.expiry.append((self.commits + self.window, entry_id))
+
+        for node in self.introduced:
+            shingle_set = shingles(node[1])
+            best = None
+            for entry_id in index.candidates(self.hasher.signature(shingle_set)):
+                parent, parent_shingles = index.entries[entry_id][:2]
+                if parent == node:
+                    # The same comment came back, it keeps its own history
+                    continue
+                similarity = jaccard(shingle_set, parent_shingles)
+                # Prefer the most similar comment, then one of the same file,
+                # then the most recently removed
+                rank = (similarity, parent[0] == node[0], entry_id)
+                if similarity >= self.threshold and (best is None or rank > best):
+                    best = rank
+            if best is not None:
+                parent, _ = index.pop(best[2])
+                self._write_edge(parent, node, best[0], hexsha, committed_datetime)
+
+        self.introduced.clear()
+        self.removed.clear()
+        while self.expiry and self.expiry[0][0] <= self.commits:
+            index.pop(self.expiry.popleft()[1])
+
+    def _write_edge(self, parent, child, similarity, hexsha, committed_datetime):
+        lineage = self.lineages.get(parent)
+        if lineage is None:
+            lineage = self.lineages[parent] = self.next_lineage
+            self.next_lineage += 1
+        self.lineages[child] = lineage
+        self.csv_writer.writerow(
+            [lineage, *parent, *child, round(similarity, 4), hexsha, committed_datetime]
+        )
+        self.edges += 1
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def lineage_lifetimes(comments, edges):
+    """
+    Add the lineage of each mined comment to a comments DataFrame, as loaded by
+    `comment_output.load_comments`, from the edges written by CommentLineage.
+
+    The "Lineage" column holds the lineage ID, or NA for comments that are not
+    part of one. "Lineage Introduced" is the first introduction in the lineage and
+    "Lineage Removed" its removal, NaT while any of its comments is present.
+    Comments outside a lineage keep their own dates.
+    """
+    nodes = pd.concat(
+        [
+            edges[["Lineage", "Parent File Path", "Parent Comment"]].set_axis(
+                ["Lineage", "File Path", "Comment"], axis=1
+            ),
+            edges[["Lineage", "Child File Path", "Child Comment"]].set_axis(
+                ["Lineage", "File Path", "Comment"], axis=1
+            ),
+        ]
+    ).drop_duplicates(["File Path", "Comment"], keep="last")
+    comments = comments.merge(nodes, on=["File Path", "Comment"], how="left")
+    comments["Lineage"] = comments["Lineage"].astype("Int64")
+
+    # Comments outside a lineage form a group of their own
+    groups = comments["Lineage"].fillna(-1 - pd.Series(comments.index)).astype("int64")
+    comments["Lineage Introduced"] = comments.groupby(groups)["Introduced"].transform(
+        "min"
+    )
+    still_present = pd.Timestamp.max.tz_localize("UTC")
+    removed = comments["Removed"].fillna(still_present)
+    lineage_removed = removed.groupby(groups).transform("max")
+    comments["Lineage Removed"] = lineage_removed.mask(lineage_removed == still_present)
+    return comments
+
+
+def merge_lineages(comments, edges):
+    """
+    Return a comments DataFrame where each lineage is a single comment, the first
+    one introduced, dated with the introduction and removal of the whole lineage
+    as computed by `lineage_lifetimes`. An edited or moved comment then counts
+    as one comment that is still present, not as a removal.
+    """
+    comments = lineage_lifetimes(comments, edges)
+    in_lineage = comments["Lineage"].notna()
+    first_comments = (
+        comments[in_lineage]
+        .sort_values("Introduced", kind="stable")
+        .drop_duplicates("Lineage")
+    )
+    comments = pd.concat([comments[~in_lineage], first_comments]).sort_index()
+    comments["Introduced"] = comments.pop("Lineage Introduced")
+    comments["Removed"] = comments.pop("Lineage Removed")
+    return comments
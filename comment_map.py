@@ -0,0 +1,277 @@
+from collections import Counter
+from itertools import chain, islice
+from operator import attrgetter
+import numpy as np
+from comment_lexer import LEXERS, TOKEN_GROUPERS
+from extract_comments import read_text
+
+
+class PatchMismatch(ValueError):
+    """
+    Raised when the hunks of a patch do not apply to the lines of a CommentMap.
+    The map is left in an undefined state and has to be rebuilt.
+    """
+
+
+# Function to split a text into lines that keep their "\n", as git counts them
+def split_lines(text):
+    lines = text.split("\n")
+    last = lines.pop()
+    lines = [line + "\n" for line in lines]
+    if last:
+        lines.append(last)
+    return lines
+
+
+# Function to decode the lines of a hunk the way read_text decodes a whole file
+def decode_lines(raw_lines):
+    try:
+        lines = [line.decode("utf-8") for line in raw_lines]
+    except UnicodeDecodeError as e:
+        raise PatchMismatch(f"Undecodable hunk: {e}")
+    for number, line in enumerate(lines):
+        if "\r" in line:
+            line = line.replace("\r\n", "\n")
+            if "\r" in line:
+                # Universal newlines would split the line, git does not
+                raise PatchMismatch("Carriage return inside a line")
+            lines[number] = line
+    return lines
+
+
+def lex_lines(lex, lines, first_line, window=64):
+    """
+    Yield the tokens of the lines of a file from line `first_line` on, joining
+    only as many lines as the tokens read need. The lexers look at most one line
+    past a token, so tokens that end before the last line of a window of lines
+    are those of the whole text. When a token reaches the last line, or the
+    window holds no more tokens, the window doubles and is lexed again.
+    """
+    start = first_line - 1
+    yielded = 0
+    while True:
+        end = min(start + window, len(lines))
+        last_line = first_line + end - start - 1
+        tokens = lex("".join(lines[start:end]), first_line)
+        for token in islice(tokens, yielded, None):
+            if end < len(lines) and token.end_line >= last_line:
+                break
+            yielded += 1
+            yield token
+        else:
+            if end == len(lines):
+                return
+        window *= 2
+
+
+class CommentMap:
+    """
+    Line-indexed comments of the current version of one file, which is moved to
+    the next version by applying the hunks of a zero-context diff between the two.
+
+    It keeps the lines of the file, the lines spanned by every token of the lexer
+    and the comment records ordered by first line. Each changed region is re-lexed
+    from the first line after one that no token covers, up to the first line after
+    the change that no token covers in either version, where the two token streams
+    agree again. Tokens and records outside these regions are only renumbered.
+    """
+
+    def __init__(self, files_type, text):
+        self.lex = LEXERS[files_type]
+        self.group = TOKEN_GROUPERS[files_type]
+        self.lines = split_lines(text)
+        tokens = list(self.lex(text))
+        self.token_starts = np.array([t.start_line for t in tokens], dtype=np.int64)
+        self.token_ends = np.array([t.end_line for t in tokens], dtype=np.int64)
+        records = sorted(self.group(tokens), key=attrgetter("start_line"))
+        self.record_starts = np.array(
+            [record.start_line for record in records], dtype=np.int64
+        )
+        self.record_texts = [record.text for record in records]
+        self.counts = Counter(self.record_texts)
+
+    @classmethod
+    def from_content(cls, files_type, content):
+        """
+        Build the map of a file version from its raw content, or return None if
+        its lines cannot be followed through git's patches: when it does not decode,
+        or holds carriage returns that universal newlines turn into line breaks.
+        """
+        if content.count(b"\r") != content.count(b"\r\n"):
+            return None
+        try:
+            text = read_text(None, content)
+        except UnicodeDecodeError:
+            return None
+        return cls(files_type, text)
+
+    def comments(self):
+        """
+        Return the set of comments of the current version.
+        """
+        return set(self.counts)
+
+    def _covering_token(self, line):
+        # Tokens follow each other, so only the last one starting on or before the
+        # line can cover it
+        index = int(np.searchsorted(self.token_starts, line, "right")) - 1
+        if index >= 0 and self.token_ends[index] >= line:
+            return index
+        return None
+
+    def _region_start(self, line):
+        # Move up until the line before is covered by no token
+        while line > 1:
+            index = self._covering_token(line - 1)
+            if index is None:
+                break
+            line = int(self.token_starts[index])
+        return line
+
+    def _settled_line(self, low, high, delta):
+        # First line from low to high (new numbering, free of new tokens) whose old
+        # line is covered by no old token either
+        line = low
+        while line <= high:
+            index = self._covering_token(line - delta)
+            if index is None:
+                return line
+            line = int(self.token_ends[index]) + 1 + delta
+        return None
+
+    def apply_patch(self, hunks):
+        """
+        Move the map to the next version of the file and return the comments that
+        version introduced and removed. Hunks are (old_start, old_count, new_start,
+        new_count, removed_lines, added_lines) as in a `git diff -U0` hunk header,
+        with the lines as bytes including their "\\n".
+        """
+        if not hunks:
+            return [], []
+        changes = []
+        delta = 0
+        for old_start, old_count, new_start, new_count, removed, added in hunks:
+            # A hunk that removes or adds no lines sits after its given line
+            first_old = old_start if old_count else old_start + 1
+            first_new = new_start if new_count else new_start + 1
+            if first_new != first_old + delta or first_old - 1 > len(self.lines):
+                raise PatchMismatch(f"Misplaced hunk at line {old_start}")
+            changes.append((first_old, old_count, first_new, new_count))
+            delta += new_count - old_count
+            hunk_lines = self.lines[first_old - 1 : first_old - 1 + old_count]
+            if hunk_lines != decode_lines(removed):
+                raise PatchMismatch(f"Hunk at line {old_start} does not apply")
+        # Replace the lines bottom-up so the line numbers of earlier hunks hold
+        for (first_old, old_count, _, _), hunk in zip(
+            reversed(changes), reversed(hunks)
+        ):
+            self.lines[first_old - 1 : first_old - 1 + old_count] = decode_lines(
+                hunk[5]
+            )
+
+        regions = self._relex_regions(changes)
+        return self._splice_regions(regions)
+
+    def _relex_regions(self, changes):
+        # Re-lex the regions around the changes. Each region is returned as (start,
+        # end, delta before, delta after, tokens) with start and end the first and
+        # last + 1 old line numbers, and end None for a region running to the end.
+        regions = []
+        line_count = len(self.lines)
+        delta = 0
+        index = 0
+        while index < len(changes):
+            first_old, old_count, first_new, new_count = changes[index]
+            start = self._region_start(first_old)
+            delta_before = delta
+            tokens = lex_lines(self.lex, self.lines, start + delta)
+            region_tokens = []
+            next_token = next(tokens, None)
+            changed_end = first_new + new_count - 1
+            delta += new_count - old_count
+            index += 1
+            while True:
+                low = changed_end + 1
+                if region_tokens:
+                    low = max(low, region_tokens[-1].end_line + 1)
+                high = next_token.start_line - 1 if next_token else line_count
+                if index < len(changes) and changes[index][2] <= high:
+                    # The lexers may only agree again before the next change,
+                    # otherwise that change belongs to this region
+                    end = self._settled_line(low, changes[index][2] - 1, delta)
+                    if end is None:
+                        first_old, old_count, first_new, new_count = changes[index]
+                        changed_end = first_new + new_count - 1
+                        delta += new_count - old_count
+                        index += 1
+                        continue
+                else:
+                    end = self._settled_line(low, high, delta)
+                    if end is None and next_token is not None:
+                        region_tokens.append(next_token)
+                        next_token = next(tokens, None)
+                        continue
+                break
+            if end is not None:
+                end = end - delta + 1
+            regions.append((start, end, delta_before, delta, region_tokens))
+            if end is None:
+                break
+        return regions
+
+    def _splice_regions(self, regions):
+        # Replace the tokens and records of the re-lexed regions, renumber the rest
+        # and update the comment counts
+        token_starts, token_ends, record_starts, record_texts = [], [], [], []
+        removed_texts, added_texts = [], []
+        token_index = record_index = 0
+        for start, end, delta_before, delta_after, tokens in regions:
+            first = int(np.searchsorted(self.token_starts, start))
+            last = len(self.token_starts)
+            if end is not None:
+                last = int(np.searchsorted(self.token_starts, end))
+            token_starts.append(self.token_starts[token_index:first] + delta_before)
+            token_ends.append(self.token_ends[token_index:first] + delta_before)
+            token_starts.append(np.array([t.start_line for t in tokens], np.int64))
+            token_ends.append(np.array([t.end_line for t in tokens], np.int64))
+            token_index = last
+
+            first = int(np.searchsorted(self.record_starts, start))
+            last = len(self.record_starts)
+            if end is not None:
+                last = int(np.searchsorted(self.record_starts, end))
+            records = sorted(self.group(tokens), key=attrgetter("start_line"))
+            record_starts.append(self.record_starts[record_index:first] + delta_before)
+            record_starts.append(np.array([r.start_line for r in records], np.int64))
+            record_texts.append(self.record_texts[record_index:first])
+            record_texts.append([record.text for record in records])
+            removed_texts.extend(self.record_texts[first:last])
+            added_texts.extend(record.text for record in records)
+            record_index = last
+
+        delta = regions[-1][3]
+        token_starts.append(self.token_starts[token_index:] + delta)
+        token_ends.append(self.token_ends[token_index:] + delta)
+        record_starts.append(self.record_starts[record_index:] + delta)
+        record_texts.append(self.record_texts[record_index:])
+        self.token_starts = np.concatenate(token_starts)
+        self.token_ends = np.concatenate(token_ends)
+        self.record_starts = np.concatenate(record_starts)
+        self.record_texts = list(chain.from_iterable(record_texts))
+
+        # A comment is introduced when its count rises from zero and removed when
+        # it drops to zero
+        counts = self.counts
+        before = {text: counts[text] for text in removed_texts}
+        before.update((text, counts[text]) for text in added_texts)
+        counts.subtract(removed_texts)
+        counts.update(added_texts)
+        introduced, removed = [], []
+        for text, count in before.items():
+            if count == 0 and counts[text] > 0:
+                introduced.append(text)
+            elif count > 0 and counts[text] == 0:
+                removed.append(text)
+            if counts[text] == 0:
+                del counts[text]
+        return introduced, removed
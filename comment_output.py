@@ -0,0 +1,159 @@
+import csv
+import os
+import pandas as pd
+
+# Columns of the mined comments output
+COMMENT_CSV_HEADER = ["File Path", "Comment", "Introduced", "Removed"]
+
+
+class CsvCommentWriter:
+    """
+    Write mined comment rows to a CSV file with the original column layout.
+    """
+
+    def __init__(self, file_name):
+        self.file = open(file_name, "w", newline="", encoding="utf-8")
+        self.csv_writer = csv.writer(self.file)
+        self.csv_writer.writerow(COMMENT_CSV_HEADER)
+
+    def writerows(self, rows):
+        self.csv_writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ParquetCommentWriter:
+    """
+    Write mined comment rows to a Parquet file in row groups as mining proceeds.
+
+    Projects and file paths are dictionary-encoded and the introduced/removed
+    dates are stored as native UTC timestamp columns. The project of each row is
+    the name of the repository directory its file path belongs to.
+    """
+
+    def __init__(self, file_name, project_dirs=(), row_group_size=100_000):
+        # pyarrow is only needed for the columnar output
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.schema = pa.schema(
+            [
+                ("Project", pa.dictionary(pa.int32(), pa.string())),
+                ("File Path", pa.dictionary(pa.int32(), pa.string())),
+                ("Comment", pa.string()),
+                ("Introduced", pa.timestamp("us", tz="UTC")),
+                ("Removed", pa.timestamp("us", tz="UTC")),
+            ]
+        )
+        self.parquet_writer = pq.ParquetWriter(
+            file_name, self.schema, compression="zstd"
+        )
+        self.project_dirs = [
+            (
+                os.path.join(project_dir, ""),
+                os.path.basename(os.path.normpath(project_dir)),
+            )
+            for project_dir in project_dirs
+        ]
+        self.row_group_size = row_group_size
+        self.rows = []
+        self._last_path = None
+        self._last_project = None
+
+    def _project(self, file_path):
+        if file_path != self._last_path:
+            self._last_path = file_path
+            self._last_project = next(
+                (
+                    name
+                    for prefix, name in self.project_dirs
+                    if file_path.startswith(prefix)
+                ),
+                None,
+            )
+        return self._last_project
+
+    def writerows(self, rows):
+        for file_path, comment, introduced, removed in rows:
+            self.rows.append(
+                (self._project(file_path), file_path, comment, introduced, removed)
+            )
+        if len(self.rows) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        columns = list(zip(*self.rows))
+        pa = self.pa
+        table = pa.Table.from_arrays(
+            [
+                pa.array(columns[0], pa.string()).dictionary_encode(),
+                pa.array(columns[1], pa.string()).dictionary_encode(),
+                pa.array(columns[2], pa.string()),
+                pa.array(columns[3], self.schema.field("Introduced").type),
+                pa.array(columns[4], self.schema.field("Removed").type),
+            ],
+            schema=self.schema,
+        )
+        self.parquet_writer.write_table(table, row_group_size=len(self.rows))
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self.parquet_writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_comment_writer(file_name, project_dirs=()):
+    """
+    Open a writer for mined comments, choosing Parquet or CSV from the file name.
+    """
+    if file_name.endswith(".parquet"):
+        return ParquetCommentWriter(file_name, project_dirs)
+    return CsvCommentWriter(file_name)
+
+
+def load_comments(file_name, columns=None):
+    """
+    Load a comments file into a DataFrame. Parquet files are read directly with
+    their categorical and timestamp columns. For CSV files the introduced/removed
+    columns are parsed as UTC timestamps.
+    """
+    if file_name.endswith(".parquet"):
+        return pd.read_parquet(file_name, columns=columns)
+
+    df = pd.read_csv(file_name, usecols=columns)
+    for column in ("Introduced", "Removed", "introduced", "removed"):
+        if column in df.columns:
+            df[column] = pd.to_datetime(df[column], utc=True, errors="coerce")
+    return df
+
+
+def iter_comment_chunks(file_name, chunk_size=100_000, columns=None):
+    """
+    Yield a comments file as DataFrames of at most `chunk_size` rows, reading
+    Parquet files batch by batch and CSV files in chunks.
+    """
+    if file_name.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(file_name)
+        for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+            yield batch.to_pandas()
+        return
+
+    yield from pd.read_csv(file_name, usecols=columns, chunksize=chunk_size)
@@ -0,0 +1,291 @@
+from array import array
+from datetime import datetime, timedelta, timezone
+
+# Sentinel stored in the timestamp arrays for a missing date
+NO_DATE = -(2**63)
+
+
+class FileRecord:
+    """
+    Comment history of one file. Comments are referenced by their interned ID, and
+    their introduced/removed dates are kept as epoch seconds plus UTC offset in
+    minutes in parallel arrays, one slot per comment in order of first appearance.
+    """
+
+    __slots__ = (
+        "file_id",
+        "comment_ids",
+        "slots",
+        "introduced",
+        "introduced_offset",
+        "removed",
+        "removed_offset",
+        "current",
+    )
+
+    def __init__(self, file_id):
+        self.file_id = file_id
+        self.comment_ids = array("q")
+        self.slots = {}
+        self.introduced = array("q")
+        self.introduced_offset = array("h")
+        self.removed = array("q")
+        self.removed_offset = array("h")
+        self.current = set()
+
+    def slot(self, comment_id):
+        """
+        Return the slot of a comment, appending a new one if it is not known yet.
+        The second value tells whether the slot was just created.
+        """
+        slot = self.slots.get(comment_id)
+        if slot is not None:
+            return slot, False
+        slot = len(self.comment_ids)
+        self.slots[comment_id] = slot
+        self.comment_ids.append(comment_id)
+        self.introduced.append(NO_DATE)
+        self.introduced_offset.append(0)
+        self.removed.append(NO_DATE)
+        self.removed_offset.append(0)
+        return slot, True
+
+
+class CommentStore:
+    """
+    Compact store of the introduced/removed dates of mined comments.
+
+    Comment texts are interned once across all files and reference counted, so
+    they are released as soon as no resident file uses them. Files get integer
+    IDs and a FileRecord. Finished files can be streamed to the output with
+    `finish`, which drops them from memory.
+    """
+
+    def __init__(self):
+        self.comment_ids = {}
+        self.comments = []
+        self.refcounts = array("q")
+        self.free_comment_ids = []
+        self.file_ids = {}
+        self.paths = []
+        self.files = {}
+
+    def __contains__(self, file_path):
+        return file_path in self.files
+
+    def __len__(self):
+        return len(self.files)
+
+    def _intern(self, comment):
+        comment_id = self.comment_ids.get(comment)
+        if comment_id is not None:
+            return comment_id
+        if self.free_comment_ids:
+            comment_id = self.free_comment_ids.pop()
+            self.comments[comment_id] = comment
+        else:
+            comment_id = len(self.comments)
+            self.comments.append(comment)
+            self.refcounts.append(0)
+        self.comment_ids[comment] = comment_id
+        return comment_id
+
+    def _release(self, comment_id):
+        self.refcounts[comment_id] -= 1
+        if self.refcounts[comment_id] == 0:
+            del self.comment_ids[self.comments[comment_id]]
+            self.comments[comment_id] = None
+            self.free_comment_ids.append(comment_id)
+
+    def _record(self, file_path):
+        record = self.files.get(file_path)
+        if record is None:
+            file_id = self.file_ids.get(file_path)
+            if file_id is None:
+                file_id = len(self.paths)
+                self.file_ids[file_path] = file_id
+                self.paths.append(file_path)
+            record = self.files[file_path] = FileRecord(file_id)
+        return record
+
+    def _slot(self, record, comment_id):
+        slot, created = record.slot(comment_id)
+        if created:
+            self.refcounts[comment_id] += 1
+        return slot
+
+    def current_comments(self, file_path):
+        """
+        Return the set of comments present in the latest version of a file.
+        """
+        record = self.files.get(file_path)
+        if record is None:
+            return set()
+        return {self.comments[comment_id] for comment_id in record.current}
+
+    def current_count(self, file_path):
+        """
+        Return the number of comments present in the latest version of a file.
+        """
+        record = self.files.get(file_path)
+        return 0 if record is None else len(record.current)
+
+    def record_changes(self, file_path, current_comments, committed_datetime):
+        """
+        Record the comments introduced and removed by a new version of a file and
+        return the number of comments introduced and removed.
+        """
+        record = self._record(file_path)
+        seconds, offset = _pack_date(committed_datetime)
+
+        current = set()
+        introduced = 0
+        for comment in current_comments:
+            comment_id = self._intern(comment)
+            current.add(comment_id)
+            if comment_id not in record.current:
+                # Newly introduced comment
+                slot = self._slot(record, comment_id)
+                record.introduced[slot] = seconds
+                record.introduced_offset[slot] = offset
+                introduced += 1
+
+        removed = record.current - current
+        for comment_id in removed:
+            slot = record.slots[comment_id]
+            record.removed[slot] = seconds
+            record.removed_offset[slot] = offset
+
+        # Update the current state of comments for the file
+        record.current = current
+        return introduced, len(removed)
+
+    def apply_changes(
+        self, file_path, introduced_comments, removed_comments, committed_datetime
+    ):
+        """
+        Like `record_changes`, but given only the comments that a new version of a
+        file introduced and removed instead of its full set of comments.
+        """
+        record = self._record(file_path)
+        seconds, offset = _pack_date(committed_datetime)
+
+        for comment in introduced_comments:
+            comment_id = self._intern(comment)
+            record.current.add(comment_id)
+            slot = self._slot(record, comment_id)
+            record.introduced[slot] = seconds
+            record.introduced_offset[slot] = offset
+
+        for comment in removed_comments:
+            comment_id = self.comment_ids[comment]
+            record.current.discard(comment_id)
+            slot = record.slots[comment_id]
+            record.removed[slot] = seconds
+            record.removed_offset[slot] = offset
+
+        return len(introduced_comments), len(removed_comments)
+
+    def restore(self, file_path, comment, introduced, removed, is_current):
+        """
+        Restore one comment of a file, e.g. from a checkpoint.
+        """
+        record = self._record(file_path)
+        comment_id = self._intern(comment)
+        slot = self._slot(record, comment_id)
+        if introduced is not None:
+            record.introduced[slot], record.introduced_offset[slot] = _pack_date(
+                introduced
+            )
+        if removed is not None:
+            record.removed[slot], record.removed_offset[slot] = _pack_date(removed)
+        if is_current:
+            record.current.add(comment_id)
+
+    def move(self, old_file_path, new_file_path):
+        """
+        Carry the comment history of a file over to its new path after a rename.
+        Comments already recorded at the new path that the moved file never had
+        are kept.
+        """
+        moved = self.files.pop(old_file_path)
+        existing = self.files.pop(new_file_path, None)
+        if existing is not None:
+            for slot, comment_id in enumerate(existing.comment_ids):
+                if comment_id not in moved.slots:
+                    new_slot, _ = moved.slot(comment_id)
+                    moved.introduced[new_slot] = existing.introduced[slot]
+                    moved.introduced_offset[new_slot] = existing.introduced_offset[slot]
+                    moved.removed[new_slot] = existing.removed[slot]
+                    moved.removed_offset[new_slot] = existing.removed_offset[slot]
+                else:
+                    self._release(comment_id)
+
+        file_id = self.file_ids.get(new_file_path)
+        if file_id is None:
+            file_id = len(self.paths)
+            self.file_ids[new_file_path] = file_id
+            self.paths.append(new_file_path)
+        moved.file_id = file_id
+        self.files[new_file_path] = moved
+
+    def rows(self, file_path):
+        """
+        Yield (comment, introduced, removed, is_current) for each comment of a file.
+        """
+        record = self.files[file_path]
+        for slot, comment_id in enumerate(record.comment_ids):
+            yield (
+                self.comments[comment_id],
+                _unpack_date(record.introduced[slot], record.introduced_offset[slot]),
+                _unpack_date(record.removed[slot], record.removed_offset[slot]),
+                comment_id in record.current,
+            )
+
+    def pop_rows(self, file_path):
+        """
+        Return the output rows of a file and drop it from the store.
+        """
+        if file_path not in self.files:
+            return []
+        rows = [
+            [file_path, comment, introduced, removed]
+            for comment, introduced, removed, _ in self.rows(file_path)
+        ]
+        self.discard(file_path)
+        return rows
+
+    def finish(self, file_path, comment_writer):
+        """
+        Write the rows of a finished file to the output and drop it from the store.
+        """
+        comment_writer.writerows(self.pop_rows(file_path))
+
+    def finish_all(self, comment_writer):
+        for file_path in list(self.files):
+            self.finish(file_path, comment_writer)
+
+    def discard(self, file_path):
+        record = self.files.pop(file_path)
+        for comment_id in record.comment_ids:
+            self._release(comment_id)
+
+    def resident_comments(self):
+        """
+        Return the number of comment slots held by files still in memory.
+        """
+        return sum(len(record.comment_ids) for record in self.files.values())
+
+
+# Function to pack a timezone-aware datetime as (epoch seconds, UTC offset minutes)
+def _pack_date(date):
+    offset = date.utcoffset()
+    offset_minutes = int(offset.total_seconds() // 60) if offset else 0
+    return int(date.timestamp()), offset_minutes
+
+
+# Function to rebuild a datetime in its original timezone from its packed form
+def _unpack_date(seconds, offset_minutes):
+    if seconds == NO_DATE:
+        return None
+    return datetime.fromtimestamp(seconds, timezone(timedelta(minutes=offset_minutes)))
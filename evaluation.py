@@ -0,0 +1,287 @@
+import argparse
+import ast
+import time
+import numpy as np
+import pandas as pd
+from scipy.stats import binomtest
+
+METRICS = ["accuracy", "precision", "recall", "f1"]
+
+# Resamples are drawn in blocks of about this many indices to bound memory
+BLOCK_SIZE = 2**24
+
+
+def bootstrap_cell_counts(cells, n_cells, resamples=2000, seed=0):
+    """
+    Count how often each cell code occurs in the sample and in each of
+    `resamples` bootstrap resamples of it. Returns the sample counts and a
+    (resamples, n_cells) array, drawn without a Python loop over resamples.
+    """
+    cells = np.asarray(cells, dtype=np.int64)
+    n = cells.size
+    rng = np.random.default_rng(seed)
+    counts = np.empty((resamples, n_cells), dtype=np.int64)
+    block = max(1, BLOCK_SIZE // max(n, 1))
+    small_cells = cells.astype(np.int8 if n_cells <= 128 else np.int64)
+    for start in range(0, resamples, block):
+        size = min(block, resamples - start)
+        resampled = small_cells[rng.integers(0, n, size=(size, n), dtype=np.int32)]
+        for cell in range(n_cells):
+            counts[start : start + size, cell] = (resampled == cell).sum(axis=1)
+    return np.bincount(cells, minlength=n_cells), counts
+
+
+def metrics_from_counts(tp, fp, fn, tn):
+    """
+    Return the accuracy, precision, recall and F1 of confusion counts, which may
+    be arrays. Undefined ratios are 0, as in sklearn.
+    """
+    tp, fp, fn, tn = (np.asarray(count, dtype=np.float64) for count in (tp, fp, fn, tn))
+
+    def ratio(numerator, denominator):
+        return np.divide(
+            numerator,
+            denominator,
+            out=np.zeros(np.broadcast(numerator, denominator).shape),
+            where=denominator > 0,
+        )
+
+    return {
+        "accuracy": ratio(tp + tn, tp + fp + fn + tn),
+        "precision": ratio(tp, tp + fp),
+        "recall": ratio(tp, tp + fn),
+        "f1": ratio(2 * tp, 2 * tp + fp + fn),
+    }
+
+
+# Function to summarise point estimates and bootstrap samples of metrics
+def interval_table(estimates, samples, confidence):
+    tail = (1 - confidence) / 2 * 100
+    return pd.DataFrame(
+        {
+            "estimate": [float(estimates[metric]) for metric in METRICS],
+            "low": [np.percentile(samples[metric], tail) for metric in METRICS],
+            "high": [np.percentile(samples[metric], 100 - tail) for metric in METRICS],
+        },
+        index=pd.Index(METRICS, name="metric"),
+    )
+
+
+def bootstrap_metrics(
+    y_true, y_pred, pos_label="yes", resamples=2000, confidence=0.95, seed=0
+):
+    """
+    Return accuracy, precision, recall and F1 of binary predictions with
+    percentile bootstrap confidence intervals.
+    """
+    truth = np.asarray(y_true) == pos_label
+    predicted = np.asarray(y_pred) == pos_label
+    # Cells: 0 true negative, 1 false positive, 2 false negative, 3 true positive
+    counts, resampled = bootstrap_cell_counts(truth * 2 + predicted, 4, resamples, seed)
+    estimates = metrics_from_counts(counts[3], counts[1], counts[2], counts[0])
+    samples = metrics_from_counts(
+        resampled[:, 3], resampled[:, 1], resampled[:, 2], resampled[:, 0]
+    )
+    return interval_table(estimates, samples, confidence)
+
+
+def per_label_metrics(y_true, y_pred, resamples=2000, confidence=0.95, seed=0):
+    """
+    Return bootstrap metrics with each label in turn as the positive label, all
+    from the resamples of a single confusion matrix.
+    """
+    y_true, y_pred = np.asarray(y_true), np.asarray(y_pred)
+    labels, codes = np.unique(np.concatenate([y_true, y_pred]), return_inverse=True)
+    k = len(labels)
+    counts, resampled = bootstrap_cell_counts(
+        codes[: len(y_true)] * k + codes[len(y_true) :], k * k, resamples, seed
+    )
+    counts = counts.reshape(k, k)
+    resampled = resampled.reshape(-1, k, k)
+
+    def label_metrics(matrix, label):
+        tp = matrix[..., label, label]
+        fp = matrix[..., :, label].sum(axis=-1) - tp
+        fn = matrix[..., label, :].sum(axis=-1) - tp
+        tn = matrix.sum(axis=(-2, -1)) - tp - fp - fn
+        return metrics_from_counts(tp, fp, fn, tn)
+
+    tables = {
+        label: interval_table(
+            label_metrics(counts, index), label_metrics(resampled, index), confidence
+        )
+        for index, label in enumerate(labels)
+    }
+    return pd.concat(tables, names=["label"])
+
+
+def slice_metrics(
+    df,
+    slice_column,
+    prediction_column="gpt_prediction",
+    pos_label="yes",
+    resamples=2000,
+    confidence=0.95,
+    seed=0,
+):
+    """
+    Return bootstrap metrics for each value of a slice column. List values, such
+    as issue labels, put an issue in the slice of each of their elements.
+    """
+    df = df.explode(slice_column) if df[slice_column].map(np.ndim).any() else df
+    tables = {}
+    for value, group in df.groupby(slice_column, sort=True):
+        table = bootstrap_metrics(
+            group["impacts_science"],
+            group[prediction_column],
+            pos_label,
+            resamples,
+            confidence,
+            seed,
+        )
+        table["n"] = len(group)
+        tables[value] = table
+    return pd.concat(tables, names=[slice_column])
+
+
+def paired_comparison(
+    y_true, pred_a, pred_b, pos_label="yes", resamples=2000, confidence=0.95, seed=0
+):
+    """
+    Compare two prediction columns on the same issues. Both are scored on the
+    same bootstrap resamples, and the table holds the metric differences (b - a)
+    with their confidence interval and a two-sided bootstrap p-value. The exact
+    McNemar test of the issues on which exactly one of them is correct is
+    returned as well.
+    """
+    truth = np.asarray(y_true) == pos_label
+    a = np.asarray(pred_a) == pos_label
+    b = np.asarray(pred_b) == pos_label
+    counts, resampled = bootstrap_cell_counts(truth * 4 + a * 2 + b, 8, resamples, seed)
+
+    def metrics_of(counts, first):
+        # Sum the cells of the other prediction out
+        cells = counts.reshape(counts.shape[:-1] + (2, 2, 2))
+        cells = cells.sum(axis=-1) if first else cells.sum(axis=-2)
+        return metrics_from_counts(
+            cells[..., 1, 1], cells[..., 0, 1], cells[..., 1, 0], cells[..., 0, 0]
+        )
+
+    estimates_a, estimates_b = metrics_of(counts, True), metrics_of(counts, False)
+    samples_a, samples_b = metrics_of(resampled, True), metrics_of(resampled, False)
+    differences = {metric: samples_b[metric] - samples_a[metric] for metric in METRICS}
+    table = interval_table(
+        {metric: estimates_b[metric] - estimates_a[metric] for metric in METRICS},
+        differences,
+        confidence,
+    )
+    table.insert(0, "a", [float(estimates_a[metric]) for metric in METRICS])
+    table.insert(1, "b", [float(estimates_b[metric]) for metric in METRICS])
+    table["p_value"] = [
+        min(1.0, 2 * min((d <= 0).mean(), (d >= 0).mean()))
+        for d in differences.values()
+    ]
+
+    correct_a = a == truth
+    correct_b = b == truth
+    only_a = int((correct_a & ~correct_b).sum())
+    only_b = int((correct_b & ~correct_a).sum())
+    mcnemar = binomtest(only_a, only_a + only_b).pvalue if only_a + only_b else 1.0
+    return table, {
+        "only_a_correct": only_a,
+        "only_b_correct": only_b,
+        "p_value": mcnemar,
+    }
+
+
+# Function to parse the labels column of the issues CSV into lists
+def parse_issue_labels(labels):
+    if isinstance(labels, str) and labels.startswith("["):
+        return ast.literal_eval(labels)
+    return []
+
+
+def evaluation_report(
+    df,
+    prediction_column="gpt_prediction",
+    compare_column=None,
+    slices=(),
+    resamples=2000,
+    confidence=0.95,
+):
+    """
+    Print the bootstrap metrics of a prediction column overall, per label and per
+    slice, and its paired comparison with a second prediction column.
+    """
+    with pd.option_context("display.float_format", "{:.3f}".format):
+        print(f"Metrics of {prediction_column} ({len(df)} issues):")
+        print(
+            bootstrap_metrics(
+                df["impacts_science"],
+                df[prediction_column],
+                resamples=resamples,
+                confidence=confidence,
+            )
+        )
+        print("Per label:")
+        print(
+            per_label_metrics(
+                df["impacts_science"], df[prediction_column], resamples, confidence
+            )
+        )
+        for slice_column in slices:
+            print(f"Per {slice_column}:")
+            print(
+                slice_metrics(
+                    df,
+                    slice_column,
+                    prediction_column,
+                    resamples=resamples,
+                    confidence=confidence,
+                )
+            )
+        if compare_column is not None:
+            table, mcnemar = paired_comparison(
+                df["impacts_science"],
+                df[prediction_column],
+                df[compare_column],
+                resamples=resamples,
+                confidence=confidence,
+            )
+            print(f"{compare_column} (b) against {prediction_column} (a):")
+            print(table)
+            print(
+                f"McNemar: {mcnemar['only_a_correct']} issues only a got right, "
+                f"{mcnemar['only_b_correct']} only b, p = {mcnemar['p_value']:.4f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate LLM predictions")
+    parser.add_argument("--input", default="ctsm_issues_labelled.csv")
+    parser.add_argument("--prediction", default="gpt_prediction")
+    parser.add_argument("--compare", help="second prediction column to compare")
+    parser.add_argument(
+        "--slice",
+        action="append",
+        default=[],
+        help="column to break the metrics down by, e.g. labels or year",
+    )
+    parser.add_argument("--resamples", type=int, default=2000)
+    parser.add_argument("--confidence", type=float, default=0.95)
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.input)
+    df = df.dropna(subset=["impacts_science", args.prediction])
+    if args.compare:
+        df = df.dropna(subset=[args.compare])
+    if "labels" in df:
+        df["labels"] = df["labels"].map(parse_issue_labels)
+    if "created_at" in df:
+        df["year"] = pd.to_datetime(df["created_at"], utc=True).dt.year
+
+    start_time = time.time()
+    evaluation_report(
+        df, args.prediction, args.compare, args.slice, args.resamples, args.confidence
+    )
+    print(f"Report computed in {time.time() - start_time:.2f} seconds")
@@ -1,57 +1,201 @@
+import argparse
+import json
 import os
 import time
-import pandas as pd
-from github import Github, RateLimitExceededException
+import urllib.error
+import urllib.parse
+import urllib.request
+from issue_store import IssueStore
 
+# Endpoint of the GitHub REST API; a stub server can be used instead
+API_URL = "https://api.github.com"
 
-# Function to check rate limit and sleep if necessary
-def check_rate_limit(g):
-    rate_limit = g.get_rate_limit().core
-    remaining = rate_limit.remaining
-    reset = rate_limit.reset.timestamp()
-    now = time.time()
 
-    if remaining < 10:
-        sleep_time = reset - now + 1  # add 1 second buffer
+class RateLimitReached(Exception):
+    """
+    Raised when the API rate limit is used up and waiting for its reset is not
+    allowed. Everything fetched so far is stored, so the next run resumes.
+    """
+
+    def __init__(self, reset):
+        super().__init__(f"API rate limit reached, it resets at {time.ctime(reset)}")
+        self.reset = reset
+
+
+class IssueFetcher:
+    """
+    Incremental fetcher of GitHub issues into an IssueStore.
+
+    A sync asks for the issues updated since the stored cursor, oldest update
+    first, and stores each page together with the new cursor, so an interrupted
+    sync resumes from the last stored update. Every request carries the ETag and
+    Last-Modified of the previous response to the same URL. The last page of a
+    sync leaves the cursor where its request had it, so the next sync starts with
+    that very request: if nothing changed, the server answers 304, which GitHub
+    does not count against the rate limit.
+    The rate limit is tracked from the response headers. When fewer than
+    `min_remaining` requests are left, the fetcher sleeps until the reset, or
+    raises RateLimitReached if `wait` is false.
+    """
+
+    def __init__(
+        self,
+        store,
+        token=None,
+        base_url=API_URL,
+        per_page=100,
+        min_remaining=10,
+        wait=True,
+    ):
+        self.store = store
+        self.token = token
+        self.base_url = base_url.rstrip("/")
+        self.per_page = per_page
+        self.min_remaining = min_remaining
+        self.wait = wait
+        self.remaining = None
+        self.reset = None
+        self.requests = 0
+
+    def _issues_url(self, repo_name, since, page):
+        # All states, so that reopened issues leave the closed set
+        query = {
+            "state": "all",
+            "sort": "updated",
+            "direction": "asc",
+            "per_page": self.per_page,
+            "page": page,
+        }
+        if since:
+            query["since"] = since
+        return (
+            f"{self.base_url}/repos/{repo_name}/issues?{urllib.parse.urlencode(query)}"
+        )
+
+    def _read_rate_limit(self, headers):
+        if headers.get("X-RateLimit-Remaining") is not None:
+            self.remaining = int(headers["X-RateLimit-Remaining"])
+        if headers.get("X-RateLimit-Reset") is not None:
+            self.reset = int(headers["X-RateLimit-Reset"])
+
+    def _wait_for_rate_limit(self):
+        if self.remaining is None or self.remaining >= self.min_remaining:
+            return
+        reset = self.reset if self.reset is not None else time.time() + 60
+        if not self.wait:
+            raise RateLimitReached(reset)
+        sleep_time = max(reset - time.time(), 0) + 1  # add 1 second buffer
         print(f"Rate limit exceeded. Sleeping for {sleep_time:.2f} seconds.")
         time.sleep(sleep_time)
+        self.remaining = None
+
+    def _get(self, url, conditional=False):
+        """
+        Return the decoded JSON and headers of a GET request, with None as JSON
+        for 304 Not Modified.
+        """
+        while True:
+            self._wait_for_rate_limit()
+            headers = {
+                "Accept": "application/vnd.github+json",
+                "User-Agent": "ScientificSATD-issue-fetcher",
+            }
+            if self.token:
+                headers["Authorization"] = f"Bearer {self.token}"
+            if conditional:
+                etag, last_modified = self.store.validators(url)
+                if etag:
+                    headers["If-None-Match"] = etag
+                if last_modified:
+                    headers["If-Modified-Since"] = last_modified
 
+            self.requests += 1
+            try:
+                with urllib.request.urlopen(
+                    urllib.request.Request(url, headers=headers)
+                ) as response:
+                    self._read_rate_limit(response.headers)
+                    return json.load(response), response.headers
+            except urllib.error.HTTPError as e:
+                self._read_rate_limit(e.headers)
+                if e.code == 304:
+                    return None, e.headers
+                # Primary (remaining 0) and secondary (Retry-After) rate limits
+                retry_after = e.headers.get("Retry-After")
+                if e.code in (403, 429) and (retry_after or self.remaining == 0):
+                    if retry_after:
+                        self.reset = int(time.time()) + int(retry_after)
+                    self.remaining = 0
+                    continue
+                raise
 
-# Initialize the GitHub API client
-token = os.getenv("GITHUB_TOKEN")
-if not token:
-    raise ValueError("Please set the GITHUB_TOKEN environment variable")
-g = Github(token)
+    def sync(self, repo_name):
+        """
+        Fetch the issues of a repository updated since the last sync and return
+        how many were stored.
+        """
+        since = self.store.since(repo_name)
+        page = 1
+        stored = 0
+        while True:
+            url = self._issues_url(repo_name, since, page)
+            issues, headers = self._get(url, conditional=True)
+            validators = (url, headers.get("ETag"), headers.get("Last-Modified"))
+            if not issues:
+                if issues is not None:
+                    # An empty listing keeps the cursor and saves its validators
+                    self.store.save_issues(repo_name, [], None, validators)
+                break
+            stored += len(issues)
+            if len(issues) < self.per_page:
+                # Keep the cursor of this request, whose validators the next sync
+                # sends. The issues it returns again are absorbed by the upserts.
+                self.store.save_issues(repo_name, issues, since, validators)
+                break
+            new_since = max(issue["updated_at"] for issue in issues)
+            self.store.save_issues(repo_name, issues, new_since, validators)
+            # Re-query from the newest update instead of following page links,
+            # which shift when issues are updated during the sync. Only a full page
+            # of issues updated in the same second needs the next page.
+            page = page + 1 if new_since == since else 1
+            since = new_since
+        return stored
 
 
-# Function to collect all closed issues from a given repository and save as CSV
-def collect_closed_issues(repo_name, output_file):
-    repo = g.get_repo(repo_name)
-    closed_issues = []
+# Function to sync the issues of a repository and save its closed issues as CSV
+def collect_closed_issues(repo_name, output_file, fetcher):
     try:
-        for issue in repo.get_issues(state="closed"):
-            check_rate_limit(g)
-            closed_issues.append(
-                {
-                    "id": issue.id,
-                    "number": issue.number,
-                    "title": issue.title,
-                    "body": issue.body,
-                    "state": issue.state,
-                    "created_at": issue.created_at,
-                    "closed_at": issue.closed_at,
-                    "labels": [label.name for label in issue.labels],
-                }
-            )
-    except RateLimitExceededException:
-        check_rate_limit(g)
-
-    df = pd.DataFrame(closed_issues)
+        stored = fetcher.sync(repo_name)
+        print(f"Fetched {stored} updated issues with {fetcher.requests} requests")
+    except RateLimitReached as e:
+        print(f"{e}. Run again to resume.")
+
+    df = fetcher.store.closed_issues(repo_name)
     df.to_csv(output_file, index=False)
-    print(f"Saved {len(closed_issues)} closed issues to {output_file}")
+    print(f"Saved {len(df)} closed issues to {output_file}")
 
 
 if __name__ == "__main__":
-    repo_name = "ESCOMP/CTSM"  # Name of the repository
-    output_file = "closed_issues.csv"  # Output file name
-    collect_closed_issues(repo_name, output_file)
+    parser = argparse.ArgumentParser(description="Fetch closed issues incrementally")
+    parser.add_argument("--repo", default="ESCOMP/CTSM", help="repository name")
+    parser.add_argument("--output", default="closed_issues.csv")
+    parser.add_argument(
+        "--store", default="issues.sqlite", help="local issue store database"
+    )
+    parser.add_argument("--base-url", default=API_URL)
+    parser.add_argument(
+        "--no-wait",
+        action="store_true",
+        help="stop at the rate limit instead of sleeping until it resets",
+    )
+    args = parser.parse_args()
+
+    # Initialize the GitHub API client
+    token = os.getenv("GITHUB_TOKEN")
+    if not token and args.base_url == API_URL:
+        raise ValueError("Please set the GITHUB_TOKEN environment variable")
+
+    store = IssueStore(args.store)
+    fetcher = IssueFetcher(store, token, args.base_url, wait=not args.no_wait)
+    collect_closed_issues(args.repo, args.output, fetcher)
+    store.close()
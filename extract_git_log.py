@@ -1,63 +1,172 @@
 import git
 import os
+import re
 import csv
+import argparse
+import subprocess
+import multiprocessing
+from datetime import datetime, timedelta, timezone
 from git import Repo
-from collections import defaultdict
 from tqdm import tqdm
+from comment_cache import CommentCache
+from comment_lexer import iter_comments
+from comment_lineage import CommentLineage
+from comment_map import CommentMap, PatchMismatch
+from comment_output import CsvCommentWriter, open_comment_writer
+from comment_store import CommentStore
+from mining_state import MiningStateStore
+from mining_stats import MiningStats, StackSampler
 from extract_comments import (
+    EXTRACTOR_VERSION,
+    read_text,
     extract_python_comments,
     extract_cpp_comments,
     extract_fortran_comments,
 )
 
-file_comments = defaultdict(lambda: defaultdict(lambda: defaultdict(dict)))
+comment_store = CommentStore()
 error_details = []
+# Files whose comments changed since the last checkpoint of the mining state
+dirty_files = set()
+# Optional cache of extracted comments keyed by blob SHA, opened by the main script
+comment_cache = None
+# Optional lineage tracker of edited and moved comments, used by single-pass mining
+comment_lineage = None
+# Optional timers and counters of the mining phases, enabled by the main script
+mining_stats = None
 
 
-# Function to checkout all versions of a file and save to CSV
-def checkout_file_versions(repo, repo_dir, relative_file_path, files_type):
+# Map each file type to the extractor that parses its comments
+EXTRACTORS = {
+    "python": extract_python_comments,
+    "cpp": extract_cpp_comments,
+    "fortran": extract_fortran_comments,
+}
+
+
+# Map each mined file extension to its file type
+FILE_TYPES = {
+    ".cpp": "cpp",
+    ".h": "cpp",
+    ".hpp": "cpp",
+    ".F90": "fortran",
+    ".py": "python",
+}
+
+
+# Function to call a function, timing it as a phase of mining a file when the
+# mining stats are enabled
+def timed(phase, file_path, function, *args):
+    if mining_stats is None:
+        return function(*args)
+    return mining_stats.time(phase, file_path, function, *args)
+
+
+# Function to iterate, timing the production of each item like timed()
+def timed_iter(phase, file_path, iterable):
+    if mining_stats is None:
+        return iterable
+    return mining_stats.time_iter(phase, file_path, iterable)
+
+
+# Function to read the content of a blob
+def read_blob(absolute_file_path, blob):
+    content = timed("read", absolute_file_path, blob.data_stream.read)
+    if mining_stats is not None:
+        mining_stats.read_bytes(absolute_file_path, len(content))
+    return content
+
+
+# Function to look up the blob of a file at a given commit in the object store.
+# GitPython serves object reads through one long-lived `git cat-file --batch`
+# process, so no subprocess is spawned and the working tree is never touched.
+def read_file_version(commit, relative_file_path):
+    try:
+        return commit.tree / relative_file_path
+    except KeyError:
+        # The path does not exist in this commit (e.g. the file was deleted)
+        return None
+
+
+# Function to extract the comments of a blob, reusing cached results when possible
+def extract_blob_comments(absolute_file_path, blob, files_type):
+    extractor = EXTRACTORS.get(files_type)
+    if extractor is None or blob is None:
+        return set()
+
+    if comment_cache is not None:
+        cached_comments = timed(
+            "cache", absolute_file_path, comment_cache.get, blob.hexsha, files_type
+        )
+        if cached_comments is not None:
+            return set(cached_comments)
+
+    content = read_blob(absolute_file_path, blob)
+    comments = timed(
+        "extract", absolute_file_path, extractor, absolute_file_path, content
+    )
+    if comment_cache is not None:
+        timed(
+            "cache",
+            absolute_file_path,
+            comment_cache.put,
+            blob.hexsha,
+            files_type,
+            comments,
+        )
+    return set(comments)
+
+
+# Function to record the comments introduced and removed by a new version of a file
+def record_comment_changes(absolute_file_path, current_comments, committed_datetime):
+    if comment_lineage is not None:
+        previous_comments = comment_store.current_comments(absolute_file_path)
+        comment_lineage.record(
+            absolute_file_path,
+            current_comments - previous_comments,
+            previous_comments - current_comments,
+        )
+    timed(
+        "diff",
+        absolute_file_path,
+        comment_store.record_changes,
+        absolute_file_path,
+        current_comments,
+        committed_datetime,
+    )
+    dirty_files.add(absolute_file_path)
+    if mining_stats is not None:
+        mining_stats.file_version(absolute_file_path, len(current_comments))
+
+
+# Function to walk all versions of a file and record its introduced/removed comments
+def checkout_file_versions(repo, repo_dir, relative_file_path, files_type, rev=None):
     # Construct the absolute file path
     absolute_file_path = os.path.join(repo_dir, relative_file_path)
 
     try:
-        for commit in reversed(list(repo.iter_commits(paths=relative_file_path))):
-            # Checkout using the relative file path
-            repo.git.checkout(commit.hexsha, relative_file_path)
-
-            current_comments = (
-                set(extract_python_comments(absolute_file_path))
-                if files_type == "python"
-                else (
-                    set(extract_cpp_comments(absolute_file_path))
-                    if files_type == "cpp"
-                    else (
-                        set(extract_fortran_comments(absolute_file_path))
-                        if files_type == "fortran"
-                        else set()
-                    )
-                )
+        commits = timed(
+            "git",
+            absolute_file_path,
+            list,
+            repo.iter_commits(rev, paths=relative_file_path),
+        )
+        for commit in reversed(commits):
+            # Read this version of the file straight from the object store
+            blob = timed(
+                "read",
+                absolute_file_path,
+                read_file_version,
+                commit,
+                relative_file_path,
             )
-
-            previous_comments = file_comments[absolute_file_path].get(
-                "current_comments", set()
+            current_comments = extract_blob_comments(
+                absolute_file_path, blob, files_type
             )
 
-            # Find newly introduced comments
-            introduced = current_comments - previous_comments
-            for comment in introduced:
-                file_comments[absolute_file_path][comment][
-                    "introduced"
-                ] = commit.committed_datetime
-
-            # Find removed comments
-            removed = previous_comments - current_comments
-            for comment in removed:
-                file_comments[absolute_file_path][comment][
-                    "removed"
-                ] = commit.committed_datetime
-
-            # Update the current state of comments for the file
-            file_comments[absolute_file_path]["current_comments"] = current_comments
+            record_comment_changes(
+                absolute_file_path, current_comments, commit.committed_datetime
+            )
     except git.exc.GitCommandError as e:
         error_info = {
             "file_path": relative_file_path,
@@ -67,20 +176,329 @@ def checkout_file_versions(repo, repo_dir, relative_file_path, files_type):
         error_details.append(error_info)
 
 
-# Function to save defaultdict to CSV
-def save_defaultdict_to_csv(csv_file_name):
-    with open(csv_file_name, "w", newline="", encoding="utf-8") as file:
-        csv_writer = csv.writer(file)
-        csv_writer.writerow(["File Path", "Comment", "Introduced", "Removed"])
+# Function to stream the versions of one file with their zero-context patches from a
+# single `git log -p -U0`. Yields (commit hash, commit date, patches) in the commit
+# order of checkout_file_versions, where each patch is [old blob SHA, new blob SHA,
+# hunks]. Hunks are lists [old start, old count, new start, new count, removed
+# lines, added lines] with the lines as bytes, or None for a binary diff. Merges
+# come without patches.
+def iter_file_patches(repo_dir, rev, relative_file_path):
+    process = subprocess.Popen(
+        [
+            "git",
+            "-c",
+            "log.follow=false",
+            "log",
+            "--reverse",
+            "--no-color",
+            "--no-ext-diff",
+            "--no-textconv",
+            "--no-renames",
+            "--src-prefix=a/",
+            "--dst-prefix=b/",
+            "-p",
+            "-U0",
+            "--full-index",
+            "--format=%x01%H %cI",
+            rev or "HEAD",
+            "--",
+            relative_file_path,
+        ],
+        cwd=repo_dir,
+        stdout=subprocess.PIPE,
+    )
+
+    commit = None
+    patch = None
+    hunk = None
+    for line in process.stdout:
+        if hunk is not None and (hunk[1] > len(hunk[4]) or hunk[3] > len(hunk[5])):
+            # Hunk body: the removed lines, then the added lines
+            if line.startswith(b"-") and hunk[1] > len(hunk[4]):
+                hunk[4].append(line[1:])
+                continue
+            if line.startswith(b"+") and hunk[3] > len(hunk[5]):
+                hunk[5].append(line[1:])
+                continue
+        if line.startswith(b"\\"):
+            # "\ No newline at end of file" applies to the line before
+            lines = hunk[5] if hunk[5] else hunk[4]
+            lines[-1] = lines[-1].rstrip(b"\n")
+        elif line.startswith(b"\x01"):
+            if commit is not None:
+                yield commit
+            hexsha, date = line[1:].decode().split()
+            commit = (hexsha, datetime.fromisoformat(date), [])
+            patch = hunk = None
+        elif line.startswith(b"diff --git "):
+            patch = [None, None, []]
+            commit[2].append(patch)
+            hunk = None
+        elif patch is None:
+            continue
+        elif line.startswith(b"@@ "):
+            old_range, new_range = line.split(b" ")[1:3]
+            old_start, _, old_count = old_range[1:].partition(b",")
+            new_start, _, new_count = new_range[1:].partition(b",")
+            hunk = [
+                int(old_start),
+                int(old_count or 1),
+                int(new_start),
+                int(new_count or 1),
+                [],
+                [],
+            ]
+            patch[2].append(hunk)
+        elif line.startswith(b"index "):
+            patch[0], patch[1] = line.split()[1].decode().split("..")
+        elif line.startswith(b"Binary files "):
+            patch[2] = None
+    if commit is not None:
+        yield commit
+
+    if process.wait() != 0:
+        raise git.exc.GitCommandError(process.args, process.returncode)
+
+
+# Function to read a version of a file in full and build its comment map. Without a
+# map (e.g. undecodable content), the comments come from the plain extractor.
+def read_comment_map(absolute_file_path, blob, files_type):
+    content = read_blob(absolute_file_path, blob)
+    comment_map = timed(
+        "extract", absolute_file_path, CommentMap.from_content, files_type, content
+    )
+    if comment_map is None:
+        return None, set(
+            timed(
+                "extract",
+                absolute_file_path,
+                EXTRACTORS[files_type],
+                absolute_file_path,
+                content,
+            )
+        )
+    return comment_map, comment_map.comments()
+
+
+# Function to walk all versions of a file like checkout_file_versions, but move a
+# line-indexed comment map from version to version with the diff hunks between
+# them, so each version costs time proportional to its change. A version whose
+# patch does not follow from the previous version (merges, binary diffs, hunks
+# that do not apply) is read in full and rebuilds the map.
+def checkout_file_patches(repo, repo_dir, relative_file_path, files_type, rev=None):
+    absolute_file_path = os.path.join(repo_dir, relative_file_path)
+    comment_map = None
+    blob_sha = None
+    hexsha = None
+
+    try:
+        for hexsha, committed_datetime, patches in timed_iter(
+            "git",
+            absolute_file_path,
+            iter_file_patches(repo_dir, rev, relative_file_path),
+        ):
+            if len(patches) == 1 and patches[0][1] is None:
+                # Only the file mode changed
+                continue
+            if len(patches) == 1:
+                old_sha, new_sha, hunks = patches[0]
+            else:
+                # No single patch against the previous version: look the file up
+                blob = timed(
+                    "read",
+                    absolute_file_path,
+                    read_file_version,
+                    repo.commit(hexsha),
+                    relative_file_path,
+                )
+                old_sha, new_sha, hunks = None, blob.hexsha if blob else None, None
+                if new_sha == blob_sha:
+                    continue
+
+            if new_sha is None or not new_sha.strip("0"):
+                # The file was deleted
+                comment_map = blob_sha = None
+                record_comment_changes(absolute_file_path, set(), committed_datetime)
+                continue
+
+            if comment_map is not None and old_sha == blob_sha and hunks is not None:
+                try:
+                    introduced, removed = timed(
+                        "diff", absolute_file_path, comment_map.apply_patch, hunks
+                    )
+                except PatchMismatch:
+                    comment_map = None
+                else:
+                    blob_sha = new_sha
+                    timed(
+                        "diff",
+                        absolute_file_path,
+                        comment_store.apply_changes,
+                        absolute_file_path,
+                        introduced,
+                        removed,
+                        committed_datetime,
+                    )
+                    dirty_files.add(absolute_file_path)
+                    if mining_stats is not None:
+                        mining_stats.file_version(
+                            absolute_file_path,
+                            comment_store.current_count(absolute_file_path),
+                        )
+                    continue
+
+            blob = git.Blob(repo, bytes.fromhex(new_sha), path=relative_file_path)
+            comment_map, current_comments = read_comment_map(
+                absolute_file_path, blob, files_type
+            )
+            blob_sha = new_sha
+            record_comment_changes(
+                absolute_file_path, current_comments, committed_datetime
+            )
+    except (git.exc.GitCommandError, ValueError) as e:
+        error_details.append(
+            {
+                "file_path": relative_file_path,
+                "commit_hash": hexsha,
+                "error_message": str(e),
+            }
+        )
+
+
+# Function to stream the changed files of every commit from a single `git log --raw`.
+# Yields (commit hash, commit date, changes) in chronological order, where each
+# change is (status, old path, new path, new blob SHA). Commits up to and including
+# `since` are skipped.
+def iter_history_changes(repo_dir, rev, since=None):
+    process = subprocess.Popen(
+        [
+            "git",
+            "log",
+            "--reverse",
+            "--first-parent",
+            "-m",
+            "-M",
+            "--raw",
+            "-z",
+            "--no-abbrev",
+            "--format=%x01%H %cI",
+            f"{since}..{rev}" if since else rev,
+        ],
+        cwd=repo_dir,
+        stdout=subprocess.PIPE,
+    )
+
+    def tokens():
+        pending = b""
+        for chunk in iter(lambda: process.stdout.read(1 << 16), b""):
+            pending += chunk
+            *complete, pending = pending.split(b"\0")
+            yield from complete
+        if pending:
+            yield pending
+
+    commit = None
+    token_stream = tokens()
+    for token in token_stream:
+        token = token.lstrip(b"\n")
+        if token.startswith(b"\x01"):
+            if commit is not None:
+                yield commit
+            hexsha, date = token[1:].decode().split(" ")
+            commit = (hexsha, datetime.fromisoformat(date), [])
+        elif token.startswith(b":"):
+            # Raw entry: ":<old mode> <new mode> <old sha> <new sha> <status>"
+            _, _, _, new_sha, status = token.decode().split(" ")
+            old_path = os.fsdecode(next(token_stream))
+            new_path = (
+                os.fsdecode(next(token_stream)) if status[0] in "RC" else old_path
+            )
+            commit[2].append((status[0], old_path, new_path, new_sha))
+    if commit is not None:
+        yield commit
+
+    if process.wait() != 0:
+        raise git.exc.GitCommandError(process.args, process.returncode)
+
 
-        for file_path, comments in file_comments.items():
-            for comment_text, dates in comments.items():
-                if comment_text != "current_comments":
-                    # Extracting introduced and removed dates, if they exist
-                    introduced = dates.get("introduced")
-                    removed = dates.get("removed")
-                    # Writing to CSV
-                    csv_writer.writerow([file_path, comment_text, introduced, removed])
+# Function to mine the comment history of a repository in one pass over its commits.
+# With a state store, mining resumes from the last checkpoint of the repository and
+# the state is checkpointed every `checkpoint_every` commits.
+def analyze_git_history(dir, tag=None, state_store=None, checkpoint_every=500):
+    repo = git.Repo(dir)
+    rev = tag or "HEAD"
+    since = state_store.load(dir, comment_store) if state_store else None
+    if since and not repo.is_ancestor(since, rev):
+        raise ValueError(f"Checkpoint {since} of {dir} is not an ancestor of {rev}")
+    total_commits = int(
+        repo.git.rev_list(
+            "--count", "--first-parent", f"{since}..{rev}" if since else rev
+        )
+    )
+
+    for index, (hexsha, committed_datetime, changes) in enumerate(
+        tqdm(
+            timed_iter("git", None, iter_history_changes(dir, rev, since)),
+            total=total_commits,
+            desc=f"Processing commits in {dir}",
+        )
+    ):
+        for status, old_path, new_path, new_sha in changes:
+            old_type = FILE_TYPES.get(os.path.splitext(old_path)[1])
+            new_type = FILE_TYPES.get(os.path.splitext(new_path)[1])
+            old_absolute_path = os.path.join(dir, old_path)
+            new_absolute_path = os.path.join(dir, new_path)
+
+            if status == "R" and old_type and old_absolute_path in comment_store:
+                if new_type:
+                    # Carry the comment history over to the new path
+                    comment_store.move(old_absolute_path, new_absolute_path)
+                    dirty_files.update((old_absolute_path, new_absolute_path))
+                else:
+                    # Renamed to an untracked type, so all comments are removed
+                    record_comment_changes(old_absolute_path, set(), committed_datetime)
+
+            if not new_type:
+                continue
+            try:
+                blob = (
+                    None
+                    if status == "D"
+                    else git.Blob(repo, bytes.fromhex(new_sha), path=new_path)
+                )
+                current_comments = extract_blob_comments(
+                    new_absolute_path, blob, new_type
+                )
+            except (git.exc.GitCommandError, ValueError) as e:
+                error_details.append(
+                    {
+                        "file_path": new_path,
+                        "commit_hash": hexsha,
+                        "error_message": str(e),
+                    }
+                )
+                continue
+            record_comment_changes(
+                new_absolute_path, current_comments, committed_datetime
+            )
+
+        if comment_lineage is not None:
+            comment_lineage.end_commit(hexsha, committed_datetime)
+        if mining_stats is not None:
+            mining_stats.count("commits")
+        if state_store and (index + 1) % checkpoint_every == 0:
+            state_store.save(dir, hexsha, comment_store, dirty_files)
+            dirty_files.clear()
+
+    if state_store and total_commits:
+        state_store.save(dir, repo.rev_parse(rev).hexsha, comment_store, dirty_files)
+        dirty_files.clear()
+
+
+# Function to save the comments still held in memory to CSV
+def save_comments_to_csv(csv_file_name):
+    with CsvCommentWriter(csv_file_name) as comment_writer:
+        comment_store.finish_all(comment_writer)
 
 
 def save_errors_to_csv(csv_file_name):
@@ -94,36 +512,263 @@ def save_errors_to_csv(csv_file_name):
             )
 
 
-# Modify the analyze_repo function accordingly
-def analyze_git_directory(dir, tag=None):
+# Function to list the C++, Fortran and Python files of a revision of the repo
+def list_source_files(repo, rev):
+    tracked_files = repo.git.ls_tree("-r", "--name-only", rev).split("\n")
+    # List all C++ files in the selected version of the repo
+    cpp_files = [f for f in tracked_files if f.endswith((".cpp", ".h", ".hpp"))]
+    # List all Fortran files in the selected version of the repo
+    fortran_files = [f for f in tracked_files if f.endswith(".F90")]
+    # List all Python files in the selected version of the repo
+    python_files = [f for f in tracked_files if f.endswith(".py")]
+    return cpp_files, fortran_files, python_files
+
+
+# Modify the analyze_repo function accordingly. With a comment writer, each file's rows
+# are written as soon as its history is mined instead of staying in memory.
+# `incremental` mines each file from the diff hunks between its versions.
+def analyze_git_directory(dir, tag=None, comment_writer=None, incremental=False):
     repo = git.Repo(dir)
-    # Checkout to the specified tag, if provided
-    if tag:
-        repo.git.checkout(tag)
-    # List all Python files in the latest version of the repo
-    python_files = [f for f in repo.git.ls_files().split("\n") if f.endswith(".py")]
-    # List all Fortran files in the latest version of the repo
-    fortran_files = [f for f in repo.git.ls_files().split("\n") if f.endswith(".F90")]
-    # List all C++ files in the latest version of the repo
-    cpp_files = [
-        f for f in repo.git.ls_files().split("\n") if f.endswith((".cpp", ".h", ".hpp"))
+    checkout = checkout_file_patches if incremental else checkout_file_versions
+    # Read the tree of the specified tag, if provided, without checking it out
+    rev = tag or "HEAD"
+    cpp_files, fortran_files, python_files = list_source_files(repo, rev)
+
+    for files, files_type, language in (
+        (cpp_files, "cpp", "c++"),
+        (fortran_files, "fortran", "fortran"),
+        (python_files, "python", "python"),
+    ):
+        # Using tqdm to show progress bar
+        for relative_file_path in tqdm(
+            files, desc=f"Processing {language} files in {dir}"
+        ):
+            checkout(repo, dir, relative_file_path, files_type, rev)
+            if comment_writer is not None:
+                comment_store.finish(
+                    os.path.join(dir, relative_file_path), comment_writer
+                )
+
+
+# Repository handles opened by each worker of the parallel miner, keyed by directory
+worker_repos = {}
+
+
+# Function to set up a worker process of the parallel miner
+def init_worker(cache_path, collect_stats=False):
+    global comment_cache, mining_stats
+    # Each worker reads the shared comment cache through its own read-only
+    # connection and hands its new entries to the parent, the only writer
+    comment_cache = (
+        CommentCache(cache_path, EXTRACTOR_VERSION, read_only=True)
+        if cache_path
+        else None
+    )
+    # Workers hand their stats over to the parent with each file's result
+    mining_stats = MiningStats() if collect_stats else None
+
+
+# Function to mine the history of one file inside a worker process
+def mine_file_job(job):
+    repo_dir, rev, relative_file_path, files_type, incremental = job
+    if repo_dir not in worker_repos:
+        worker_repos[repo_dir] = git.Repo(repo_dir)
+    hits, misses = (
+        (comment_cache.hits, comment_cache.misses) if comment_cache else (0, 0)
+    )
+
+    checkout = checkout_file_patches if incremental else checkout_file_versions
+    checkout(worker_repos[repo_dir], repo_dir, relative_file_path, files_type, rev)
+
+    # Hand the file's rows back to the parent and drop them from this worker
+    rows = comment_store.pop_rows(os.path.join(repo_dir, relative_file_path))
+    errors = list(error_details)
+    error_details.clear()
+    stats = mining_stats.drain() if mining_stats is not None else None
+    if comment_cache is None:
+        return rows, errors, 0, 0, None, stats
+    return (
+        rows,
+        errors,
+        comment_cache.hits - hits,
+        comment_cache.misses - misses,
+        comment_cache.drain(),
+        stats,
+    )
+
+
+# Function to analyze several repositories with a pool of worker processes, writing
+# each file's rows to the comment writer as its result arrives
+def analyze_git_directories_parallel(
+    directories, workers, comment_writer, cache_path=None, incremental=False
+):
+    jobs = []
+    for dir, tag in directories:
+        rev = tag or "HEAD"
+        cpp_files, fortran_files, python_files = list_source_files(git.Repo(dir), rev)
+        # Queue the files in the same order as the serial miner
+        for files, files_type in (
+            (cpp_files, "cpp"),
+            (fortran_files, "fortran"),
+            (python_files, "python"),
+        ):
+            jobs.extend((dir, rev, f, files_type, incremental) for f in files)
+
+    with multiprocessing.Pool(
+        workers,
+        initializer=init_worker,
+        initargs=(cache_path, mining_stats is not None),
+    ) as pool:
+        # imap yields results in job order, so the merged output is deterministic
+        results = pool.imap(mine_file_job, jobs, chunksize=4)
+        for rows, errors, hits, misses, cache_entries, stats in tqdm(
+            results, total=len(jobs), desc=f"Processing files with {workers} workers"
+        ):
+            comment_writer.writerows(rows)
+            error_details.extend(errors)
+            if comment_cache is not None:
+                comment_cache.hits += hits
+                comment_cache.misses += misses
+                if cache_entries is not None:
+                    comment_cache.merge(cache_entries)
+            if stats is not None:
+                mining_stats.merge(stats)
+
+
+# Function to run `git blame --porcelain` on a file at a revision. Returns the
+# content of the file and, for every line, the committer date of the commit that
+# last changed it.
+def blame_file(repo_dir, rev, relative_file_path):
+    process = subprocess.run(
+        ["git", "blame", "--porcelain", rev or "HEAD", "--", relative_file_path],
+        cwd=repo_dir,
+        capture_output=True,
+    )
+    if process.returncode != 0:
+        raise git.exc.GitCommandError(process.args, process.returncode, process.stderr)
+
+    commit_dates = {}
+    line_dates = []
+    content = []
+    porcelain = iter(process.stdout.split(b"\n"))
+    for header in porcelain:
+        if not header:
+            continue
+        # "<sha> <original line> <final line> [<lines in group>]", then the
+        # commit's fields the first time it appears, then the line itself
+        hexsha = header[:40]
+        fields = {}
+        for field in porcelain:
+            if field.startswith(b"\t"):
+                content.append(field[1:] + b"\n")
+                break
+            key, _, value = field.partition(b" ")
+            fields[key] = value
+        if hexsha not in commit_dates:
+            offset = int(fields[b"committer-tz"])
+            minutes = (abs(offset) // 100 * 60 + abs(offset) % 100) * (
+                1 if offset >= 0 else -1
+            )
+            commit_dates[hexsha] = datetime.fromtimestamp(
+                int(fields[b"committer-time"]), timezone(timedelta(minutes=minutes))
+            )
+        line_dates.append(commit_dates[hexsha])
+    return b"".join(content), line_dates
+
+
+# Function to map the lines of the decoded text of a file to git's line numbers.
+# They only differ when lone carriage returns, which universal newlines treat as
+# line breaks, occur in the content.
+def git_line_numbers(content):
+    if content.count(b"\r") == content.count(b"\r\n"):
+        return None
+    git_lines = [1]
+    for line_break in re.finditer(rb"\r\n|\r|\n", content):
+        git_lines.append(git_lines[-1] + (line_break.group() != b"\r"))
+    return git_lines
+
+
+# Function to extract the comments of a file at a revision and date each one with
+# the newest commit among the lines it spans. Returns output rows with an empty
+# Removed column; a comment found several times keeps its earliest date.
+def blame_file_comments(repo_dir, relative_file_path, files_type, rev=None):
+    absolute_file_path = os.path.join(repo_dir, relative_file_path)
+    content, line_dates = blame_file(repo_dir, rev, relative_file_path)
+    try:
+        text = read_text(absolute_file_path, content)
+    except UnicodeDecodeError as e:
+        error_details.append(
+            {
+                "file_path": relative_file_path,
+                "commit_hash": rev or "HEAD",
+                "error_message": str(e),
+            }
+        )
+        return []
+    git_lines = git_line_numbers(content)
+
+    introduced = {}
+    for record in iter_comments(text, files_type):
+        start_line, end_line = record.start_line, record.end_line
+        if git_lines is not None:
+            start_line, end_line = git_lines[start_line - 1], git_lines[end_line - 1]
+        date = max(line_dates[start_line - 1 : end_line])
+        if record.text not in introduced or date < introduced[record.text]:
+            introduced[record.text] = date
+    return [
+        [absolute_file_path, comment, date, None]
+        for comment, date in introduced.items()
     ]
 
-    # Using tqdm to show progress bar
-    for relative_file_path in tqdm(cpp_files, desc=f"Processing c++ files in {dir}"):
-        checkout_file_versions(repo, dir, relative_file_path, "cpp")
 
-    # Using tqdm to show progress bar
-    for relative_file_path in tqdm(
-        fortran_files, desc=f"Processing fortran files in {dir}"
-    ):
-        checkout_file_versions(repo, dir, relative_file_path, "fortran")
+# Function to blame one file inside a worker process of the surviving-debt miner
+def mine_surviving_job(job):
+    repo_dir, rev, relative_file_path, files_type = job
+    try:
+        rows = blame_file_comments(repo_dir, relative_file_path, files_type, rev)
+    except git.exc.GitCommandError as e:
+        error_details.append(
+            {
+                "file_path": relative_file_path,
+                "commit_hash": rev or "HEAD",
+                "error_message": str(e),
+            }
+        )
+        rows = []
+    errors = list(error_details)
+    error_details.clear()
+    return rows, errors
 
-    # Using tqdm to show progress bar
-    for relative_file_path in tqdm(
-        python_files, desc=f"Processing python files in {dir}"
-    ):
-        checkout_file_versions(repo, dir, relative_file_path, "python")
+
+# Function to mine only the comments that survive at each repository's tag, dated
+# by `git blame` instead of replaying the history of every file. Files are blamed
+# by a pool of `workers` processes and written in the order of the other miners.
+def analyze_surviving_comments(directories, workers, comment_writer):
+    jobs = []
+    for dir, tag in directories:
+        rev = tag or "HEAD"
+        cpp_files, fortran_files, python_files = list_source_files(git.Repo(dir), rev)
+        for files, files_type in (
+            (cpp_files, "cpp"),
+            (fortran_files, "fortran"),
+            (python_files, "python"),
+        ):
+            jobs.extend((dir, rev, f, files_type) for f in files)
+
+    progress = tqdm(total=len(jobs), desc="Blaming surviving comments")
+    if workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            for rows, errors in pool.imap(mine_surviving_job, jobs, chunksize=4):
+                comment_writer.writerows(rows)
+                error_details.extend(errors)
+                progress.update()
+    else:
+        for job in jobs:
+            rows, errors = mine_surviving_job(job)
+            comment_writer.writerows(rows)
+            error_details.extend(errors)
+            progress.update()
+    progress.close()
 
 
 directories = [
@@ -131,7 +776,145 @@ directories = [
     ("../../Projects/MOOSE", None),
 ]
 
-for directory, tag in directories:
-    analyze_git_directory(directory, tag)
-save_defaultdict_to_csv("all_projects_comments.csv")
-save_errors_to_csv("all_projects_errors.csv")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mine comment history of repos")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of worker processes used to mine file histories",
+    )
+    parser.add_argument(
+        "--single-pass",
+        action="store_true",
+        help="walk each repository's history once instead of once per file",
+    )
+    parser.add_argument(
+        "--state",
+        help="checkpoint database used to resume single-pass mining incrementally",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="update each file's comments from the diff hunks between its versions",
+    )
+    parser.add_argument(
+        "--lineage",
+        help="output file for links between edited or moved comments (single-pass)",
+    )
+    parser.add_argument(
+        "--lineage-threshold",
+        type=float,
+        default=0.6,
+        help="minimum similarity of a comment to the one it replaces",
+    )
+    parser.add_argument(
+        "--surviving",
+        action="store_true",
+        help="only mine comments present at the tag, dated with git blame",
+    )
+    parser.add_argument(
+        "--output",
+        default="all_projects_comments.csv",
+        help="output file for mined comments; a .parquet name writes Parquet",
+    )
+    parser.add_argument(
+        "--repo",
+        action="append",
+        help="repository to mine as DIR or DIR@TAG, repeatable "
+        "(default: the directories listed in this script)",
+    )
+    parser.add_argument("--errors", default="all_projects_errors.csv")
+    parser.add_argument(
+        "--cache", default="comment_cache.sqlite", help="cache of extracted comments"
+    )
+    parser.add_argument(
+        "--stats",
+        help="output file for JSON snapshots of the time spent per mining phase; "
+        "also prints the slowest files and largest comment sets at the end",
+    )
+    parser.add_argument(
+        "--stats-every",
+        type=float,
+        default=60.0,
+        help="seconds between two snapshots of the mining stats",
+    )
+    parser.add_argument(
+        "--profile",
+        help="output file for stack samples of the miner, in folded stack format",
+    )
+    parser.add_argument(
+        "--profile-interval",
+        type=float,
+        default=0.01,
+        help="seconds between two stack samples",
+    )
+    args = parser.parse_args()
+    if args.repo:
+        directories = [
+            (directory, tag or None)
+            for directory, _, tag in (repo.partition("@") for repo in args.repo)
+        ]
+    if args.state and args.lineage:
+        # A resumed run would restart the lineage file and its IDs
+        parser.error("--lineage cannot be combined with --state")
+    if args.state or args.lineage:
+        args.single_pass = True
+    if args.single_pass and args.workers > 1:
+        parser.error("--single-pass cannot be combined with --workers")
+    if args.surviving and (args.single_pass or args.incremental):
+        parser.error("--surviving replaces history mining, use it on its own")
+    if args.single_pass and args.incremental:
+        parser.error("--incremental applies to per-file mining, not --single-pass")
+
+    comment_cache = CommentCache(args.cache, EXTRACTOR_VERSION)
+    if args.stats:
+        mining_stats = MiningStats(
+            args.stats,
+            args.stats_every,
+            gauges=lambda: {
+                "files_in_memory": len(comment_store),
+                "comments_in_memory": comment_store.resident_comments(),
+            },
+        )
+    if args.profile:
+        # Worker processes are not sampled, only the main process
+        profiler = StackSampler(args.profile_interval)
+        profiler.start()
+    with open_comment_writer(
+        args.output, [directory for directory, _ in directories]
+    ) as comment_writer:
+        if args.surviving:
+            analyze_surviving_comments(directories, args.workers, comment_writer)
+        elif args.single_pass:
+            state_store = MiningStateStore(args.state) if args.state else None
+            if args.lineage:
+                comment_lineage = CommentLineage(
+                    args.lineage, threshold=args.lineage_threshold
+                )
+            for directory, tag in directories:
+                analyze_git_history(directory, tag, state_store)
+                # The history of a repository is complete once its walk ends
+                comment_store.finish_all(comment_writer)
+        elif args.workers > 1:
+            analyze_git_directories_parallel(
+                directories,
+                args.workers,
+                comment_writer,
+                comment_cache.db_path,
+                args.incremental,
+            )
+        else:
+            for directory, tag in directories:
+                analyze_git_directory(directory, tag, comment_writer, args.incremental)
+    if comment_lineage is not None:
+        comment_lineage.close()
+        print(f"Linked {comment_lineage.edges} edited or moved comments")
+    save_errors_to_csv(args.errors)
+    comment_cache.report()
+    comment_cache.close()
+    if args.profile:
+        profiler.stop()
+        profiler.write(args.profile)
+    if mining_stats is not None:
+        mining_stats.report()
@@ -0,0 +1,516 @@
+import argparse
+import asyncio
+import concurrent.futures
+import email.utils
+import http.client
+import json
+import os
+import random
+import re
+import time
+import urllib.parse
+from datetime import timezone
+from extract_closed_issues import API_URL
+from issue_store import IssueStore
+
+# GitHub repositories of the studied projects
+PROJECT_REPOS = {
+    "Astropy": "astropy/astropy",
+    "Athena": "PrincetonUniversity/athena",
+    "Biopython": "biopython/biopython",
+    "Elmer": "ElmerCSC/elmerfem",
+    "Firedrake": "firedrakeproject/firedrake",
+    "GROMACS": "gromacs/gromacs",
+    "Root": "root-project/root",
+    "MOOSE": "idaholab/moose",
+    "CESM": "ESCOMP/CESM",
+}
+
+LAST_PAGE_LINK = re.compile(r'<([^>]+)>;\s*rel="last"')
+
+
+class RateLimiter:
+    """
+    Token bucket shared by all requests of a harvest.
+
+    Requests are spaced by a bucket of `burst` tokens refilled at `rate` per
+    second. The remaining quota is taken from the X-RateLimit headers of the
+    responses and counted down locally between them. Once fewer than
+    `min_remaining` requests are left, everything waits for the reset. A
+    secondary rate limit halves the rate and pauses all requests for its
+    Retry-After, or for a backoff that doubles with each consecutive hit. Every
+    success then adds back a hundredth of the maximum rate.
+    """
+
+    def __init__(self, rate=10.0, burst=10, min_remaining=10, backoff=60.0):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.refilled = time.monotonic()
+        self.min_remaining = min_remaining
+        self.backoff = backoff
+        self.throttles = 0
+        self.remaining = None
+        self.reset = None
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def _delay(self):
+        now = time.time()
+        if self.paused_until > now:
+            return self.paused_until - now
+        if self.remaining is not None and self.remaining < self.min_remaining:
+            if self.reset is None or self.reset <= now:
+                # The window has rolled over, the next response tells the new quota
+                self.remaining = None
+            else:
+                return self.reset - now + 1  # add 1 second buffer
+        monotonic = time.monotonic()
+        self.tokens = min(
+            self.burst, self.tokens + (monotonic - self.refilled) * self.rate
+        )
+        self.refilled = monotonic
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        return 0
+
+    async def acquire(self):
+        """
+        Wait until a request may be sent and take its token.
+        """
+        async with self.lock:
+            while True:
+                delay = self._delay()
+                if not delay:
+                    break
+                await asyncio.sleep(delay)
+            self.tokens -= 1
+            if self.remaining is not None:
+                self.remaining -= 1
+
+    def update(self, headers):
+        """
+        Take the quota from the headers of a response.
+        """
+        if headers.get("X-RateLimit-Remaining") is None:
+            return
+        remaining = int(headers["X-RateLimit-Remaining"])
+        reset = int(headers.get("X-RateLimit-Reset", 0)) or None
+        # Responses overtake each other, so only a new window may raise the quota
+        if self.remaining is None or reset != self.reset:
+            self.remaining = remaining
+        else:
+            self.remaining = min(self.remaining, remaining)
+        self.reset = reset
+
+    def succeeded(self):
+        self.throttles = 0
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 100)
+
+    def throttled(self, retry_after=None):
+        """
+        Back off after a secondary rate limit.
+        """
+        delay = retry_after or self.backoff * 2**self.throttles
+        self.throttles += 1
+        self.rate = max(self.rate / 2, self.max_rate / 100)
+        self.paused_until = max(self.paused_until, time.time() + delay)
+
+
+class ThreadedTransport:
+    """
+    Keep-alive http.client connections used from a pool of `size` threads, for
+    when aiohttp is not installed.
+    """
+
+    errors = (OSError, http.client.HTTPException)
+
+    def __init__(self, size):
+        self.size = size
+        self.idle = []
+        self.executor = concurrent.futures.ThreadPoolExecutor(size)
+
+    def _connect(self, parts):
+        if parts.scheme == "https":
+            return http.client.HTTPSConnection(parts.netloc, timeout=60)
+        return http.client.HTTPConnection(parts.netloc, timeout=60)
+
+    def _request(self, url, headers):
+        parts = urllib.parse.urlsplit(url)
+        target = urllib.parse.urlunsplit(("", "", parts.path, parts.query, ""))
+        key = (parts.scheme, parts.netloc)
+        connection = None
+        while True:
+            # list.pop is atomic, so threads never share a connection
+            try:
+                idle_key, connection = self.idle.pop()
+                reused = idle_key == key
+                if not reused:
+                    connection.close()
+                    connection = self._connect(parts)
+            except IndexError:
+                reused = False
+                connection = self._connect(parts)
+            try:
+                connection.request("GET", target, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+                break
+            except self.errors:
+                connection.close()
+                # A kept-alive connection may have been closed by the server
+                if not reused:
+                    raise
+        if response.will_close:
+            connection.close()
+        elif len(self.idle) < self.size:
+            self.idle.append((key, connection))
+        else:
+            connection.close()
+        return response.status, response.headers, body
+
+    async def get(self, url, headers):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, self._request, url, headers
+        )
+
+    async def close(self):
+        self.executor.shutdown()
+        while self.idle:
+            self.idle.pop()[1].close()
+
+
+class AiohttpTransport:
+    """
+    Pooled connections of an aiohttp session.
+    """
+
+    def __init__(self, size):
+        import aiohttp
+
+        self.errors = (aiohttp.ClientError, asyncio.TimeoutError)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=size),
+            timeout=aiohttp.ClientTimeout(total=60),
+        )
+
+    async def get(self, url, headers):
+        async with self.session.get(url, headers=headers) as response:
+            return response.status, response.headers, await response.read()
+
+    async def close(self):
+        await self.session.close()
+
+
+# Function to open the aiohttp transport, or the threaded one without aiohttp
+def open_transport(size):
+    try:
+        return AiohttpTransport(size)
+    except ImportError:
+        return ThreadedTransport(size)
+
+
+# Function to convert an HTTP date to the ISO 8601 format of GitHub timestamps
+def iso_timestamp(http_date):
+    date = email.utils.parsedate_to_datetime(http_date).astimezone(timezone.utc)
+    return date.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class IssueHarvester:
+    """
+    Concurrent, incremental harvester of the issues of many GitHub repositories.
+
+    The first harvest of a repository lists all its issues in creation order,
+    which stays stable while issues are updated, so once the first page reports
+    the last page number the other pages are fetched concurrently. Its sync
+    cursor then moves to the server time of the first response, or stays unset
+    if the listing had a single page. Later harvests ask for the issues updated
+    since the cursor, a listing that issues join while it is paged, so they
+    page it one request at a time as IssueFetcher does: oldest update first,
+    re-queried from the newest update of each full page, with the last page
+    keeping the cursor of its request. The next run then sends that same
+    request with the validators of its response, and an unchanged repository
+    costs a single 304.
+
+    At most `concurrency` requests of all repositories are in flight at once,
+    over pooled connections, and a shared RateLimiter spends the API quota.
+    Every page is appended to the repository's JSONL file in `output_dir` and
+    saved in the IssueStore as it arrives, and when a repository is complete
+    its closed issues are written to a CSV file. A failed or interrupted
+    repository is fetched again from its last stored cursor by the next run,
+    and the upserts absorb the pages it already had.
+    """
+
+    def __init__(
+        self,
+        store,
+        output_dir,
+        token=None,
+        base_url=API_URL,
+        concurrency=8,
+        per_page=100,
+        limiter=None,
+        max_retries=5,
+    ):
+        self.store = store
+        self.output_dir = output_dir
+        self.token = token
+        self.base_url = base_url.rstrip("/")
+        self.concurrency = concurrency
+        self.per_page = per_page
+        self.limiter = limiter or RateLimiter()
+        self.max_retries = max_retries
+        self.requests = 0
+        self.transport = None
+        self.slots = None
+
+    def _issues_url(self, repo_name, since, page):
+        # All states, so that reopened issues leave the closed set. Only the
+        # unfiltered listing is in creation order, see the class docstring.
+        query = {
+            "state": "all",
+            "sort": "updated" if since else "created",
+            "direction": "asc",
+            "per_page": self.per_page,
+            "page": page,
+        }
+        if since:
+            query["since"] = since
+        return (
+            f"{self.base_url}/repos/{repo_name}/issues?{urllib.parse.urlencode(query)}"
+        )
+
+    def output_path(self, repo_name, suffix):
+        return os.path.join(self.output_dir, repo_name.replace("/", "__") + suffix)
+
+    async def _get(self, url, conditional=False):
+        """
+        Return the decoded JSON and headers of a GET request, with None as JSON
+        for 304 Not Modified.
+        """
+        headers = {
+            "Accept": "application/vnd.github+json",
+            "User-Agent": "ScientificSATD-issue-harvester",
+        }
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        if conditional:
+            etag, last_modified = self.store.validators(url)
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        failures = 0
+        while True:
+            await self.limiter.acquire()
+            async with self.slots:
+                self.requests += 1
+                try:
+                    status, response_headers, body = await self.transport.get(
+                        url, headers
+                    )
+                except self.transport.errors:
+                    status = None
+            if status is not None:
+                self.limiter.update(response_headers)
+                if status == 304:
+                    self.limiter.succeeded()
+                    return None, response_headers
+                if status == 200:
+                    self.limiter.succeeded()
+                    return json.loads(body), response_headers
+                if status in (403, 429):
+                    retry_after = response_headers.get("Retry-After")
+                    if retry_after:
+                        self.limiter.throttled(int(retry_after))
+                        continue
+                    if response_headers.get("X-RateLimit-Remaining") == "0":
+                        # The limiter now waits for the reset
+                        continue
+                    if status == 429:
+                        self.limiter.throttled()
+                        continue
+                if status < 500:
+                    raise RuntimeError(f"GET {url} failed with status {status}")
+            # Connection errors and server errors are retried with jittered backoff
+            failures += 1
+            if failures > self.max_retries:
+                raise RuntimeError(f"GET {url} failed after {failures} attempts")
+            await asyncio.sleep(random.uniform(0.5, 1.5) * 2 ** (failures - 1))
+
+    def _save_page(self, repo_name, issues, jsonl_file, since=None, validators=None):
+        for issue in issues:
+            record = {
+                key: issue.get(key)
+                for key in (
+                    "id",
+                    "number",
+                    "title",
+                    "body",
+                    "state",
+                    "created_at",
+                    "closed_at",
+                    "updated_at",
+                )
+            }
+            record["labels"] = [label["name"] for label in issue.get("labels", [])]
+            jsonl_file.write(json.dumps(record) + "\n")
+        jsonl_file.flush()
+        self.store.save_issues(repo_name, issues, since, validators)
+
+    async def _harvest_all_pages(
+        self, repo_name, issues, headers, validators, jsonl_file
+    ):
+        """
+        Fetch the other pages of the first listing of a repository concurrently,
+        given its first page, and return how many issues were stored. The
+        validators of the first page are only saved once all pages are, so an
+        interrupted listing is not answered with 304 by the next run.
+        """
+        stored = len(issues)
+        last_link = LAST_PAGE_LINK.search(headers.get("Link") or "")
+        if not last_link:
+            # A single page keeps the cursor unset, so the next run can send the
+            # same conditional request
+            self._save_page(repo_name, issues, jsonl_file, None, validators)
+            return stored
+        self._save_page(repo_name, issues, jsonl_file)
+        newest = max(issue["updated_at"] for issue in issues)
+        last_query = urllib.parse.urlsplit(last_link.group(1)).query
+        last_page = int(urllib.parse.parse_qs(last_query)["page"][0])
+        pages = [
+            asyncio.ensure_future(self._get(self._issues_url(repo_name, None, page)))
+            for page in range(2, last_page + 1)
+        ]
+        try:
+            for page in asyncio.as_completed(pages):
+                issues, _ = await page
+                self._save_page(repo_name, issues, jsonl_file)
+                stored += len(issues)
+                if issues:
+                    newest = max(newest, *(issue["updated_at"] for issue in issues))
+        finally:
+            for page in pages:
+                page.cancel()
+
+        # Issues updated after the first response are fetched by the next run
+        if headers.get("Date"):
+            newest = iso_timestamp(headers["Date"])
+        self.store.save_issues(repo_name, [], newest, validators)
+        return stored
+
+    async def harvest_repo(self, repo_name):
+        """
+        Fetch the issues of a repository updated since its last harvest and
+        return how many were stored.
+        """
+        since = self.store.since(repo_name)
+        page = 1
+        stored = 0
+        jsonl_file = None
+        try:
+            while True:
+                url = self._issues_url(repo_name, since, page)
+                issues, headers = await self._get(url, conditional=True)
+                validators = (url, headers.get("ETag"), headers.get("Last-Modified"))
+                if not issues:
+                    # An empty or unchanged listing keeps the cursor, so the next
+                    # run can send the same conditional request
+                    if issues is not None:
+                        self.store.save_issues(repo_name, [], None, validators)
+                    break
+                if jsonl_file is None:
+                    jsonl_file = open(
+                        self.output_path(repo_name, ".jsonl"), "w", encoding="utf-8"
+                    )
+                if since is None:
+                    stored = await self._harvest_all_pages(
+                        repo_name, issues, headers, validators, jsonl_file
+                    )
+                    break
+                stored += len(issues)
+                if len(issues) < self.per_page:
+                    # Keep the cursor of this request, whose validators the next
+                    # run sends
+                    self._save_page(repo_name, issues, jsonl_file, since, validators)
+                    break
+                new_since = max(issue["updated_at"] for issue in issues)
+                self._save_page(repo_name, issues, jsonl_file, new_since, validators)
+                # As in IssueFetcher, only a full page of issues updated in the
+                # same second needs the next page
+                page = page + 1 if new_since == since else 1
+                since = new_since
+        finally:
+            if jsonl_file is not None:
+                jsonl_file.close()
+
+        self.store.closed_issues(repo_name).to_csv(
+            self.output_path(repo_name, "_closed_issues.csv"), index=False
+        )
+        return stored
+
+    async def harvest(self, repo_names):
+        """
+        Harvest repositories concurrently and return, for each one, the number of
+        issues stored or the exception that stopped it.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.transport = open_transport(self.concurrency)
+        self.slots = asyncio.Semaphore(self.concurrency)
+        try:
+            results = await asyncio.gather(
+                *(self.harvest_repo(repo_name) for repo_name in repo_names),
+                return_exceptions=True,
+            )
+        finally:
+            await self.transport.close()
+        return dict(zip(repo_names, results))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Harvest the issues of many repositories concurrently"
+    )
+    parser.add_argument(
+        "--repos",
+        nargs="+",
+        default=list(PROJECT_REPOS.values()),
+        help="repository names, by default those of the studied projects",
+    )
+    parser.add_argument("--output-dir", default="issues")
+    parser.add_argument(
+        "--store", default="issues.sqlite", help="local issue store database"
+    )
+    parser.add_argument("--base-url", default=API_URL)
+    parser.add_argument(
+        "--concurrency", type=int, default=8, help="maximum requests in flight"
+    )
+    parser.add_argument(
+        "--rate", type=float, default=10.0, help="maximum requests per second"
+    )
+    args = parser.parse_args()
+
+    token = os.getenv("GITHUB_TOKEN")
+    if not token and args.base_url == API_URL:
+        raise ValueError("Please set the GITHUB_TOKEN environment variable")
+
+    store = IssueStore(args.store)
+    harvester = IssueHarvester(
+        store,
+        args.output_dir,
+        token,
+        args.base_url,
+        concurrency=args.concurrency,
+        limiter=RateLimiter(rate=args.rate, burst=args.concurrency),
+    )
+    start_time = time.time()
+    results = asyncio.run(harvester.harvest(args.repos))
+    for repo_name, result in results.items():
+        if isinstance(result, Exception):
+            print(f"{repo_name}: failed, {result}")
+        else:
+            print(f"{repo_name}: {result} updated issues")
+    print(f"{harvester.requests} requests in {time.time() - start_time:.1f} seconds")
+    store.close()
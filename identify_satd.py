@@ -1,12 +1,15 @@
-import pandas as pd
+import argparse
+import multiprocessing
 import re
+from collections import Counter, deque
+import pandas as pd
+from tqdm import tqdm
+from comment_output import iter_comment_chunks
+from satd_matcher import KeywordMatcher, load_keywords
 
-# Load the dataframe (assuming the file is a CSV for example purposes)
-df = pd.read_csv("path_to_your_dataframe.csv")
-
-# Load the keywords from the provided text file
-with open("satd_features.txt", "r") as file:
-    keywords = [line.strip() for line in file.readlines()]
+# Load the keywords from the provided text file and compile them into one matcher
+keywords = load_keywords("satd_features.txt")
+matcher = KeywordMatcher(keywords)
 
 
 # Preprocess comments: tokenizing, converting text to lowercase, and stripping special characters
@@ -20,20 +23,113 @@ def preprocess_comment(comment):
     return " ".join(tokens)
 
 
-df["processed_comment"] = df["comment"].apply(preprocess_comment)
-
-
 # Function to check if any keyword is in the comment
 def contains_keyword(comment):
-    for keyword in keywords:
-        # Match the keyword exactly, but ignore case
-        if re.search(rf"\b{keyword}\b", comment):
-            return True
-    return False
+    return matcher.contains_keyword(comment)
+
+
+# Function to filter one chunk of comments. Returns the matching rows, with the
+# keywords that fired, and the hit counts per (keyword, project).
+def filter_chunk(df):
+    # The miner writes a "Comment" column, labelled datasets use "comment"
+    if "comment" not in df.columns:
+        df = df.rename(columns={"Comment": "comment"})
+    project_column = next((c for c in ("project", "Project") if c in df.columns), None)
+
+    processed_comments = df["comment"].astype(str).map(preprocess_comment)
+    matched_keywords = processed_comments.map(matcher.find_keywords)
+    is_match = matched_keywords.map(bool)
+
+    filtered_df = df[is_match].copy()
+    filtered_df["processed_comment"] = processed_comments[is_match]
+    filtered_df["matched_keywords"] = matched_keywords[is_match].str.join("; ")
+
+    projects = (
+        filtered_df[project_column].astype(str)
+        if project_column
+        else pd.Series("all", index=filtered_df.index)
+    )
+    hits = Counter(
+        (keyword, project)
+        for keywords_fired, project in zip(matched_keywords[is_match], projects)
+        for keyword in keywords_fired
+    )
+    return filtered_df, hits, len(df)
+
+
+# Function to build the keyword x project hit-count table, including unused keywords
+def build_hit_table(hits):
+    hit_table = pd.Series(hits, dtype="int64")
+    if hit_table.empty:
+        hit_table = pd.DataFrame(index=pd.Index(keywords, name="keyword"))
+    else:
+        hit_table = hit_table.unstack(fill_value=0).reindex(keywords, fill_value=0)
+        hit_table.index.name = "keyword"
+    hit_table["total"] = hit_table.sum(axis=1)
+    return hit_table.sort_values("total", ascending=False)
+
+
+# Function to filter a comments file chunk by chunk and append matches to the output
+def identify_satd(input_file, output_file, hits_file, chunk_size=100_000, workers=1):
+    chunks = iter_comment_chunks(input_file, chunk_size)
+    hits = Counter()
+    total_rows = 0
+    matched_rows = 0
+    header = True
+
+    def write_result(result):
+        nonlocal total_rows, matched_rows, header
+        filtered_df, chunk_hits, chunk_rows = result
+        filtered_df.to_csv(
+            output_file, mode="w" if header else "a", header=header, index=False
+        )
+        header = False
+        hits.update(chunk_hits)
+        total_rows += chunk_rows
+        matched_rows += len(filtered_df)
+
+    progress = tqdm(desc="Filtering comment chunks", unit="chunk")
+    if workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            # Keep a bounded window of chunks in flight so memory stays flat,
+            # and write results in input order
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.apply_async(filter_chunk, (chunk,)))
+                if len(pending) >= 2 * workers:
+                    write_result(pending.popleft().get())
+                    progress.update()
+            while pending:
+                write_result(pending.popleft().get())
+                progress.update()
+    else:
+        for chunk in chunks:
+            write_result(filter_chunk(chunk))
+            progress.update()
+    progress.close()
+
+    if header:
+        # No chunks at all, still write an empty output
+        pd.DataFrame().to_csv(output_file, index=False)
+    build_hit_table(hits).to_csv(hits_file)
+    print(f"Matched {matched_rows} of {total_rows} comments")
 
 
-# Filter the dataframe for rows containing any of the keywords
-filtered_df = df[df["processed_comment"].apply(contains_keyword)]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Filter potential SATD comments")
+    parser.add_argument(
+        "--input",
+        default="all_projects_comments.csv",
+        help="comments to filter, as CSV or the Parquet output of extract_git_log.py",
+    )
+    parser.add_argument("--output", default="filtered_comments.csv")
+    parser.add_argument(
+        "--hits",
+        default="keyword_hits.csv",
+        help="output table of matches per keyword and project",
+    )
+    parser.add_argument("--chunk-size", type=int, default=100_000)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
 
-# Save the filtered dataframe to a CSV file
-filtered_df.to_csv("filtered_comments.csv", index=False)
+    identify_satd(args.input, args.output, args.hits, args.chunk_size, args.workers)
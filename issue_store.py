@@ -0,0 +1,134 @@
+import json
+import sqlite3
+import pandas as pd
+
+# Columns of the closed issues output
+ISSUE_COLUMNS = [
+    "id",
+    "number",
+    "title",
+    "body",
+    "state",
+    "created_at",
+    "closed_at",
+    "labels",
+]
+
+
+class IssueStore:
+    """
+    Local copy of the issues of GitHub repositories.
+
+    Besides the issues, the store keeps for every repository the `since` cursor of
+    its last sync, i.e. the newest `updated_at` already stored, and for every
+    requested URL the ETag and Last-Modified validators of its last response, so
+    later runs only fetch what changed and can send conditional requests.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS issues (
+                repo TEXT NOT NULL,
+                id INTEGER NOT NULL,
+                number INTEGER NOT NULL,
+                title TEXT,
+                body TEXT,
+                state TEXT,
+                created_at TEXT,
+                closed_at TEXT,
+                updated_at TEXT,
+                labels TEXT,
+                PRIMARY KEY (repo, id)
+            )
+            """)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS syncs (
+                repo TEXT PRIMARY KEY,
+                since TEXT NOT NULL
+            )
+            """)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS validators (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT
+            )
+            """)
+        self.connection.commit()
+
+    def since(self, repo):
+        """
+        Return the `updated_at` up to which a repository is synced, or None.
+        """
+        row = self.connection.execute(
+            "SELECT since FROM syncs WHERE repo = ?", (repo,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def save_issues(self, repo, issues, since, validators=None):
+        """
+        Store issues as returned by the GitHub API and advance the sync cursor of
+        the repository to `since`, in one transaction. `validators` is the (URL,
+        ETag, Last-Modified) of the response the issues came from, saved in the
+        same transaction so that a 304 never answers for issues not stored.
+        """
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO issues VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        repo,
+                        issue["id"],
+                        issue["number"],
+                        issue.get("title"),
+                        issue.get("body"),
+                        issue.get("state"),
+                        issue.get("created_at"),
+                        issue.get("closed_at"),
+                        issue.get("updated_at"),
+                        json.dumps(
+                            [label["name"] for label in issue.get("labels", [])]
+                        ),
+                    )
+                    for issue in issues
+                ],
+            )
+            if since is not None:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO syncs VALUES (?, ?)", (repo, since)
+                )
+            if validators is not None:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO validators VALUES (?, ?, ?)", validators
+                )
+
+    def validators(self, url):
+        """
+        Return the (ETag, Last-Modified) of the last response for a URL.
+        """
+        row = self.connection.execute(
+            "SELECT etag, last_modified FROM validators WHERE url = ?", (url,)
+        ).fetchone()
+        return row if row else (None, None)
+
+    def closed_issues(self, repo):
+        """
+        Return the stored closed issues of a repository as a DataFrame with the
+        columns of the original closed issues CSV, newest issue first.
+        """
+        df = pd.read_sql_query(
+            "SELECT id, number, title, body, state, created_at, closed_at, labels "
+            "FROM issues WHERE repo = ? AND state = 'closed' ORDER BY number DESC",
+            self.connection,
+            params=(repo,),
+        )
+        for column in ("created_at", "closed_at"):
+            df[column] = pd.to_datetime(df[column], utc=True)
+        df["labels"] = df["labels"].map(json.loads)
+        return df[ISSUE_COLUMNS]
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,113 @@
+import sqlite3
+from datetime import datetime
+
+
+class MiningStateStore:
+    """
+    Persistent checkpoint of the comment history mined from each repository.
+
+    For every repository the store keeps the last processed commit together with
+    the introduced/removed dates of every comment seen so far and each file's
+    current comment set, so an interrupted or nightly run can resume from the
+    checkpoint and only process newer commits.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                repo_dir TEXT PRIMARY KEY,
+                last_commit TEXT NOT NULL
+            )
+            """)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS comments (
+                repo_dir TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                comment TEXT NOT NULL,
+                introduced TEXT,
+                removed TEXT,
+                is_current INTEGER NOT NULL,
+                PRIMARY KEY (file_path, comment)
+            )
+            """)
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS comments_repo_dir ON comments (repo_dir)"
+        )
+        self.connection.commit()
+
+    def last_commit(self, repo_dir):
+        """
+        Return the last commit checkpointed for a repository, or None.
+        """
+        row = self.connection.execute(
+            "SELECT last_commit FROM checkpoints WHERE repo_dir = ?", (repo_dir,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def load(self, repo_dir, comment_store):
+        """
+        Restore the checkpointed comments of a repository into `comment_store` and
+        return the last processed commit, or None if there is no checkpoint.
+        """
+        rows = self.connection.execute(
+            "SELECT file_path, comment, introduced, removed, is_current "
+            "FROM comments WHERE repo_dir = ?",
+            (repo_dir,),
+        )
+        for file_path, comment, introduced, removed, is_current in rows:
+            comment_store.restore(
+                file_path,
+                comment,
+                _parse_date(introduced),
+                _parse_date(removed),
+                is_current,
+            )
+        return self.last_commit(repo_dir)
+
+    def save(self, repo_dir, last_commit, comment_store, file_paths):
+        """
+        Checkpoint the given files of a repository and its last processed commit.
+        Files no longer present in `comment_store` (e.g. renamed) are dropped.
+        """
+        with self.connection:
+            for file_path in file_paths:
+                self.connection.execute(
+                    "DELETE FROM comments WHERE file_path = ?", (file_path,)
+                )
+                if file_path not in comment_store:
+                    continue
+
+                self.connection.executemany(
+                    "INSERT INTO comments VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (
+                            repo_dir,
+                            file_path,
+                            comment,
+                            _format_date(introduced),
+                            _format_date(removed),
+                            is_current,
+                        )
+                        for comment, introduced, removed, is_current in (
+                            comment_store.rows(file_path)
+                        )
+                    ],
+                )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?)",
+                (repo_dir, last_commit),
+            )
+
+    def close(self):
+        self.connection.close()
+
+
+def _format_date(date):
+    return date.isoformat() if date is not None else None
+
+
+def _parse_date(date):
+    return datetime.fromisoformat(date) if date is not None else None
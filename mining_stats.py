@@ -0,0 +1,253 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+# Phases of mining a file version, in the order they happen
+PHASES = ("git", "read", "cache", "extract", "diff")
+
+
+class MiningStats:
+    """
+    Timers and counters of the history miner, per phase and per file.
+
+    The miner reports the seconds of each phase (running git, reading blobs,
+    looking up the comment cache, extracting comments and diffing comment sets),
+    the bytes it reads and the size of each file's comment set after every
+    version. With a `snapshot_path`, a JSON line with the totals so far is
+    appended every `snapshot_every` seconds, and a final one with the ranking of
+    the slowest files and largest comment sets when the miner is done. `gauges`
+    is an optional function returning more values to include in each snapshot.
+    """
+
+    def __init__(self, snapshot_path=None, snapshot_every=60.0, gauges=None):
+        self.snapshot_path = snapshot_path
+        self.snapshot_every = snapshot_every
+        self.gauges = gauges
+        self.started = time.perf_counter()
+        self.next_snapshot = self.started + snapshot_every
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.counters = Counter()
+        # Per file: [seconds, versions, bytes read, largest comment set]
+        self.files = {}
+        self.last_file = None
+        if snapshot_path:
+            # Each run starts a new series of snapshots
+            open(snapshot_path, "w").close()
+
+    def _file(self, file_path):
+        cost = self.files.get(file_path)
+        if cost is None:
+            cost = self.files[file_path] = [0.0, 0, 0, 0]
+        return cost
+
+    def time(self, phase, file_path, function, *args):
+        """
+        Call a function and add its run time to a phase and, unless `file_path`
+        is None, to the cost of that file.
+        """
+        start = time.perf_counter()
+        result = function(*args)
+        seconds = time.perf_counter() - start
+        self.phases[phase] += seconds
+        if file_path is not None:
+            self._file(file_path)[0] += seconds
+        return result
+
+    def time_iter(self, phase, file_path, iterable):
+        """
+        Yield the items of an iterable, adding the time spent producing them to
+        a phase like `time`.
+        """
+        iterator = iter(iterable)
+        while True:
+            try:
+                item = self.time(phase, file_path, next, iterator)
+            except StopIteration:
+                return
+            yield item
+
+    def read_bytes(self, file_path, size):
+        self.counters["bytes_read"] += size
+        self._file(file_path)[2] += size
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def file_version(self, file_path, comments):
+        """
+        Record that a version of a file was mined and left `comments` comments in
+        its current set, and write a snapshot when one is due.
+        """
+        cost = self._file(file_path)
+        cost[1] += 1
+        cost[3] = max(cost[3], comments)
+        self.counters["file_versions"] += 1
+        self.last_file = file_path
+        if self.snapshot_path and time.perf_counter() >= self.next_snapshot:
+            self.write_snapshot()
+
+    def drain(self):
+        """
+        Return the stats collected so far and reset them, so a worker process can
+        hand them over to the parent's stats with `merge`.
+        """
+        stats = {
+            "phases": self.phases,
+            "counters": dict(self.counters),
+            "files": self.files,
+        }
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.counters = Counter()
+        self.files = {}
+        return stats
+
+    def merge(self, stats):
+        for phase, seconds in stats["phases"].items():
+            self.phases[phase] += seconds
+        self.counters.update(stats["counters"])
+        for file_path, (seconds, versions, size, comments) in stats["files"].items():
+            cost = self._file(file_path)
+            cost[0] += seconds
+            cost[1] += versions
+            cost[2] += size
+            cost[3] = max(cost[3], comments)
+            self.last_file = file_path
+        if self.snapshot_path and time.perf_counter() >= self.next_snapshot:
+            self.write_snapshot()
+
+    def ranking(self, column, top):
+        ranked = sorted(self.files.items(), key=lambda item: item[1][column])
+        return [
+            {
+                "file_path": file_path,
+                "seconds": round(seconds, 6),
+                "versions": versions,
+                "bytes_read": size,
+                "largest_comment_set": comments,
+            }
+            for file_path, (seconds, versions, size, comments) in ranked[::-1][:top]
+        ]
+
+    def slowest_directories(self, top):
+        seconds = Counter()
+        for file_path, cost in self.files.items():
+            seconds[os.path.dirname(file_path)] += cost[0]
+        return [
+            {"directory": directory, "seconds": round(total, 6)}
+            for directory, total in seconds.most_common(top)
+        ]
+
+    def snapshot(self, top=5):
+        """
+        Return the totals so far as a JSON-serialisable dictionary, with the `top`
+        slowest files.
+        """
+        elapsed = time.perf_counter() - self.started
+        snapshot = {
+            "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "elapsed": round(elapsed, 3),
+            "phases": {phase: round(s, 6) for phase, s in self.phases.items()},
+            "counters": dict(self.counters),
+            "file_versions_per_second": (
+                self.counters["file_versions"] / elapsed if elapsed else 0.0
+            ),
+            "files": len(self.files),
+            "last_file": self.last_file,
+            "slowest_files": self.ranking(0, top),
+        }
+        if self.gauges is not None:
+            snapshot.update(self.gauges())
+        return snapshot
+
+    def write_snapshot(self, final=False, top=20):
+        snapshot = self.snapshot(top)
+        snapshot["final"] = final
+        if final:
+            snapshot["largest_comment_sets"] = self.ranking(3, top)
+            snapshot["slowest_directories"] = self.slowest_directories(top)
+        with open(self.snapshot_path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(snapshot) + "\n")
+        self.next_snapshot = time.perf_counter() + self.snapshot_every
+
+    def report(self, top=10):
+        """
+        Print the time per phase and the files with the most time spent and the
+        largest comment sets, then write the final snapshot.
+        """
+        total = sum(self.phases.values())
+        print(
+            f"Mined {self.counters['file_versions']} file versions of "
+            f"{len(self.files)} files in {time.perf_counter() - self.started:.1f}s"
+        )
+        for phase, seconds in self.phases.items():
+            share = seconds / total if total else 0.0
+            print(f"  {phase:<8}{seconds:>10.2f}s {share:>6.1%}")
+
+        print(f"Slowest {top} files:")
+        for row in self.ranking(0, top):
+            print(
+                f"  {row['seconds']:>10.2f}s {row['versions']:>6} versions  "
+                f"{row['file_path']}"
+            )
+        print(f"Largest {top} comment sets:")
+        for row in self.ranking(3, top):
+            print(f"  {row['largest_comment_set']:>10} comments  {row['file_path']}")
+
+        if self.snapshot_path:
+            self.write_snapshot(final=True)
+
+
+class StackSampler:
+    """
+    Sampling profiler of one thread. A background thread records the thread's
+    stack every `interval` seconds, and `write` saves the counts in the folded
+    stack format of flame graph tools ("frame;frame;frame count" per line).
+
+    Only the sampling thread does any work, so the profiled code runs unchanged.
+    """
+
+    def __init__(self, interval=0.01, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{stack} {count}\n")
+        print(f"Saved {self.samples} profile samples to {path}")
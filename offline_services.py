@@ -0,0 +1,136 @@
+import argparse
+import json
+import os
+import re
+import pandas as pd
+from issue_store import IssueStore
+
+# Words that mark an issue as scientific for the stand-in of the LLM
+SCIENCE_TERMS = re.compile(
+    r"\b(?:scien\w*|physic\w*|parameteri[sz]\w*|equations?|algorithms?|"
+    r"numeric\w*|conserv\w*|fluxe?s?|temperatures?|precipitation|radiation|"
+    r"soil|carbon|nitrogen|hydrolog\w*|biogeochem\w*|albedo|photosynthesis|"
+    r"bias(?:es)?|calibrat\w*|climat\w*)\b",
+    re.I,
+)
+
+
+# Function to read issues saved as JSON lines, by harvest_issues.py or from the API
+def load_issue_records(source):
+    issues = []
+    with open(source, encoding="utf-8") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            issue = json.loads(line)
+            # The harvester keeps label names, the API label objects
+            issue["labels"] = [
+                label if isinstance(label, dict) else {"name": label}
+                for label in issue.get("labels") or []
+            ]
+            issues.append(issue)
+    return issues
+
+
+def replay_issues(source, repo_name, output_file):
+    """
+    Stand-in of extract_closed_issues.py: load issues from a local JSON lines
+    file into an in-memory issue store and save its closed issues as the same
+    CSV the GitHub fetcher writes.
+    """
+    store = IssueStore(":memory:")
+    store.save_issues(repo_name, load_issue_records(source), None)
+    df = store.closed_issues(repo_name)
+    store.close()
+    df.to_csv(output_file, index=False)
+    print(f"Saved {len(df)} closed issues to {output_file}")
+
+
+# Function to list the request files of a batch request directory or file
+def request_files(path):
+    if os.path.isdir(path):
+        return sorted(
+            os.path.join(path, name)
+            for name in os.listdir(path)
+            if name.endswith(".jsonl")
+        )
+    return [path]
+
+
+def answer_requests(request_paths, output_file, prescreen_model=None):
+    """
+    Stand-in of the Batch API: answer every request of the batch request files
+    with an `impacts_science` label and write the answers in the format of a
+    batch output file. Labels come from a pre-screen model if one is given,
+    otherwise from a list of scientific terms.
+    """
+    requests = []
+    for path in request_paths:
+        for request_file in request_files(path):
+            with open(request_file, encoding="utf-8") as file:
+                requests.extend(json.loads(line) for line in file if line.strip())
+    texts = [request["body"]["messages"][-1]["content"] for request in requests]
+
+    if prescreen_model is not None and requests:
+        # Imported here, as it needs scikit-learn
+        from prescreen import PrescreenClassifier
+
+        classifier = PrescreenClassifier.load(prescreen_model)
+        probabilities = classifier.probabilities(
+            pd.DataFrame({"title": texts, "body": ""})
+        )
+        labels = ["yes" if p >= 0.5 else "no" for p in probabilities]
+    else:
+        labels = ["yes" if SCIENCE_TERMS.search(text) else "no" for text in texts]
+
+    with open(output_file, "w", encoding="utf-8") as file:
+        for number, (request, label) in enumerate(zip(requests, labels)):
+            content = json.dumps({"impacts_science": label})
+            result = {
+                "id": f"batch_req_{number}",
+                "custom_id": request["custom_id"],
+                "response": {
+                    "status_code": 200,
+                    "body": {
+                        "model": request["body"]["model"],
+                        "choices": [
+                            {
+                                "index": 0,
+                                "message": {"role": "assistant", "content": content},
+                                "finish_reason": "stop",
+                            }
+                        ],
+                    },
+                },
+                "error": None,
+            }
+            file.write(json.dumps(result) + "\n")
+    print(f"Answered {len(requests)} requests in {output_file}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Local stand-ins of the GitHub and OpenAI services"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    issues = commands.add_parser("issues", help="replay closed issues from a file")
+    issues.add_argument("--source", required=True, help="issues as JSON lines")
+    issues.add_argument("--repo", default="ESCOMP/CTSM", help="repository name")
+    issues.add_argument("--output", default="closed_issues.csv")
+
+    respond = commands.add_parser("respond", help="answer batch requests locally")
+    respond.add_argument(
+        "--requests",
+        nargs="+",
+        required=True,
+        help="batch request files or directories of them",
+    )
+    respond.add_argument("--output", default="requests_output.jsonl")
+    respond.add_argument("--prescreen", help="pre-screen model to label with")
+    args = parser.parse_args()
+
+    if args.command == "issues":
+        replay_issues(args.source, args.repo, args.output)
+    else:
+        answer_requests(args.requests, args.output, args.prescreen)
@@ -0,0 +1,576 @@
+import argparse
+import ast
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# The scripts of the stages live next to this file and are run from here
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class Stage:
+    """
+    One step of the pipeline: a command that reads input files and writes output
+    files. Outputs ending with a path separator are directories.
+
+    A stage is re-run when its fingerprint changes: the content hashes of its
+    inputs and of the local modules its script imports, its arguments, and
+    `params`, a function returning anything else its outputs depend on.
+    `untracked` arguments, such as the number of workers, do not change the
+    outputs. Volatile stages read external services and always run, but stages
+    after them still only run when their outputs change.
+    """
+
+    def __init__(
+        self,
+        name,
+        script,
+        arguments=(),
+        inputs=(),
+        outputs=(),
+        params=None,
+        untracked=(),
+        stdout=None,
+        volatile=False,
+    ):
+        self.name = name
+        self.script = script
+        self.arguments = [str(argument) for argument in arguments]
+        self.untracked = [str(argument) for argument in untracked]
+        self.inputs = list(inputs)
+        self.outputs = list(outputs) + ([stdout] if stdout else [])
+        self.params = params
+        self.stdout = stdout
+        self.volatile = volatile
+
+    @property
+    def command(self):
+        return [sys.executable, self.script, *self.arguments, *self.untracked]
+
+
+# Function to list a script and the modules of this directory it imports, recursively
+def local_modules(script):
+    pending = [os.path.join(SCRIPT_DIR, script)]
+    found = set()
+    while pending:
+        path = pending.pop()
+        if path in found or not os.path.exists(path):
+            continue
+        found.add(path)
+        with open(path, encoding="utf-8") as file:
+            tree = ast.parse(file.read(), path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names = [node.module]
+            else:
+                continue
+            pending.extend(
+                os.path.join(SCRIPT_DIR, name.split(".")[0] + ".py") for name in names
+            )
+    return sorted(found)
+
+
+class PipelineState:
+    """
+    Fingerprints of the stages that ran and the content hashes of the files they
+    produced, in a SQLite database. File hashes are cached by size and
+    modification time, so unchanged large inputs are not read again.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                hash TEXT NOT NULL
+            )
+            """)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS stages (
+                name TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                outputs TEXT NOT NULL
+            )
+            """)
+        self.connection.commit()
+
+    def file_hash(self, path):
+        """
+        Return the content hash of a file or directory, or None if it is missing.
+        """
+        path = os.path.abspath(path)
+        if os.path.isdir(path):
+            digest = hashlib.sha256()
+            for name in sorted(os.listdir(path)):
+                digest.update(
+                    f"{name}\0{self.file_hash(os.path.join(path, name))}\0".encode()
+                )
+            return digest.hexdigest()
+        if not os.path.exists(path):
+            return None
+
+        stat = os.stat(path)
+        row = self.connection.execute(
+            "SELECT hash FROM files WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (path, stat.st_size, stat.st_mtime_ns),
+        ).fetchone()
+        if row:
+            return row[0]
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1024**2), b""):
+                digest.update(chunk)
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                (path, stat.st_size, stat.st_mtime_ns, digest.hexdigest()),
+            )
+        return digest.hexdigest()
+
+    def record(self, name):
+        """
+        Return the fingerprint and output hashes of the last run of a stage.
+        """
+        row = self.connection.execute(
+            "SELECT fingerprint, outputs FROM stages WHERE name = ?", (name,)
+        ).fetchone()
+        return (row[0], json.loads(row[1])) if row else (None, {})
+
+    def save(self, name, fingerprint, outputs):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO stages VALUES (?, ?, ?)",
+                (name, fingerprint, json.dumps(outputs)),
+            )
+
+    def close(self):
+        self.connection.close()
+
+
+class Pipeline:
+    """
+    Stages connected by their files: a stage runs after the stages that write its
+    inputs. Stages run as separate processes, and stages that do not depend on
+    each other run concurrently.
+    """
+
+    def __init__(self, stages, state, log_dir, jobs=2):
+        self.stages = {stage.name: stage for stage in stages}
+        self.state = state
+        self.log_dir = log_dir
+        self.jobs = jobs
+        writers = {}
+        for stage in stages:
+            for output in stage.outputs:
+                if output in writers:
+                    raise ValueError(f"{output} is written by {writers[output]} too")
+                writers[output] = stage.name
+        self.dependencies = {
+            stage.name: {writers[path] for path in stage.inputs if path in writers}
+            for stage in stages
+        }
+
+    def fingerprint(self, stage):
+        hashes = {}
+        for path in stage.inputs:
+            hashes[path] = self.state.file_hash(path)
+            if hashes[path] is None:
+                raise FileNotFoundError(f"input {path} of {stage.name} is missing")
+        code = {
+            os.path.basename(path): self.state.file_hash(path)
+            for path in local_modules(stage.script)
+        }
+        content = {
+            "inputs": hashes,
+            "code": code,
+            "arguments": stage.arguments,
+            "params": stage.params() if stage.params else None,
+        }
+        return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+    def up_to_date(self, stage, fingerprint):
+        recorded_fingerprint, outputs = self.state.record(stage.name)
+        return recorded_fingerprint == fingerprint and all(
+            self.state.file_hash(path) == outputs.get(path) for path in stage.outputs
+        )
+
+    def execute(self, stage):
+        # Outputs of an earlier run must not survive into this one
+        for output in stage.outputs:
+            if output.endswith(os.sep):
+                shutil.rmtree(output, ignore_errors=True)
+                os.makedirs(output)
+            else:
+                if os.path.exists(output):
+                    os.remove(output)
+                os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+
+        log_file = os.path.join(self.log_dir, f"{stage.name}.log")
+        start_time = time.time()
+        with open(log_file, "w", encoding="utf-8") as log:
+            stdout = open(stage.stdout, "w", encoding="utf-8") if stage.stdout else log
+            try:
+                process = subprocess.run(
+                    stage.command, cwd=SCRIPT_DIR, stdout=stdout, stderr=log
+                )
+            finally:
+                if stage.stdout:
+                    stdout.close()
+        return process.returncode, time.time() - start_time
+
+    def run(self, targets=None, force=(), dry_run=False):
+        """
+        Run the target stages, all by default, and the stages they depend on.
+        Returns the status of every stage: "ran", "up to date", "would run",
+        "failed" or "skipped" after a failed dependency.
+        """
+        needed = set()
+        pending = list(targets or self.stages)
+        while pending:
+            name = pending.pop()
+            if name not in self.stages:
+                raise ValueError(f"unknown stage {name}")
+            if name not in needed:
+                needed.add(name)
+                pending.extend(self.dependencies[name])
+
+        os.makedirs(self.log_dir, exist_ok=True)
+        status = {}
+        running = {}
+        with ThreadPoolExecutor(self.jobs) as executor:
+            while len(status) < len(needed):
+                for name in sorted(needed - status.keys() - running.keys()):
+                    dependencies = self.dependencies[name]
+                    if any(
+                        status.get(d) in ("failed", "skipped") for d in dependencies
+                    ):
+                        status[name] = "skipped"
+                        print(f"[{name}] skipped after a failed dependency")
+                        continue
+                    if not all(d in status for d in dependencies):
+                        continue
+                    stage = self.stages[name]
+                    if any(status[d] == "would run" for d in dependencies):
+                        # Its inputs are not known without running the others
+                        status[name] = "would run"
+                        print(f"[{name}] would run: {' '.join(stage.command)}")
+                        continue
+                    try:
+                        fingerprint = self.fingerprint(stage)
+                    except (OSError, subprocess.CalledProcessError) as e:
+                        status[name] = "failed"
+                        print(f"[{name}] failed: {e}")
+                        continue
+                    if (
+                        not stage.volatile
+                        and name not in force
+                        and self.up_to_date(stage, fingerprint)
+                    ):
+                        status[name] = "up to date"
+                        print(f"[{name}] up to date")
+                    elif dry_run:
+                        status[name] = "would run"
+                        print(f"[{name}] would run: {' '.join(stage.command)}")
+                    else:
+                        print(f"[{name}] running")
+                        future = executor.submit(self.execute, stage)
+                        running[name] = (future, fingerprint)
+                if not running:
+                    continue
+
+                done, _ = wait(
+                    [future for future, _ in running.values()],
+                    return_when=FIRST_COMPLETED,
+                )
+                for name, (future, fingerprint) in list(running.items()):
+                    if future not in done:
+                        continue
+                    del running[name]
+                    stage = self.stages[name]
+                    returncode, seconds = future.result()
+                    log_file = os.path.join(self.log_dir, f"{name}.log")
+                    missing = [
+                        path
+                        for path in stage.outputs
+                        if self.state.file_hash(path) is None
+                    ]
+                    if returncode != 0 or missing:
+                        status[name] = "failed"
+                        reason = (
+                            f"exit code {returncode}"
+                            if returncode
+                            else f"missing {', '.join(missing)}"
+                        )
+                        print(f"[{name}] failed ({reason}), see {log_file}")
+                        continue
+                    outputs = {
+                        path: self.state.file_hash(path) for path in stage.outputs
+                    }
+                    self.state.save(name, fingerprint, outputs)
+                    status[name] = "ran"
+                    print(f"[{name}] finished in {seconds:.1f} seconds")
+        return status
+
+
+# Function to resolve the commit a repository revision points to
+def git_revision(directory, tag=None):
+    return subprocess.run(
+        ["git", "rev-parse", f"{tag or 'HEAD'}^{{commit}}"],
+        cwd=directory,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.strip()
+
+
+def build_stages(
+    workdir,
+    repos,
+    issue_repo,
+    labelled_issues,
+    offline=False,
+    issue_source=None,
+    prescreen_model=None,
+    response_cache="gpt_responses.sqlite",
+    workers=1,
+):
+    """
+    Return the stages of the study: mine -> filter for the comments, and
+    issues -> batch -> (respond) -> ingest -> metrics for the issues. Offline,
+    the issues are replayed from `issue_source` and the batches are answered by
+    the local stand-in instead of the Batch API.
+    """
+
+    def path(name):
+        return os.path.join(workdir, name)
+
+    response_cache = os.path.abspath(response_cache)
+    stages = [
+        Stage(
+            "mine",
+            "extract_git_log.py",
+            [
+                *(f"--repo={d}@{t}" if t else f"--repo={d}" for d, t in repos),
+                "--output",
+                path("all_projects_comments.csv"),
+                "--errors",
+                path("all_projects_errors.csv"),
+            ],
+            outputs=[
+                path("all_projects_comments.csv"),
+                path("all_projects_errors.csv"),
+            ],
+            # Mining reads commits only, so the commits mined fingerprint the repos
+            params=lambda: [git_revision(d, t) for d, t in repos],
+            # The comment cache grows large, it belongs in the working directory
+            untracked=["--workers", workers, "--cache", path("comment_cache.sqlite")],
+        ),
+        Stage(
+            "filter",
+            "identify_satd.py",
+            [
+                "--input",
+                path("all_projects_comments.csv"),
+                "--output",
+                path("filtered_comments.csv"),
+                "--hits",
+                path("keyword_hits.csv"),
+            ],
+            inputs=[
+                path("all_projects_comments.csv"),
+                os.path.join(SCRIPT_DIR, "satd_features.txt"),
+            ],
+            outputs=[path("filtered_comments.csv"), path("keyword_hits.csv")],
+            untracked=["--workers", workers],
+        ),
+    ]
+
+    if offline:
+        stages.append(
+            Stage(
+                "issues",
+                "offline_services.py",
+                [
+                    "issues",
+                    "--source",
+                    issue_source,
+                    "--repo",
+                    issue_repo,
+                    "--output",
+                    path("closed_issues.csv"),
+                ],
+                inputs=[issue_source],
+                outputs=[path("closed_issues.csv")],
+            )
+        )
+    else:
+        stages.append(
+            Stage(
+                "issues",
+                "extract_closed_issues.py",
+                ["--repo", issue_repo, "--output", path("closed_issues.csv")],
+                outputs=[path("closed_issues.csv")],
+                volatile=True,
+            )
+        )
+
+    prescreen = ["--prescreen", prescreen_model] if prescreen_model else []
+    prescreen_inputs = [prescreen_model] if prescreen_model else []
+    requests_dir = os.path.join(path("requests"), "")
+    stages.append(
+        Stage(
+            "batch",
+            "send_gpt_request.py",
+            [
+                "--input",
+                path("closed_issues.csv"),
+                "--manifest",
+                path("requests_manifest.csv"),
+                "--cache",
+                response_cache,
+                "--requests-prefix",
+                os.path.join(requests_dir, "batch_requests"),
+                "--batch-ids",
+                path("batch_ids.txt"),
+                *prescreen,
+                *(["--no-submit"] if offline else []),
+            ],
+            inputs=[path("closed_issues.csv"), *prescreen_inputs],
+            outputs=[path("requests_manifest.csv"), requests_dir]
+            + ([] if offline else [path("batch_ids.txt")]),
+        )
+    )
+
+    if offline:
+        stages.append(
+            Stage(
+                "respond",
+                "offline_services.py",
+                [
+                    "respond",
+                    "--requests",
+                    requests_dir,
+                    "--output",
+                    path("batch_output.jsonl"),
+                    *prescreen,
+                ],
+                inputs=[requests_dir, *prescreen_inputs],
+                outputs=[path("batch_output.jsonl")],
+            )
+        )
+        results = ["--results", path("batch_output.jsonl")]
+    else:
+        results = ["--batch-ids", path("batch_ids.txt")]
+
+    stages += [
+        Stage(
+            "ingest",
+            "analyze_gpt_predictions.py",
+            [
+                "--issues",
+                labelled_issues,
+                "--manifest",
+                path("requests_manifest.csv"),
+                "--cache",
+                response_cache,
+                "--output",
+                path("ctsm_issues_labelled.csv"),
+                "--errors",
+                path("gpt_errors.csv"),
+                *results,
+            ],
+            inputs=[labelled_issues, path("requests_manifest.csv"), results[1]],
+            outputs=[path("ctsm_issues_labelled.csv"), path("gpt_errors.csv")],
+            # Online, batches finish after they are submitted
+            volatile=not offline,
+        ),
+        Stage(
+            "metrics",
+            "evaluation.py",
+            ["--input", path("ctsm_issues_labelled.csv"), "--resamples", 2000],
+            inputs=[path("ctsm_issues_labelled.csv")],
+            stdout=path("metrics.txt"),
+        ),
+    ]
+    return stages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the study pipeline")
+    parser.add_argument(
+        "stages",
+        nargs="*",
+        help="stages to run with their dependencies (default: all)",
+    )
+    parser.add_argument("--workdir", default="pipeline_output")
+    parser.add_argument(
+        "--repo",
+        action="append",
+        help="repository to mine as DIR or DIR@TAG, repeatable "
+        "(default: the directories listed in extract_git_log.py)",
+    )
+    parser.add_argument("--issue-repo", default="ESCOMP/CTSM")
+    parser.add_argument(
+        "--labelled",
+        default="filtered_df.csv",
+        help="issues with manual impacts_science labels",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="replay issues from --issue-source and answer batches locally",
+    )
+    parser.add_argument("--issue-source", help="issues as JSON lines (offline)")
+    parser.add_argument("--prescreen", help="pre-screen model trained by prescreen.py")
+    parser.add_argument("--response-cache", default="gpt_responses.sqlite")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--jobs", type=int, default=2, help="stages run at the same time"
+    )
+    parser.add_argument(
+        "--force", action="append", default=[], help="stage to run even if unchanged"
+    )
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    if args.offline and not args.issue_source:
+        parser.error("--offline needs --issue-source")
+
+    if args.repo:
+        repos = [(d, t or None) for d, _, t in (r.partition("@") for r in args.repo)]
+    else:
+        # Imported here, as loading the miner needs GitPython
+        from extract_git_log import directories as repos
+
+    workdir = os.path.abspath(args.workdir)
+    os.makedirs(workdir, exist_ok=True)
+    stages = build_stages(
+        workdir,
+        [(os.path.abspath(d), t) for d, t in repos],
+        args.issue_repo,
+        os.path.abspath(args.labelled),
+        args.offline,
+        args.issue_source and os.path.abspath(args.issue_source),
+        args.prescreen and os.path.abspath(args.prescreen),
+        args.response_cache,
+        args.workers,
+    )
+    state = PipelineState(os.path.join(workdir, "pipeline_state.sqlite"))
+    pipeline = Pipeline(stages, state, os.path.join(workdir, "logs"), args.jobs)
+    start_time = time.time()
+    status = pipeline.run(args.stages or None, args.force, args.dry_run)
+    state.close()
+    print(f"Pipeline finished in {time.time() - start_time:.1f} seconds")
+    if "failed" in status.values():
+        sys.exit(1)
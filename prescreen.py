@@ -0,0 +1,171 @@
+import argparse
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import StratifiedKFold, cross_val_predict
+from sklearn.pipeline import make_pipeline
+
+
+# Function to join the title and description of each issue into one text
+def issue_texts(df):
+    return df["title"].fillna("").astype(str) + "\n" + df["body"].fillna("").astype(str)
+
+
+# Function to build the TF-IDF and logistic regression pipeline
+def make_classifier():
+    return make_pipeline(
+        TfidfVectorizer(
+            ngram_range=(1, 2), min_df=2, max_features=50_000, sublinear_tf=True
+        ),
+        LogisticRegression(class_weight="balanced", max_iter=1000),
+    )
+
+
+def confidence_band(probabilities, labels, target_accuracy):
+    """
+    Return the (low, high) probability thresholds outside of which labels can be
+    assigned automatically: the issues at or above `high` are labelled "yes" and
+    those at or below `low` "no", each group as large as possible while its
+    accuracy on the given labels (1 for "yes") stays at `target_accuracy`.
+    """
+    order = np.argsort(-probabilities, kind="stable")
+    ranks = np.arange(1, len(order) + 1)
+
+    precision = np.cumsum(labels[order]) / ranks
+    confident = np.flatnonzero(
+        (precision >= target_accuracy) & (probabilities[order] > 0.5)
+    )
+    high = probabilities[order][confident[-1]] if confident.size else np.inf
+
+    order = order[::-1]
+    negative_precision = np.cumsum(1 - labels[order]) / ranks
+    confident = np.flatnonzero(
+        (negative_precision >= target_accuracy) & (probabilities[order] < 0.5)
+    )
+    low = probabilities[order][confident[-1]] if confident.size else -np.inf
+    return low, high
+
+
+class PrescreenClassifier:
+    """
+    Cheap local classifier that labels the issues it is confident about, so that
+    only the uncertain ones are sent to the LLM.
+
+    A TF-IDF and logistic regression model is trained on the labelled
+    `impacts_science` issues. Its confidence band is chosen on cross-validated
+    probabilities, so that the automatic "yes" and "no" labels each reach
+    `target_accuracy`. Issues with a probability inside the band get no label.
+    """
+
+    def __init__(self, target_accuracy=0.95, folds=5):
+        self.target_accuracy = target_accuracy
+        self.folds = folds
+        self.pipeline = None
+        self.low = -np.inf
+        self.high = np.inf
+        self.cv_probabilities = None
+
+    def fit(self, df):
+        texts = issue_texts(df)
+        labels = (df["impacts_science"] == "yes").to_numpy(dtype=np.int64)
+        folds = StratifiedKFold(self.folds, shuffle=True, random_state=0)
+        self.cv_probabilities = cross_val_predict(
+            make_classifier(), texts, labels, cv=folds, method="predict_proba"
+        )[:, 1]
+        self.low, self.high = confidence_band(
+            self.cv_probabilities, labels, self.target_accuracy
+        )
+        self.pipeline = make_classifier().fit(texts, labels)
+        return self
+
+    def probabilities(self, df):
+        return self.pipeline.predict_proba(issue_texts(df))[:, 1]
+
+    def labels(self, probabilities, index=None):
+        """
+        Return the automatic labels of issues with the given probabilities,
+        "yes", "no" or None when uncertain.
+        """
+        labels = np.where(
+            probabilities >= self.high,
+            "yes",
+            np.where(probabilities <= self.low, "no", None),
+        )
+        return pd.Series(labels, index=index, dtype=object)
+
+    def predict(self, df):
+        return self.labels(self.probabilities(df), df.index)
+
+    def save(self, path):
+        # Save plain values rather than the object, which would be pickled as
+        # __main__.PrescreenClassifier when this script is run
+        joblib.dump(
+            {
+                "target_accuracy": self.target_accuracy,
+                "folds": self.folds,
+                "pipeline": self.pipeline,
+                "low": self.low,
+                "high": self.high,
+            },
+            path,
+        )
+
+    @staticmethod
+    def load(path):
+        saved = joblib.load(path)
+        classifier = PrescreenClassifier(saved["target_accuracy"], saved["folds"])
+        classifier.pipeline = saved["pipeline"]
+        classifier.low, classifier.high = saved["low"], saved["high"]
+        return classifier
+
+
+def report_prescreen(classifier, df):
+    """
+    Print the share of the labelled issues the pre-screen would label, and the
+    metrics of its labels and of the combined pipeline on cross-validated
+    probabilities. The combined pipeline needs the LLM labels of the remaining
+    issues in a "gpt_prediction" column.
+    """
+    # Imported here, as it needs the OpenAI client
+    from analyze_gpt_predictions import calculate_metrics
+
+    df = df.assign(
+        prescreen_label=classifier.labels(classifier.cv_probabilities, df.index)
+    )
+    labelled = df["prescreen_label"].notna()
+    print(
+        f"Confidence band: ({classifier.low:.3f}, {classifier.high:.3f}); "
+        f"{labelled.sum()} of {len(df)} issues ({labelled.mean():.1%}) "
+        "labelled without the LLM"
+    )
+    if labelled.any():
+        print("Pre-screen labels:")
+        calculate_metrics(df[labelled], "prescreen_label")
+    if "gpt_prediction" in df:
+        df["prediction"] = df["prescreen_label"].fillna(df["gpt_prediction"])
+        print("Combined pipeline:")
+        calculate_metrics(df.dropna(subset=["prediction"]), "prediction")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the issue pre-screen")
+    parser.add_argument(
+        "--input",
+        default="ctsm_issues_labelled.csv",
+        help="issues with impacts_science labels",
+    )
+    parser.add_argument("--model", default="prescreen.joblib")
+    parser.add_argument(
+        "--target-accuracy",
+        type=float,
+        default=0.95,
+        help="accuracy required of the automatic labels",
+    )
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.input).dropna(subset=["impacts_science"])
+    classifier = PrescreenClassifier(args.target_accuracy).fit(df)
+    classifier.save(args.model)
+    report_prescreen(classifier, df)
@@ -0,0 +1,211 @@
+import re
+import numpy as np
+
+# Parts of an issue description that cost many tokens but say little about
+# what the issue is about
+HTML_COMMENT = re.compile(r"<!--.*?(?:-->|\Z)", re.S)
+FENCED_BLOCK = re.compile(
+    r"^ {0,3}(```|~~~)[^\n]*\n.*?(?:^ {0,3}\1[^\n]*$|\Z)", re.M | re.S
+)
+QUOTE_LINE = re.compile(r"\s*>")
+LOG_LINE = re.compile(
+    r"\d\d:\d\d:\d\d"  # timestamps
+    r"|^\s*(?:Traceback \(|File \"[^\"]*\", line \d|at [\w$.<>]+\(|#\d+\s+0x)"
+    r"|^\s*(?:forrtl|MPT|MPI_ABORT|ERROR|WARNING|FATAL|Abort|Image\s+PC)\b"
+    r"|^\s*\d+\s*:\s*\S"  # rank-prefixed output
+    r"|(?:^|\s)(?:/[\w.+-]+){3,}"  # long paths
+)
+CODE_LINE = re.compile(
+    r"(?: {4}|\t)(?![-*+] )\S"  # indented code, but not nested list items
+    r"|\s*&\w+\s*$|\s*/\s*$"  # namelist groups
+    r"|\s*[\w%()]+\s*=\s*\S"  # assignments and namelist entries
+)
+
+# Blocks shorter than this stay in the text, longer ones are collapsed
+MIN_BLOCK_LINES = 3
+# Lines kept at the start and at the end of a collapsed block
+EXCERPT_HEAD = 2
+EXCERPT_TAIL = 2
+
+# Character classes of the token approximation: space, letter, digit and symbol.
+# Characters beyond ASCII count as letters.
+SPACE, LETTER, DIGIT, SYMBOL = range(4)
+CHARACTER_CLASSES = np.full(129, SYMBOL, dtype=np.uint8)
+CHARACTER_CLASSES[[ord(c) for c in " \t\n\r\f\v"]] = SPACE
+CHARACTER_CLASSES[ord("a") : ord("z") + 1] = LETTER
+CHARACTER_CLASSES[ord("A") : ord("Z") + 1] = LETTER
+CHARACTER_CLASSES[ord("0") : ord("9") + 1] = DIGIT
+CHARACTER_CLASSES[128] = LETTER
+
+
+# Function to find where the approximate tokens of a text start: every symbol,
+# and every 8 letters or 3 digits of a run of letters or digits
+def approximate_token_starts(text):
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    classes = CHARACTER_CLASSES[np.minimum(codes, 128)]
+    positions = np.arange(classes.size)
+    run_starts = np.ones(classes.size, dtype=bool)
+    run_starts[1:] = classes[1:] != classes[:-1]
+    offsets = positions - np.maximum.accumulate(np.where(run_starts, positions, 0))
+    starts = (
+        (classes == SYMBOL)
+        | ((classes == LETTER) & (offsets % 8 == 0))
+        | ((classes == DIGIT) & (offsets % 3 == 0))
+    )
+    return np.flatnonzero(starts)
+
+
+class Tokenizer:
+    """
+    Token counts of the tiktoken encoding of a model, or an approximation when
+    tiktoken is not installed. The approximation counts words of up to eight
+    letters, numbers of up to three digits and single symbols as tokens, which
+    is close to BPE counts on English text.
+    """
+
+    def __init__(self, model="gpt-4o"):
+        try:
+            import tiktoken
+        except ImportError:
+            self.encoding = None
+            return
+        try:
+            self.encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            self.encoding = tiktoken.get_encoding("o200k_base")
+
+    def count(self, text):
+        if self.encoding is not None:
+            return len(self.encoding.encode_ordinary(text))
+        return approximate_token_starts(text).size
+
+    def truncate(self, text, max_tokens):
+        """
+        Return the longest prefix of a text with at most `max_tokens` tokens.
+        """
+        if max_tokens <= 0:
+            return ""
+        if self.encoding is not None:
+            tokens = self.encoding.encode_ordinary(text)
+            if len(tokens) <= max_tokens:
+                return text
+            return self.encoding.decode(tokens[:max_tokens])
+        starts = approximate_token_starts(text)
+        if starts.size <= max_tokens:
+            return text
+        return text[: starts[max_tokens]].rstrip()
+
+
+# Function to classify a line of an issue description
+def line_kind(line):
+    if not line.strip():
+        return "blank"
+    if QUOTE_LINE.match(line):
+        return "quote"
+    if LOG_LINE.search(line):
+        return "log"
+    if CODE_LINE.match(line):
+        return "code"
+    stripped = line.strip()
+    # Tables, numbers and paths have few letters
+    if len(stripped) >= 20 and sum(c.isalpha() for c in stripped) < len(stripped) / 2:
+        return "log"
+    return "prose"
+
+
+def description_blocks(description):
+    """
+    Split a description into (kind, lines) blocks of consecutive prose, quote,
+    log or code lines. Fenced code blocks are one block each, and blank lines
+    belong to the block around them.
+    """
+    description = HTML_COMMENT.sub("", description.replace("\r\n", "\n"))
+    blocks = []
+    position = 0
+    for fenced in [*FENCED_BLOCK.finditer(description), None]:
+        end = fenced.start() if fenced else len(description)
+        for line in description[position:end].split("\n"):
+            kind = line_kind(line)
+            if kind == "blank":
+                if blocks:
+                    blocks[-1][1].append(line)
+                continue
+            if not blocks or blocks[-1][0] != kind:
+                blocks.append((kind, []))
+            blocks[-1][1].append(line)
+        if fenced:
+            lines = fenced.group().split("\n")[1:]
+            if lines and lines[-1].strip() in ("```", "~~~"):
+                lines.pop()
+            # Fenced blocks are never merged with a neighbour
+            blocks.append(("fenced", lines))
+            blocks.append(("blank", []))
+            position = fenced.end()
+    return [(kind, lines) for kind, lines in blocks if kind != "blank"]
+
+
+def compaction_pieces(description):
+    """
+    Return the (priority, text) pieces of a compacted description. Prose and the
+    markers of collapsed blocks have priority 0, the excerpts kept of collapsed
+    log and code blocks priority 1, and quoted replies are dropped.
+    """
+    pieces = []
+    for kind, lines in description_blocks(description):
+        lines = [line for line in lines if line.strip()]
+        if kind == "quote":
+            pieces.append((0, "[quoted text]"))
+        elif kind == "prose" or (kind != "fenced" and len(lines) < MIN_BLOCK_LINES):
+            pieces.append((0, "\n".join(lines)))
+        elif lines:
+            kind = "code" if kind == "fenced" else kind
+            pieces.append((0, f"[{kind}: {len(lines)} lines]"))
+            if len(lines) > EXCERPT_HEAD + EXCERPT_TAIL:
+                lines = lines[:EXCERPT_HEAD] + ["..."] + lines[-EXCERPT_TAIL:]
+            pieces.append((1, "\n".join(lines)))
+    return pieces
+
+
+def compact_description(description, token_budget, tokenizer, normalize):
+    """
+    Return a description compacted to at most `token_budget` tokens after
+    `normalize`. Long code blocks, logs and namelists are collapsed to a marker
+    and a few of their lines, and quoted replies are dropped. Above the budget,
+    the excerpts are dropped from the last one backwards, and then the text is
+    truncated at its end.
+    """
+    if not isinstance(description, str):
+        return normalize(description)
+    pieces = [
+        [priority, normalize(text)] for priority, text in compaction_pieces(description)
+    ]
+    pieces = [piece for piece in pieces if piece[1]]
+    counts = [tokenizer.count(text) for _, text in pieces]
+    total = sum(counts)
+    for index in range(len(pieces) - 1, -1, -1):
+        if total <= token_budget:
+            break
+        if pieces[index][0] > 0:
+            total -= counts[index]
+            pieces[index][1] = ""
+    text = " ".join(text for _, text in pieces if text)
+    # Joining may merge tokens, so check the joined text
+    return tokenizer.truncate(text, token_budget)
+
+
+def compact_descriptions(descriptions, token_budget, tokenizer, normalize):
+    """
+    Compact a sequence of descriptions and return them with the token count of
+    each one before (only normalized) and after compaction.
+    """
+    compacted = []
+    before = np.zeros(len(descriptions), dtype=np.int64)
+    after = np.zeros(len(descriptions), dtype=np.int64)
+    for index, description in enumerate(descriptions):
+        text = normalize(description)
+        before[index] = tokenizer.count(text)
+        if token_budget is not None and before[index] > 0:
+            text = compact_description(description, token_budget, tokenizer, normalize)
+        compacted.append(text)
+        after[index] = tokenizer.count(text)
+    return compacted, before, after
@@ -0,0 +1,53 @@
+import sqlite3
+
+
+class ResponseCache:
+    """
+    Persistent cache of LLM responses keyed by the content hash of their request
+    payload, so a payload that was answered once is never submitted again.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                payload_hash TEXT PRIMARY KEY,
+                content TEXT NOT NULL
+            )
+            """)
+        self.connection.commit()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def contents(self, payload_hashes):
+        """
+        Return a dict of the cached response content of each known payload hash.
+        """
+        payload_hashes = list(set(payload_hashes))
+        found = {}
+        # Stay below SQLite's limit on the number of query parameters
+        for start in range(0, len(payload_hashes), 500):
+            batch = payload_hashes[start : start + 500]
+            found.update(
+                self.connection.execute(
+                    "SELECT payload_hash, content FROM responses "
+                    f"WHERE payload_hash IN ({','.join('?' * len(batch))})",
+                    batch,
+                )
+            )
+        return found
+
+    def save(self, responses):
+        """
+        Store (payload hash, content) pairs, replacing earlier responses.
+        """
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?)", responses
+            )
+
+    def close(self):
+        self.connection.close()
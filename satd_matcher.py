@@ -0,0 +1,147 @@
+import re
+
+# A keyword made of plain words separated by single spaces is matched literally
+LITERAL_KEYWORD = re.compile(r"\w+( \w+)*")
+WORD = re.compile(r"\w+")
+
+
+def load_keywords(features_file):
+    """
+    Load the SATD keywords, one per line, dropping the trailing commas of the
+    features file and blank lines.
+    """
+    with open(features_file, "r") as file:
+        keywords = [line.strip() for line in file.readlines()]
+    return [keyword.rstrip(",").strip() for keyword in keywords if keyword.strip()]
+
+
+def reference_contains_keyword(comment, keywords):
+    """
+    Reference implementation: search each keyword as a regex between word
+    boundaries. The matcher must give exactly the same results.
+    """
+    for keyword in keywords:
+        if re.search(rf"\b{keyword}\b", comment):
+            return True
+    return False
+
+
+# Function to split a comment into runs of words separated by single spaces. A
+# literal keyword between word boundaries can only match inside one such run.
+def word_runs(comment):
+    run = []
+    position = 0
+    for match in WORD.finditer(comment):
+        if run and comment[position : match.start()] != " ":
+            yield run
+            run = []
+        run.append(match.group())
+        position = match.end()
+    if run:
+        yield run
+
+
+class KeywordMatcher:
+    """
+    Match all SATD keywords against a comment in a single pass.
+
+    Literal keywords are compiled into a word-level Aho-Corasick automaton, so a
+    comment costs one transition per word whatever the number of keywords. The
+    regex-style keywords (e.g. `xx[x]+:` or `not [\\w\\s]*good`) are combined into
+    one alternation between word boundaries.
+    """
+
+    def __init__(self, keywords):
+        self.keywords = list(keywords)
+        self.literal_keywords = [
+            k for k in self.keywords if LITERAL_KEYWORD.fullmatch(k)
+        ]
+        self.regex_keywords = [
+            k for k in self.keywords if not LITERAL_KEYWORD.fullmatch(k)
+        ]
+
+        # Automaton: goto transitions per state, failure links and the keywords
+        # recognised in each state (including those reached via failure links)
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for keyword in self.literal_keywords:
+            state = 0
+            for word in keyword.split(" "):
+                if word not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][word] = len(self.goto) - 1
+                state = self.goto[state][word]
+            self.output[state].append(keyword)
+        self._build_failure_links()
+
+        self.combined_regex = (
+            re.compile(
+                r"\b(?:" + "|".join(f"(?:{k})" for k in self.regex_keywords) + r")\b"
+            )
+            if self.regex_keywords
+            else None
+        )
+        self.keyword_regexes = [
+            (keyword, re.compile(rf"\b{keyword}\b")) for keyword in self.regex_keywords
+        ]
+
+    def _build_failure_links(self):
+        queue = list(self.goto[0].values())
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for word, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and word not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(word, 0)
+                self.fail[next_state] = target if target != next_state else 0
+                self.output[next_state].extend(self.output[self.fail[next_state]])
+
+    def _literal_matches(self, comment, first_only):
+        goto, fail, output = self.goto, self.fail, self.output
+        matches = []
+        for run in word_runs(comment):
+            state = 0
+            for word in run:
+                while state and word not in goto[state]:
+                    state = fail[state]
+                state = goto[state].get(word, 0)
+                if output[state]:
+                    if first_only:
+                        return output[state][:1]
+                    matches.extend(output[state])
+        return matches
+
+    def contains_keyword(self, comment):
+        """
+        Return True if any keyword occurs in the comment.
+        """
+        if self._literal_matches(comment, first_only=True):
+            return True
+        return bool(self.combined_regex and self.combined_regex.search(comment))
+
+    def find_keywords(self, comment):
+        """
+        Return the keywords occurring in the comment, in feature-file order.
+        """
+        found = set(self._literal_matches(comment, first_only=False))
+        if self.combined_regex and self.combined_regex.search(comment):
+            found.update(
+                keyword
+                for keyword, regex in self.keyword_regexes
+                if regex.search(comment)
+            )
+        return [keyword for keyword in self.keywords if keyword in found]
+
+    def match_series(self, comments):
+        """
+        Return a boolean mask of the comments in a Series that contain a keyword.
+        """
+        contains_keyword = self.contains_keyword
+        return comments.map(contains_keyword).astype(bool)
@@ -1,9 +1,35 @@
 import os
 import re
 import json
+import argparse
+import hashlib
+import numpy as np
+import openai
 import pandas as pd
-from tqdm import tqdm
 from openai import OpenAI
+from prescreen import PrescreenClassifier
+from prompt_compaction import Tokenizer, compact_descriptions
+from response_cache import ResponseCache
+
+# Model and instructions of the labelling requests
+MODEL = "gpt-4o"
+MAX_TOKENS = 500
+SYSTEM_MESSAGE = (
+    "You are a highly experienced research software engineer with expertise in the Community Earth System Model (CESM). "
+    "Your task is to evaluate the provided title and description of a GitHub issue to determine if the issue pertains to a scientific matter "
+    "or something else. This includes identifying whether the issue involves scientific algorithms, models, data processing methods, or other components "
+    "that directly influence scientific results. "
+    "If the issue is about a scientific matter, respond with 'yes'. "
+    "If the issue is about something else, respond with 'no'. "
+    "Please provide your response only in JSON format with a single key 'impacts_science' and its value as either 'yes' or 'no'."
+)
+
+# Tokens allowed for the compacted description of an issue, None to send it whole
+DESCRIPTION_TOKEN_BUDGET = 512
+
+# Limits of a single batch input file
+BATCH_MAX_REQUESTS = 50_000
+BATCH_MAX_BYTES = 200_000_000
 
 
 def initialize_openai_client():
@@ -31,82 +57,249 @@ def preprocess_description(description):
     return description
 
 
-def write_requests_to_jsonl(filtered_df, jsonl_file):
-    """
-    Write the processed issues to a JSONL file for batch processing.
-    """
-    with open(jsonl_file, "w") as file:
-        for index, row in tqdm(
-            filtered_df.iterrows(), total=filtered_df.shape[0], desc="Writing JSONL"
-        ):
-            custom_id = row["Custom_ID"]
-            title = row["title"]
-            description = row["processed_description"]
-
-            system_message = (
-                "You are a highly experienced research software engineer with expertise in the Community Earth System Model (CESM). "
-                "Your task is to evaluate the provided title and description of a GitHub issue to determine if the issue pertains to a scientific matter "
-                "or something else. This includes identifying whether the issue involves scientific algorithms, models, data processing methods, or other components "
-                "that directly influence scientific results. "
-                "If the issue is about a scientific matter, respond with 'yes'. "
-                "If the issue is about something else, respond with 'no'. "
-                "Please provide your response only in JSON format with a single key 'impacts_science' and its value as either 'yes' or 'no'."
-            )
-            user_message = f"Title: {title}\nDescription: {description}"
-
-            json_object = {
-                "custom_id": custom_id,
-                "method": "POST",
-                "url": "/v1/chat/completions",
-                "body": {
-                    "model": "gpt-4o",
-                    "response_format": {"type": "json_object"},
-                    "messages": [
-                        {"role": "system", "content": system_message},
-                        {"role": "user", "content": user_message},
-                    ],
-                    "max_tokens": 500,
-                },
-            }
-
-            json.dump(json_object, file)
-            file.write("\n")
-
-
-def process_issues_and_save_predictions(input_csv, output_csv):
-    """
-    Process issues from the input CSV file, get GPT predictions, and save the results to the output CSV file.
+def request_template(model=MODEL, system_message=SYSTEM_MESSAGE, max_tokens=MAX_TOKENS):
+    """
+    Return the JSON line of a batch request split around its custom ID and its
+    user message, so that requests are assembled by concatenation.
+    """
+    request = {
+        "custom_id": "\0",
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": model,
+            "response_format": {"type": "json_object"},
+            "messages": [
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": "\0"},
+            ],
+            "max_tokens": max_tokens,
+        },
+    }
+    return json.dumps(request).split(json.dumps("\0"))
+
+
+def payload_hashes(
+    df,
+    model=MODEL,
+    system_message=SYSTEM_MESSAGE,
+    max_tokens=MAX_TOKENS,
+    token_budget=DESCRIPTION_TOKEN_BUDGET,
+):
+    """
+    Return the content hash of each issue's request payload, which covers the
+    model, the prompt and the issue text, together with the JSON-encoded user
+    messages and the description tokens of each issue before and after
+    compaction to the token budget.
+    """
+    middle, suffix = request_template(model, system_message, max_tokens)[1:]
+    descriptions, tokens_before, tokens_after = compact_descriptions(
+        df["body"].tolist(), token_budget, Tokenizer(model), preprocess_description
+    )
+    user_messages = "Title: " + df["title"].astype(str) + "\nDescription: "
+    encoded = [
+        json.dumps(message + description)
+        for message, description in zip(user_messages, descriptions)
+    ]
+    body_hash = hashlib.blake2b(middle.encode("utf-8"), digest_size=16)
+    hashes = []
+    for message in encoded:
+        payload_hash = body_hash.copy()
+        payload_hash.update((message + suffix).encode("utf-8"))
+        hashes.append(payload_hash.hexdigest())
+    return hashes, encoded, tokens_before, tokens_after
+
+
+def build_requests(
+    df,
+    cache=None,
+    requested=None,
+    model=MODEL,
+    system_message=SYSTEM_MESSAGE,
+    max_tokens=MAX_TOKENS,
+    token_budget=DESCRIPTION_TOKEN_BUDGET,
+):
+    """
+    Add the payload hash and the description tokens before and after compaction
+    of each issue to the DataFrame and return it with the batch request lines to
+    submit. Identical payloads are requested once and payloads already in the
+    response cache not at all, nor those of issues that the boolean Series
+    `requested` excludes. The payload hash is used as custom ID.
+    """
+    hashes, encoded, tokens_before, tokens_after = payload_hashes(
+        df, model, system_message, max_tokens, token_budget
+    )
+    df = df.assign(
+        Payload_Hash=hashes,
+        Description_Tokens=tokens_before,
+        Compacted_Tokens=tokens_after,
+    )
+    pending = ~df["Payload_Hash"].duplicated()
+    if requested is not None:
+        pending = ~df["Payload_Hash"].where(requested).duplicated() & requested
+    if cache is not None:
+        pending &= ~df["Payload_Hash"].isin(cache.contents(hashes).keys())
+
+    prefix, middle, suffix = request_template(model, system_message, max_tokens)
+    lines = [
+        f'{prefix}"{payload_hash}"{middle}{message}{suffix}'
+        for payload_hash, message, is_pending in zip(hashes, encoded, pending)
+        if is_pending
+    ]
+    return df, lines
+
+
+def shard_requests(lines, max_requests=BATCH_MAX_REQUESTS, max_bytes=BATCH_MAX_BYTES):
+    """
+    Split request lines into consecutive shards that stay within the request
+    count and byte limits of a batch, and return the (start, end) of each shard.
+    """
+    sizes = np.fromiter(
+        (len(line.encode("utf-8")) + 1 for line in lines),
+        dtype=np.int64,
+        count=len(lines),
+    )
+    if sizes.size and sizes.max() > max_bytes:
+        raise ValueError("A single request exceeds the batch size limit")
+    ends = np.cumsum(sizes)
+
+    shards = []
+    start = 0
+    while start < len(lines):
+        offset = ends[start - 1] if start else 0
+        end = int(np.searchsorted(ends, offset + max_bytes, side="right"))
+        end = min(end, start + max_requests)
+        shards.append((start, end))
+        start = end
+    return shards
+
+
+def write_requests_to_jsonl(
+    lines, jsonl_prefix, max_requests=BATCH_MAX_REQUESTS, max_bytes=BATCH_MAX_BYTES
+):
+    """
+    Write the request lines to as many JSONL batch files as the batch limits
+    require and return their names.
+    """
+    jsonl_files = []
+    for shard, (start, end) in enumerate(
+        shard_requests(lines, max_requests, max_bytes)
+    ):
+        jsonl_file = f"{jsonl_prefix}_{shard:03d}.jsonl"
+        with open(jsonl_file, "w", encoding="utf-8") as file:
+            file.write("\n".join(lines[start:end]) + "\n")
+        jsonl_files.append(jsonl_file)
+    return jsonl_files
+
+
+def process_issues_and_save_predictions(
+    input_csv,
+    manifest_csv,
+    cache_path="gpt_responses.sqlite",
+    jsonl_prefix="batch_requests",
+    batch_ids_file="batch_ids.txt",
+    prescreen_model=None,
+    submit=True,
+):
+    """
+    Build the batch requests of the issues in the input CSV file that have no cached
+    response and submit them. The issues are saved with their payload hashes to
+    the manifest CSV file, and the IDs of the submitted batches are appended to
+    the batch IDs file. With a pre-screen model, the issues it labels are saved
+    with their label in the manifest instead of being requested. Without
+    `submit`, the request files are only written. Returns their names.
     """
     df = pd.read_csv(input_csv)
-    df["processed_description"] = df["body"].apply(preprocess_description)
 
-    write_requests_to_jsonl(df, "requests.jsonl")
+    requested = None
+    if prescreen_model is not None:
+        df["prescreen_label"] = PrescreenClassifier.load(prescreen_model).predict(df)
+        requested = df["prescreen_label"].isna()
+        print(f"{(~requested).sum()} issues labelled by the pre-screen")
+
+    cache = ResponseCache(cache_path)
+    df, lines = build_requests(df, cache, requested)
+    cache.close()
+    df.to_csv(manifest_csv, index=False)
+    before = df["Description_Tokens"].sum()
+    after = df["Compacted_Tokens"].sum()
+    print(
+        f"Description tokens: {before} before, {after} after compaction "
+        f"({1 - after / max(before, 1):.1%} fewer), "
+        f"{(df['Compacted_Tokens'] < df['Description_Tokens']).sum()} issues compacted"
+    )
+    print(
+        f"{len(df)} issues, {df['Payload_Hash'].nunique()} distinct payloads, "
+        f"{len(lines)} to request"
+    )
+    if submit:
+        # The batch IDs file exists after every run, empty if nothing was submitted
+        open(batch_ids_file, "a").close()
+    if not lines:
+        return []
+
+    jsonl_files = write_requests_to_jsonl(lines, jsonl_prefix)
+    if not submit:
+        return jsonl_files
 
+    initialize_openai_client()
     client = OpenAI(organization="org-t0BfEZys25Afw0bMxsVMwPDD")
 
-    with open("requests.jsonl", "rb") as jsonl_file:
-        batch_input_file = client.files.create(file=jsonl_file, purpose="batch")
+    for jsonl_file in jsonl_files:
+        with open(jsonl_file, "rb") as file:
+            batch_input_file = client.files.create(file=file, purpose="batch")
 
-    batch_input_file_id = batch_input_file.id
+        batch_input_file_id = batch_input_file.id
 
-    response = client.batches.create(
-        input_file_id=batch_input_file_id,
-        endpoint="/v1/chat/completions",
-        completion_window="24h",
-        metadata={"description": "PR patches labelling job"},
-    )
+        response = client.batches.create(
+            input_file_id=batch_input_file_id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+            metadata={"description": "PR patches labelling job"},
+        )
 
-    print(f"Batch process initiated with ID: {response.id}")
+        print(f"Batch process initiated with ID: {response.id}")
+        with open(batch_ids_file, "a") as file:
+            file.write(response.id + "\n")
+    return jsonl_files
 
 
 # Main function to run the script
 def main():
-    initialize_openai_client()
+    parser = argparse.ArgumentParser(description="Submit issue labelling batches")
+    parser.add_argument("--input", default="closed_issues.csv", help="issues to label")
+    parser.add_argument(
+        "--manifest",
+        default="requests_manifest.csv",
+        help="output of the issues with their payload hashes",
+    )
+    parser.add_argument("--cache", default="gpt_responses.sqlite")
+    parser.add_argument("--requests-prefix", default="batch_requests")
+    parser.add_argument("--batch-ids", default="batch_ids.txt")
+    parser.add_argument(
+        "--prescreen",
+        help="pre-screen trained by prescreen.py (default: prescreen.joblib if present)",
+    )
+    parser.add_argument(
+        "--no-submit",
+        action="store_true",
+        help="only write the batch request files",
+    )
+    args = parser.parse_args()
 
-    input_csv = "closed_issues.csv"  # Input CSV file with issues
-    output_csv = "issues_with_predictions.csv"  # Output CSV file with predictions
+    prescreen_model = args.prescreen
+    if prescreen_model is None and os.path.exists("prescreen.joblib"):
+        prescreen_model = "prescreen.joblib"
 
-    process_issues_and_save_predictions(input_csv, output_csv)
+    process_issues_and_save_predictions(
+        args.input,
+        args.manifest,
+        args.cache,
+        args.requests_prefix,
+        args.batch_ids,
+        prescreen_model,
+        submit=not args.no_submit,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,291 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from scipy.stats import chi2, norm
+from analysis_data import AnalysisData
+from comment_lineage import merge_lineages
+from comment_output import load_comments
+
+
+def lifetimes(introduced, removed, end=None, unit="D"):
+    """
+    Return the lifetimes of comments in whole `unit`s and whether their removal
+    was observed. Comments that are still present are right-censored at `end`,
+    by default the latest introduction or removal, and so are comments removed
+    before their introduction, which were re-introduced after that removal.
+    Comments without an introduction date get a NaN lifetime.
+    """
+    introduced = pd.to_datetime(pd.Series(introduced), utc=True)
+    removed = pd.to_datetime(pd.Series(removed), utc=True)
+    if end is None:
+        end = max(introduced.max(), removed.max())
+    end = pd.Timestamp(end)
+    end = end.tz_localize("UTC") if end.tzinfo is None else end.tz_convert("UTC")
+    # Removals after the end of the study were not yet seen at its end. A
+    # removal before the introduction is that of an earlier life of a comment
+    # that was added again and is still present.
+    observed = ((removed <= end) & (removed >= introduced)).to_numpy()
+    exits = removed.where(observed, end)
+    # Whole units keep the number of distinct times, and so the size of the
+    # log-rank matrices, bounded by the length of the study
+    durations = (exits - introduced) // pd.Timedelta(1, unit)
+    durations = durations.to_numpy(dtype=np.float64, na_value=np.nan)
+    # Comments dated after the end of the study are censored at no lifetime
+    return np.where(durations < 0, 0.0, durations), observed
+
+
+# Function to sort lifetimes by group and duration, dropping unknown lifetimes
+def sorted_lifetimes(durations, events, groups):
+    durations = np.asarray(durations, dtype=np.float64)
+    events = np.asarray(events, dtype=bool)
+    if groups is None:
+        groups = np.full(durations.size, "all", dtype=object)
+    groups = pd.Series(groups)
+    known = ~np.isnan(durations) & groups.notna().to_numpy()
+    codes, labels = pd.factorize(groups[known], sort=True)
+    durations, events = durations[known], events[known]
+    order = np.lexsort((durations, codes))
+    return durations[order], events[order], codes[order], labels
+
+
+def kaplan_meier(durations, events, groups=None, confidence=0.95):
+    """
+    Return the Kaplan-Meier survival curve of each group, with a row per group
+    and distinct lifetime: the number at risk, removals and censored comments at
+    that time, the survival probability after it and its pointwise confidence
+    interval (Greenwood variance, log-log transformed).
+
+    All groups are computed at once over a single sort of the lifetimes: each
+    (group, time) step is a run of the sorted array, and the products and sums
+    of the estimator are cumulative sums restarted at each group.
+    """
+    durations, events, codes, labels = sorted_lifetimes(durations, events, groups)
+    n = durations.size
+
+    # First row of each (group, time) step, and of each group
+    new_step = np.ones(n, dtype=bool)
+    new_step[1:] = (codes[1:] != codes[:-1]) | (durations[1:] != durations[:-1])
+    steps = np.flatnonzero(new_step)
+    new_group = np.ones(n, dtype=bool)
+    new_group[1:] = codes[1:] != codes[:-1]
+    group_starts = np.flatnonzero(new_group)
+    group_ends = np.append(group_starts[1:], n)
+
+    step_codes = codes[steps]
+    group_of_step = np.searchsorted(group_starts, steps, side="right") - 1
+    at_risk = group_ends[group_of_step] - steps
+    removed = np.add.reduceat(events.astype(np.int64), steps) if n else steps
+    censored = np.diff(np.append(steps, n)) - removed
+
+    # Survival is the product of (1 - d/n) within the group. It is accumulated
+    # in logs, with steps that remove every comment at risk counted apart.
+    ratio = removed / at_risk
+    emptied = ratio >= 1
+    log_factors = np.log1p(-np.where(emptied, 0, ratio))
+    first_step = np.searchsorted(steps, group_starts)
+
+    def group_cumsum(values):
+        totals = np.cumsum(values)
+        offsets = np.concatenate([[0], totals])[first_step]
+        return totals - offsets[group_of_step]
+
+    survival = np.exp(group_cumsum(log_factors))
+    survival[group_cumsum(emptied) > 0] = 0.0
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        greenwood = group_cumsum(
+            np.where(emptied, 0, removed / (at_risk * (at_risk - removed)))
+        )
+        log_survival = np.log(survival)
+        z = norm.ppf(0.5 + confidence / 2)
+        spread = z * np.sqrt(greenwood) / np.abs(log_survival)
+        ci_low = np.exp(-np.exp(np.log(-log_survival) + spread))
+        ci_high = np.exp(-np.exp(np.log(-log_survival) - spread))
+    # Before the first removal the curve is exactly 1, after the last at 0
+    ci_low = np.where(survival >= 1, 1.0, np.where(survival <= 0, 0.0, ci_low))
+    ci_high = np.where(survival >= 1, 1.0, np.where(survival <= 0, 0.0, ci_high))
+
+    return pd.DataFrame(
+        {
+            "group": labels.take(step_codes),
+            "time": durations[steps],
+            "at_risk": at_risk,
+            "removed": removed,
+            "censored": censored,
+            "survival": survival,
+            "ci_low": ci_low,
+            "ci_high": ci_high,
+        }
+    )
+
+
+def median_lifetimes(curves):
+    """
+    Return the number of comments, removals and the median lifetime of each
+    group of Kaplan-Meier curves, with the confidence interval of the median
+    (the times the interval of the curve crosses 0.5). Medians are NaN where
+    the curve never drops to 0.5.
+    """
+    groups = curves["group"].to_numpy()
+    new_group = np.ones(len(curves), dtype=bool)
+    new_group[1:] = groups[1:] != groups[:-1]
+    starts = np.flatnonzero(new_group)
+    times = curves["time"].to_numpy()
+
+    def first_time_below(column):
+        # The first row at or below 0.5 of each group, by a reduction over rows
+        rows = np.where(curves[column].to_numpy() <= 0.5, np.arange(len(curves)), -1)
+        rows = np.where(rows < 0, len(curves), rows)
+        first = np.minimum.reduceat(rows, starts) if len(curves) else starts
+        return np.where(
+            first < np.append(starts[1:], len(curves)),
+            times[np.minimum(first, len(curves) - 1)],
+            np.nan,
+        )
+
+    return pd.DataFrame(
+        {
+            "comments": np.add.reduceat(
+                (curves["removed"] + curves["censored"]).to_numpy(), starts
+            ),
+            "removed": np.add.reduceat(curves["removed"].to_numpy(), starts),
+            "median": first_time_below("survival"),
+            "ci_low": first_time_below("ci_low"),
+            "ci_high": first_time_below("ci_high"),
+        },
+        index=pd.Index(groups[starts], name="group"),
+    )
+
+
+def logrank_test(durations, events, groups):
+    """
+    Return the log-rank test that all groups have the same survival: a table of
+    the observed and expected removals of each group, the chi-squared statistic,
+    its degrees of freedom and p-value.
+
+    The number of each group at risk at each removal time comes from one
+    search of the sorted lifetimes, giving (groups, removal times) matrices
+    that the statistic and its covariance are reductions of. Their size grows
+    with the number of distinct removal times, which `lifetimes` bounds.
+    """
+    durations, events, codes, labels = sorted_lifetimes(durations, events, groups)
+    k = len(labels)
+    times = np.unique(durations[events])
+
+    # Key (group, time) pairs into one sorted array: groups are spaced further
+    # apart than the longest lifetime
+    span = (durations.max() - min(durations.min(), 0) + 1) if durations.size else 1
+    keys = codes * span + durations
+    group_sizes = np.bincount(codes, minlength=k)
+    group_starts = np.concatenate([[0], np.cumsum(group_sizes)[:-1]])
+    grid = np.arange(k)[:, None] * span + times[None, :]
+    at_risk = group_sizes[:, None] - (
+        np.searchsorted(keys, grid, side="left") - group_starts[:, None]
+    )
+    after = np.searchsorted(keys, grid, side="right")
+    event_counts = np.concatenate([[0], np.cumsum(events)])
+    removed = event_counts[after] - event_counts[np.searchsorted(keys, grid)]
+
+    total_at_risk = at_risk.sum(axis=0)
+    total_removed = removed.sum(axis=0)
+    share = at_risk / total_at_risk
+    observed = removed.sum(axis=1)
+    expected = (share * total_removed).sum(axis=1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weight = np.where(
+            total_at_risk > 1,
+            total_removed * (total_at_risk - total_removed) / (total_at_risk - 1),
+            0.0,
+        )
+    covariance = np.diag((share * weight).sum(axis=1)) - (share * weight) @ share.T
+    difference = observed - expected
+    # One group is determined by the others, so test on the first k - 1
+    statistic = (
+        float(difference[:-1] @ np.linalg.pinv(covariance[:-1, :-1]) @ difference[:-1])
+        if k > 1
+        else 0.0
+    )
+    table = pd.DataFrame(
+        {
+            "comments": group_sizes,
+            "observed": observed,
+            "expected": expected,
+        },
+        index=pd.Index(labels, name="group"),
+    )
+    return table, statistic, k - 1, float(chi2.sf(statistic, k - 1)) if k > 1 else 1.0
+
+
+# Function to give each comment one row per element of a comma separated column
+def explode_column(df, column):
+    values = df[column]
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.astype(values.cat.categories.dtype)
+    if pd.api.types.is_string_dtype(values):
+        values = values.astype(str).str.split(r"\s*,\s*")
+        return df.assign(**{column: values}).explode(column)
+    return df
+
+
+def survival_report(df, by=(), end=None, unit="D", confidence=0.95):
+    """
+    Print the median lifetimes and the log-rank test of comments grouped by
+    each column in `by`. Comments in several categories of a comma separated
+    column are counted in each of them.
+    """
+    durations, events = lifetimes(df["introduced"], df["removed"], end, unit)
+    df = df.assign(duration=durations, event=events)
+    with pd.option_context("display.float_format", "{:.1f}".format):
+        curves = kaplan_meier(df["duration"], df["event"], confidence=confidence)
+        print(f"All comments (lifetimes in {unit}):")
+        print(median_lifetimes(curves))
+        for column in by:
+            grouped = explode_column(df.dropna(subset=[column]), column)
+            curves = kaplan_meier(
+                grouped["duration"], grouped["event"], grouped[column], confidence
+            )
+            table, statistic, dof, p_value = logrank_test(
+                grouped["duration"], grouped["event"], grouped[column]
+            )
+            print(f"Per {column}:")
+            print(median_lifetimes(curves).join(table[["expected"]]))
+            print(f"Log-rank: chi2 = {statistic:.2f}, df = {dof}, p = {p_value:.4g}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Survival analysis of SATD")
+    parser.add_argument(
+        "--input", default="ssw_satd.csv", help="labelled or mined comments"
+    )
+    parser.add_argument(
+        "--by",
+        nargs="*",
+        default=["project", "category", "scientific_category"],
+        help="columns to compare lifetimes by, where present",
+    )
+    parser.add_argument(
+        "--end", help="date still present comments are censored at (default: last)"
+    )
+    parser.add_argument("--unit", default="D", help="unit of lifetimes, e.g. D or W")
+    parser.add_argument(
+        "--lineage",
+        help="lineage edges of the miner, to count each lineage as one comment",
+    )
+    args = parser.parse_args()
+
+    if args.input.endswith(".csv") and "category" in pd.read_csv(args.input, nrows=0):
+        # Labelled comments, cleaned as in the analysis notebook
+        df = AnalysisData(args.input, lineage=args.lineage).comments
+    else:
+        df = load_comments(args.input)
+        if args.lineage:
+            df = merge_lineages(df, pd.read_csv(args.lineage))
+        # Mined comments have capitalised column names
+        df.columns = [column.lower() for column in df.columns]
+    start_time = time.time()
+    survival_report(
+        df, [column for column in args.by if column in df], args.end, args.unit
+    )
+    print(f"Survival analysis computed in {time.time() - start_time:.2f} seconds")